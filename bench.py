@@ -0,0 +1,459 @@
+"""
+Benchmarks for PdfFormFiller.
+
+Run ``python bench.py`` to compare the filler's options on some generated
+pdfs, or ``python bench.py --suite`` to time a set of synthetic templates
+(throughput, peak memory and output size). Save the suite's results with
+``--save baseline.json`` and check for regressions (e.g. after upgrading
+PyPDF2 or reportlab) with ``--compare baseline.json``.
+
+Everything is generated offline with a fixed random seed, so results from
+different runs are comparable.
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tracemalloc
+from io import BytesIO
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.lib.pagesizes import letter, A4, legal
+from reportlab.lib.utils import ImageReader
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.pdfbase.ttfonts import TTFont
+import reportlab
+import PyPDF2
+
+from pdfformfiller import PdfFormFiller, PdfTemplate, FillStats, fill_many, Layout, check_fit
+from pdfformfiller.serialize import ConcatenatedWriter, SharedTemplateWriter
+from pdfformfiller.backends import BACKENDS, installed
+from pdfformfiller.fonts import FontSubsets, register_font
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua").split()
+
+PAGESIZES = {"letter": letter, "a4": A4, "legal": legal}
+
+SCENARIOS = {
+    "single": dict(pages=1, fields=10),
+    "long": dict(pages=200, fields=5),
+    "a4": dict(pages=10, pagesize="a4", fields=10),
+    "images": dict(pages=20, images=2, fields=5),
+    "dense": dict(pages=2, fields=200, textLength=12),
+    "overflow": dict(pages=10, fields=10, textLength=600),
+}
+"""
+Synthetic templates for the suite. Each one is generated by
+:func:`make_template` and filled with ``fields`` text fields per page of
+``textLength`` characters (``overflow`` has text far too long for its boxes,
+so it all has to shrink).
+"""
+
+# metrics where bigger is worse, compared against the baseline
+TIME_METRICS = ("parse", "construct", "add_text", "write", "batch")
+SIZE_METRICS = ("peak_memory", "output_size")
+
+# timings this close are just noise, whatever their ratio
+MIN_SECONDS = 0.001
+
+def make_image(size=256, seed=0):
+    "Generate a noisy (i.e. hard to compress) RGB image, or None without PIL"
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    rand = random.Random(seed)
+    data = bytes(bytearray(rand.getrandbits(8) for _ in range(size * size * 3)))
+    return ImageReader(Image.frombytes("RGB", (size, size), data))
+
+def make_template(pages=10, pagesize=letter, images=0, lines=40):
+    "Generate a pdf with some text (and optionally images) on each page"
+    packet = BytesIO()
+    canvas = Canvas(packet, pagesize=pagesize)
+    image = make_image() if images else None
+    for pagenum in range(pages):
+        canvas.setFont("Helvetica", 12)
+        for line in range(lines):
+            canvas.drawString(72, pagesize[1] - 72 - line * 15,
+                "Page {} line {} of the template".format(pagenum, line))
+        # the same image on every page, like a logo
+        for i in range(images if image else 0):
+            canvas.drawImage(image, pagesize[0] - 172, pagesize[1] - 172 - i * 110, 100, 100)
+        canvas.showPage()
+    canvas.save()
+    return packet.getvalue()
+
+def make_text(length, rand):
+    "Generate some words of (roughly) the given length"
+    words = []
+    size = 0
+    while size < length:
+        word = rand.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+def make_fields(template, fields_per_page, textLength=20, seed=0):
+    "Generate ``(text, pagenum, upperLeft, lowerRight)`` for each field"
+    rand = random.Random(seed)
+    fields = []
+    for pagenum in range(len(template)):
+        width, height = template.pageSizes[pagenum]
+        rows = max(fields_per_page, 1)
+        rowHeight = (height - 100) / float(rows)
+        for i in range(fields_per_page):
+            top = 50 + i * rowHeight
+            fields.append((make_text(textLength, rand), pagenum,
+                (50, top), (width - 50, top + rowHeight * 0.8)))
+    return fields
+
+def fill(template, fields_per_page=5, pages=None, incremental=False, streaming=False, **kwargs):
+    "Fill out every page (or the first few pages) of a template"
+    filler = PdfFormFiller(template, **kwargs)
+    for pagenum in range(len(template) if pages is None else pages):
+        for i in range(fields_per_page):
+            top = 50 + i * 60
+            filler.add_text("Joe Smith {}".format(i), pagenum, (50, top), (500, top + 50))
+    out = BytesIO()
+    filler.write(out, incremental=incremental, streaming=streaming)
+    return out.getvalue()
+
+def timeit(func, repeat=3):
+    "Best wall time of several runs"
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def peak_memory(func):
+    "Peak memory (in bytes) allocated by python while running func"
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def _add_fields(filler, fields):
+    for text, pagenum, upperLeft, lowerRight in fields:
+        filler.add_text(text, pagenum, upperLeft, lowerRight)
+
+def _batch_layout(filler, record):
+    _add_fields(filler, record)
+
+def bench_scenario(name, pages=10, pagesize="letter", images=0, fields=5, textLength=20,
+        repeat=3, records=20, workers=0, **kwargs):
+    """Time one synthetic template.
+
+    Returns:
+        dict: The scenario's parameters and its results: seconds to
+        ``parse`` the template, ``construct`` a filler from a parsed
+        template, ``add_text`` all the fields and ``write`` the pdf, seconds
+        per record of a ``batch`` of fills, ``throughput`` (records per
+        second), ``peak_memory`` of a single fill and ``output_size``.
+    """
+    data = make_template(pages, PAGESIZES[pagesize], images)
+    template = PdfTemplate(BytesIO(data))
+    fieldList = make_fields(template, fields, textLength)
+
+    def filled():
+        filler = PdfFormFiller(template, **kwargs)
+        _add_fields(filler, fieldList)
+        return filler
+
+    def write():
+        out = BytesIO()
+        filled().write(out)
+        return out.getvalue()
+
+    # time writing separately from adding the fields
+    filler = filled()
+    results = {
+        "parse": timeit(lambda: PdfTemplate(BytesIO(data)), repeat),
+        "construct": timeit(lambda: PdfFormFiller(template, **kwargs), repeat),
+        "add_text": timeit(filled, repeat),
+        "write": timeit(lambda: filler.write(BytesIO()), repeat),
+        "peak_memory": peak_memory(write),
+        "output_size": len(write()),
+    }
+    stats = fill_many(template, _batch_layout, [fieldList] * records, lambda *a: None,
+        workers=workers, **kwargs)
+    results["batch"] = stats.seconds / max(stats.count, 1)
+    results["throughput"] = stats.throughput
+    results["params"] = dict(pages=pages, pagesize=pagesize, images=images, fields=fields,
+        textLength=textLength, records=records, workers=workers)
+    results["template_size"] = len(data)
+    return results
+
+def run_suite(names=None, repeat=3, records=20, workers=0, out=sys.stdout):
+    """Run the benchmark suite.
+
+    Returns:
+        dict: Scenario name to the results of :func:`bench_scenario`
+    """
+    results = {}
+    for name in names or sorted(SCENARIOS):
+        result = results[name] = bench_scenario(name, repeat=repeat, records=records,
+            workers=workers, **SCENARIOS[name])
+        out.write("{:<10} write={:.4f}s add_text={:.4f}s batch={:.1f}/s "
+            "peak={:.1f}MB size={:.0f}KB\n".format(name, result["write"], result["add_text"],
+            result["throughput"], result["peak_memory"] / 1e6, result["output_size"] / 1e3))
+    return results
+
+def environment():
+    "Versions that the results depend on"
+    return {
+        "python": platform.python_version(),
+        "PyPDF2": getattr(PyPDF2, "__version__", "unknown"),
+        "reportlab": reportlab.Version,
+        "machine": platform.machine(),
+    }
+
+def save_baseline(results, path):
+    "Save suite results (and the environment) as a JSON baseline"
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2, sort_keys=True)
+
+def compare(results, baseline, tolerance=0.1, out=sys.stdout):
+    """Compare suite results to a baseline.
+
+    Args:
+        results (dict): Results of :func:`run_suite`
+        baseline (dict): A baseline saved by :func:`save_baseline`
+
+    Keyword Args:
+        tolerance (float): How much worse (as a fraction) a metric can be
+            before it counts as a regression
+
+    Returns:
+        list[tuple]: ``(scenario, metric, baseline, result)`` for each
+        regression
+    """
+    regressions = []
+    old = baseline["results"]
+    for name in sorted(results):
+        if name not in old:
+            continue
+        for metric in TIME_METRICS + SIZE_METRICS:
+            before, after = old[name].get(metric), results[name][metric]
+            if not before:
+                continue
+            ratio = after / float(before)
+            flag = ""
+            noise = metric in TIME_METRICS and after - before < MIN_SECONDS
+            if ratio > 1 + tolerance and not noise:
+                regressions.append((name, metric, before, after))
+                flag = "  REGRESSION"
+            out.write("{:<10} {:<12} {:>12.4g} -> {:<12.4g} {:.2f}x{}\n".format(
+                name, metric, before, after, ratio, flag))
+    if baseline.get("environment") != environment():
+        out.write("note: baseline environment differs: {}\n".format(baseline.get("environment")))
+    return regressions
+
+def bench_overlay(pages=200):
+    "Compare the per-page overlays to a single document overlay"
+    template = PdfTemplate(BytesIO(make_template(pages)))
+    results = {}
+    for mode in ("page", "document"):
+        results[mode] = timeit(lambda: fill(template, overlay=mode))
+        print("overlay={:<10} pages={:<5} {:.3f}s".format(mode, pages, results[mode]))
+    print("speedup: {:.2f}x".format(results["page"] / results["document"]))
+    return results
+
+def bench_engine(pages=200):
+    "Compare reportlab rendering to writing the content stream directly"
+    template = PdfTemplate(BytesIO(make_template(pages)))
+    results = {}
+    for engine in ("reportlab", "direct"):
+        results[engine] = timeit(lambda: fill(template, engine=engine))
+        print("engine={:<10} pages={:<5} {:.3f}s".format(engine, pages, results[engine]))
+    print("speedup: {:.2f}x".format(results["reportlab"] / results["direct"]))
+    return results
+
+def bench_incremental(pages=200):
+    "Compare rewriting the whole pdf to an incremental update of one page"
+    template = PdfTemplate(BytesIO(make_template(pages)))
+    for incremental in (False, True):
+        size = len(fill(template, pages=1, incremental=incremental))
+        elapsed = timeit(lambda: fill(template, pages=1, incremental=incremental))
+        print("incremental={:<6} pages={:<5} {:.3f}s {} bytes".format(
+            str(incremental), pages, elapsed, size))
+
+def bench_merge(pages=50):
+    "Compare the merge time of mergePage to appending, for plain and dense pages"
+    for lines in (40, 2000):
+        template = PdfTemplate(BytesIO(make_template(pages, lines=lines)))
+        for merge in ("parse", "append"):
+            stats = FillStats()
+            elapsed = timeit(lambda: fill(template, merge=merge, stats=stats))
+            print("merge={:<7} lines={:<5} pages={:<5} {:.3f}s merge {:.2f}ms/page".format(
+                merge, lines, pages, elapsed,
+                1000 * stats.seconds["merge"] / stats.counts["pages"]))
+
+def bench_compression(pages=200):
+    "Compare the output size and time of each compression option"
+    template = PdfTemplate(BytesIO(make_template(pages)))
+    results = {}
+    for compression in (None, "none", "fast", "max"):
+        for merge in ("parse", "append"):
+            # deterministic fills append the overlays instead of merging them
+            kwargs = dict(compression=compression, deterministic=(merge == "append"))
+            size = len(fill(template, **kwargs))
+            elapsed = timeit(lambda: fill(template, **kwargs))
+            results[(compression, merge)] = (elapsed, size)
+            print("compression={:<6} merge={:<7} pages={:<5} {:.3f}s {} bytes".format(
+                str(compression), merge, pages, elapsed, size))
+    return results
+
+def bench_streaming(pages=200):
+    "Compare the peak memory of a normal write to a streaming write"
+    data = make_template(pages)
+    for streaming in (False, True):
+        # a fresh template each time, so the parsed objects are counted too
+        func = lambda: fill(PdfTemplate(BytesIO(data), preload=False), streaming=streaming)
+        elapsed = timeit(func)
+        peak = peak_memory(func)
+        print("streaming={:<6} pages={:<5} {:.3f}s peak {:.1f}MB".format(
+            str(streaming), pages, elapsed, peak / 1e6))
+
+def bench_shared(records=200):
+    "Compare concatenating filled pdfs to sharing the template's pages, for a 2 page form"
+    template = PdfTemplate(BytesIO(make_template(2, images=1, lines=200)))
+    def combine(shared):
+        out = BytesIO()
+        writer = SharedTemplateWriter(out, template) if shared else ConcatenatedWriter(out)
+        for record in range(records):
+            filler = PdfFormFiller(template, merge="append")
+            for pagenum in range(2):
+                filler.add_text("Joe Smith {}".format(record), pagenum, (50, 50), (500, 100))
+            if shared:
+                writer.add(filler)
+            else:
+                pdf = BytesIO()
+                filler.write(pdf)
+                writer.add(pdf.getvalue())
+        writer.close()
+        return len(out.getvalue())
+    for shared in (False, True):
+        size = combine(shared)
+        elapsed = timeit(lambda: combine(shared))
+        print("shared={:<6} records={:<5} {:.3f}s {} bytes".format(
+            str(shared), records, elapsed, size))
+
+def bench_backends(pages=200):
+    "Compare the installed pdf backends on the same template"
+    data = make_template(pages)
+    for backend in BACKENDS:
+        if not installed(backend):
+            print("backend={:<8} not installed".format(backend))
+            continue
+        # a fresh template each time, so parsing it is counted too
+        cold = timeit(lambda: fill(PdfTemplate(BytesIO(data), preload=False, backend=backend),
+            pages=2))
+        template = PdfTemplate(BytesIO(data), backend=backend)
+        warm = timeit(lambda: fill(template))
+        print("backend={:<8} pages={:<5} open+fill 2 pages {:.3f}s, fill every page {:.3f}s".format(
+            backend, pages, cold, warm))
+
+def bench_fonts(records=200):
+    "Compare a combined batch in a TrueType font, with and without one shared subset"
+    vera = os.path.join(os.path.dirname(reportlab.__file__), "fonts", "Vera.ttf")
+    parsed = timeit(lambda: TTFont("Vera", vera), repeat=1)
+    cached = timeit(lambda: register_font("Vera", vera))
+    print("font parse {:.4f}s, registered again {:.6f}s".format(parsed, cached))
+    template = PdfTemplate(BytesIO(make_template(1)))
+    style = ParagraphStyle("vera", fontName="Vera", fontSize=12, leading=14)
+    def combine(shared):
+        subsets = FontSubsets() if shared else None
+        fillers = []
+        for record in range(records):
+            filler = PdfFormFiller(template, style=style, subsets=subsets, merge="append")
+            filler.add_text(u"J\xfcrgen {}".format(chr(0xc0 + record % 64)), 0,
+                (50, 50), (500, 100))
+            if shared:
+                subsets.add_filler(filler)
+            fillers.append(filler)
+        out = BytesIO()
+        writer = SharedTemplateWriter(out, template)
+        for filler in fillers:
+            writer.add(filler)
+        writer.close()
+        return len(out.getvalue())
+    for shared in (False, True):
+        size = combine(shared)
+        elapsed = timeit(lambda: combine(shared))
+        print("shared subset={:<6} records={:<5} {:.3f}s {} bytes".format(
+            str(shared), records, elapsed, size))
+
+def bench_check(records=200):
+    "Compare checking whether a batch's text fits to rendering it"
+    template = PdfTemplate(BytesIO(make_template(1)))
+    plan = Layout.from_dict({"fields": [
+        {"name": "name", "page": 0, "box": [[50, 50], [300, 80]]},
+        {"name": "address", "page": 0, "box": [[50, 100], [560, 130]]},
+        {"name": "notes", "page": 0, "box": [[50, 150], [560, 250]]},
+    ]}).compile(template)
+    rand = random.Random(0)
+    batch = [{"name": make_text(rand.randint(5, 25), rand),
+        "address": make_text(rand.randint(20, 50), rand),
+        "notes": make_text(rand.randint(50, 250), rand)} for _ in range(records)]
+    def render():
+        for record in batch:
+            plan.fill(record).write(BytesIO())
+    rendered = timeit(render, repeat=1)
+    checked = timeit(lambda: check_fit(plan, batch))
+    overflow = len(check_fit(plan, batch, onlyOverflow=True))
+    print("records={:<5} write {:.3f}s, check_fit {:.3f}s ({} fields don't fit)".format(
+        records, rendered, checked, overflow))
+    print("speedup: {:.2f}x".format(rendered / checked))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark PdfFormFiller")
+    parser.add_argument("pages", type=int, nargs="?", default=200,
+        help="number of pages for the option comparisons (default 200)")
+    parser.add_argument("--suite", action="store_true",
+        help="run the synthetic template suite instead of the comparisons")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+        help="only run this suite scenario (can be repeated)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per timing (best is kept)")
+    parser.add_argument("--records", type=int, default=20, help="records per batch")
+    parser.add_argument("--workers", type=int, default=0,
+        help="worker processes for batches (default 0, i.e. in process)")
+    parser.add_argument("--save", metavar="FILE", help="save the suite results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare the suite results to a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+        help="allowed slowdown before a metric counts as a regression (default 0.1)")
+    args = parser.parse_args(argv)
+
+    if not (args.suite or args.save or args.compare):
+        bench_overlay(args.pages)
+        bench_engine(args.pages)
+        bench_incremental(args.pages)
+        bench_merge(args.pages)
+        bench_compression(args.pages)
+        bench_streaming(args.pages)
+        bench_shared(args.pages)
+        bench_backends(args.pages)
+        bench_fonts(args.pages)
+        bench_check(args.pages)
+        return 0
+
+    results = run_suite(args.scenario, args.repeat, args.records, args.workers)
+    if args.save:
+        save_baseline(results, args.save)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("{} regression(s)".format(len(regressions)))
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,2 +1,14 @@
 from .pdfformfiller import PdfFormFiller
-__all__ = ["PdfFormFiller"]
+from .template import PdfTemplate
+from .batch import fill_many, iter_fill
+from .layout import Layout, LayoutError
+from .stats import FillStats
+from .check import check_fit
+__all__ = ["PdfFormFiller", "PdfTemplate", "fill_many", "iter_fill", "Layout", "LayoutError",
+    "FillStats", "check_fit"]
+try:
+    from .aio import FillLimiter
+    __all__.append("FillLimiter")
+except SyntaxError:
+    # asyncio support needs python 3.5+
+    pass
@@ -0,0 +1,414 @@
+"""
+Filling out the interactive form fields (``/AcroForm``) of a pdf.
+
+Lots of templates are real fillable pdfs. Instead of drawing text on top of
+them, their fields can be given values directly: the field's ``/V`` value is
+set, and a simple appearance stream is generated for each of its widgets (or
+the viewer is asked to generate them with ``/NeedAppearances``). This is
+much cheaper than rendering and merging an overlay, and the output is still
+a fillable form.
+
+The fields' widget rectangles can also be used to find the boxes for
+:meth:`.PdfFormFiller.add_text`, instead of measuring them by hand.
+"""
+import re
+from collections import namedtuple, OrderedDict
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from PyPDF2.generic import (IndirectObject, DictionaryObject, ArrayObject,
+    NameObject, FloatObject, BooleanObject, createStringObject)
+try:
+    basestring
+except NameError:
+    basestring = str
+
+from .fit import wrap
+from .merge import stream
+from .direct import DIRECT_FONTS, escape
+
+# attributes that kids inherit from their parent fields
+INHERITABLE = ("/FT", "/Ff", "/V", "/DA", "/Q")
+FIELD_TYPES = {"/Tx": "text", "/Btn": "button", "/Ch": "choice", "/Sig": "signature"}
+MULTILINE = 1 << 12
+DEFAULT_APPEARANCE = "/Helv 0 Tf 0 g"
+AUTO_FONT_SIZE = 12
+MARGIN = 2
+
+FormField = namedtuple("FormField", ["name", "kind", "value", "flags", "appearance", "ref", "widgets"])
+"""
+A terminal field of a pdf's interactive form, as found by :func:`.discover`.
+
+Attributes:
+    name (str): Fully qualified name of the field (e.g. ``"person.name"``)
+    kind (str): ``"text"``, ``"button"`` (check boxes and radio buttons),
+        ``"choice"`` or ``"signature"``
+    value: Current value of the field, or None
+    flags (int): The field's ``/Ff`` flags
+    appearance (str): The field's default appearance (``/DA``), e.g.
+        ``"/Helv 0 Tf 0 g"``
+    ref (IndirectObject): Reference to the field's dictionary
+    widgets (list[:class:`.FormWidget`]): Where the field is shown
+"""
+
+FormWidget = namedtuple("FormWidget", ["ref", "page", "rect", "upperLeft", "lowerRight"])
+"""
+A widget (i.e. a visible box) of a :class:`.FormField`.
+
+Attributes:
+    ref (IndirectObject): Reference to the widget annotation (which is the
+        same as the field's if the field only has one widget)
+    page (int or None): Page the widget is on (0 is first page)
+    rect (tuple): ``(x1, y1, x2, y2)`` pdf coordinates of the widget
+    upperLeft (tuple): Top left corner, in the same coordinates as
+        :meth:`.PdfFormFiller.add_text`
+    lowerRight (tuple): Bottom right corner, in the same coordinates as
+        :meth:`.PdfFormFiller.add_text`
+"""
+
+def _text(value):
+    if value is None:
+        return None
+    if isinstance(value, NameObject):
+        return str(value)
+    return value if isinstance(value, basestring) else str(value)
+
+def discover(template):
+    """Find the fields of a template's interactive form.
+
+    Args:
+        template (PdfTemplate): The pdf
+
+    Returns:
+        OrderedDict: Field name to :class:`.FormField`, in the order of the
+        form. Empty if the pdf has no form.
+    """
+    fields = OrderedDict()
+    root = template.pdf.trailer["/Root"].getObject()
+    acroform = root.get("/AcroForm")
+    if acroform is None:
+        return fields
+
+    # find the page of each widget annotation
+    annotPages = {}
+    pageRefs = {}
+    for pagenum, page in enumerate(template.pages):
+        if page.indirectRef is not None:
+            pageRefs[(page.indirectRef.idnum, page.indirectRef.generation)] = pagenum
+        for annot in page.get("/Annots", ArrayObject()).getObject():
+            if isinstance(annot, IndirectObject):
+                annotPages[(annot.idnum, annot.generation)] = pagenum
+
+    def widget(ref):
+        annot = ref.getObject()
+        pagenum = annotPages.get((ref.idnum, ref.generation))
+        parent = annot.raw_get("/P") if "/P" in annot else None
+        if pagenum is None and isinstance(parent, IndirectObject):
+            pagenum = pageRefs.get((parent.idnum, parent.generation))
+        x1, y1, x2, y2 = (float(n) for n in annot.get("/Rect", [0, 0, 0, 0]))
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+        upperLeft = lowerRight = None
+        if pagenum is not None:
+            height = template.pageSizes[pagenum][1]
+            upperLeft, lowerRight = (x1, height - y2), (x2, height - y1)
+        return FormWidget(ref, pagenum, (x1, y1, x2, y2), upperLeft, lowerRight)
+
+    def walk(ref, parentName, inherited, seen):
+        if not isinstance(ref, IndirectObject) or (ref.idnum, ref.generation) in seen:
+            return
+        seen.add((ref.idnum, ref.generation))
+        field = ref.getObject()
+        attributes = dict(inherited)
+        for key in INHERITABLE:
+            if key in field:
+                attributes[key] = field[key]
+        partial = _text(field.get("/T"))
+        name = ".".join(n for n in (parentName, partial) if n)
+
+        kids = list(field.get("/Kids", ArrayObject()).getObject())
+        children = [k for k in kids if "/T" in k.getObject()]
+        for kid in children:
+            walk(kid, name, attributes, seen)
+        if children and len(children) == len(kids):
+            return
+
+        widgets = [widget(k) for k in kids if "/T" not in k.getObject()]
+        if field.get("/Subtype") == "/Widget":
+            widgets.insert(0, widget(ref))
+        fields[name] = FormField(
+            name=name,
+            kind=FIELD_TYPES.get(attributes.get("/FT"), "unknown"),
+            value=_text(attributes.get("/V")),
+            flags=int(attributes.get("/Ff", 0)),
+            appearance=_text(attributes.get("/DA", acroform.getObject().get("/DA"))),
+            ref=ref,
+            widgets=widgets,
+        )
+
+    seen = set()
+    for ref in acroform.getObject().get("/Fields", ArrayObject()).getObject():
+        walk(ref, "", {}, seen)
+    return fields
+
+def subset_form(template, acroform, pagenums, replacements=None):
+    """Copy of an ``/AcroForm`` entry with only the fields that have a widget
+    on some of the pages, for writing those pages on their own.
+
+    Args:
+        template (PdfTemplate): The pdf
+        acroform (DictionaryObject or IndirectObject): The ``/AcroForm``
+            entry (see :func:`fill_form`)
+        pagenums (iterable): Page numbers that are written
+
+    Keyword Args:
+        replacements (dict): Replacements from :func:`fill_form`
+
+    Returns:
+        DictionaryObject
+    """
+    if isinstance(acroform, IndirectObject):
+        key = (acroform.idnum, acroform.generation)
+        acroform = (replacements or {}).get(key) or acroform.getObject()
+    pagenums = set(pagenums)
+    keep = set(name.split(".")[0] for name, field in template.fields.items()
+        if any(w.page in pagenums for w in field.widgets))
+    subset = _copy(acroform)
+    subset[NameObject("/Fields")] = ArrayObject(ref
+        for ref in acroform.get("/Fields", ArrayObject()).getObject()
+        if _text(ref.getObject().get("/T")) in keep)
+    return subset
+
+def field_boxes(template):
+    """Find the boxes of a template's form fields, for use with
+    :meth:`.PdfFormFiller.add_text`.
+
+    Args:
+        template (PdfTemplate): The pdf
+
+    Returns:
+        OrderedDict: Field name to a list of ``(pagenum, upperLeft,
+        lowerRight)`` for each of its widgets
+    """
+    return OrderedDict((name, [(w.page, w.upperLeft, w.lowerRight)
+        for w in field.widgets if w.page is not None])
+        for name, field in template.fields.items())
+
+def _copy(obj):
+    new = DictionaryObject()
+    new.update(obj)
+    return new
+
+def _font(appearance, acroform):
+    """Parse a default appearance string.
+
+    Returns:
+        tuple: ``(resource name, font size, standard font for measuring,
+        font object)``
+    """
+    match = re.search(r"/([^\s/]+)\s+([\d.]+)\s+Tf", appearance or "")
+    name, size = (match.group(1), float(match.group(2))) if match else ("Helv", 0.0)
+    fonts = acroform.get("/DR", DictionaryObject()).getObject().get("/Font", DictionaryObject()).getObject()
+    if "/" + name in fonts:
+        font = fonts.raw_get("/" + name)
+        baseFont = str(font.getObject().get("/BaseFont", "/Helvetica"))[1:]
+    else:
+        font = DictionaryObject({
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject("/Helvetica"),
+            NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+        })
+        baseFont = "Helvetica"
+    if baseFont not in DIRECT_FONTS:
+        baseFont = "Helvetica"
+    return name, size, baseFont, font
+
+def _color(components, stroke):
+    "Color operator for a /MK color array (gray, rgb or cmyk)"
+    operators = {1: "g", 3: "rg", 4: "k"}
+    if len(components) not in operators:
+        return None
+    op = operators[len(components)]
+    return "{} {}".format(" ".join("{:.3f}".format(float(c)) for c in components),
+        op.upper() if stroke else op).encode("ascii")
+
+def _decoration(characteristics, width, height):
+    "Operators for a widget's background and border colors (its /MK)"
+    ops = []
+    background = _color(characteristics.get("/BG", []), False)
+    if background:
+        ops.append(background + " 0 0 {:.2f} {:.2f} re f".format(width, height).encode("ascii"))
+    border = _color(characteristics.get("/BC", []), True)
+    if border:
+        ops.append(border + " 1 w 0.5 0.5 {:.2f} {:.2f} re S".format(
+            width - 1, height - 1).encode("ascii"))
+    return ops
+
+def text_appearance(text, rect, appearance, acroform, flags=0, quadding=0,
+        characteristics=None):
+    """Generate a simple appearance stream for a text field's widget.
+
+    Auto sized text (font size 0) gets the largest size up to 12pt that fits
+    the widget. Multiline fields are wrapped to the widget's width. The
+    widget's background and border colors (``characteristics``, its
+    ``/MK``) are drawn too.
+
+    Returns:
+        StreamObject: Form XObject, or None if the text can't be encoded in
+        the standard fonts' encoding
+    """
+    try:
+        text.encode("cp1252")
+    except UnicodeError:
+        return None
+    acroform = acroform.getObject()
+    name, size, baseFont, font = _font(appearance or DEFAULT_APPEARANCE, acroform)
+    x1, y1, x2, y2 = rect
+    width, height = x2 - x1, y2 - y1
+    innerWidth = width - 2 * MARGIN
+
+    if flags & MULTILINE:
+        size = size or AUTO_FONT_SIZE
+        lines = []
+        spaceWidth = stringWidth(" ", baseFont, size)
+        for paragraph in text.splitlines() or [""]:
+            words = paragraph.split()
+            widths = [stringWidth(w, baseFont, size) for w in words]
+            lines.extend(" ".join(l) for _, l in wrap(words, widths, spaceWidth, innerWidth) or [(0, [])])
+    else:
+        lines = [text]
+        if not size:
+            textWidth = stringWidth(text, baseFont, 1)
+            size = min(AUTO_FONT_SIZE, max(height - 2 * MARGIN, 1))
+            if textWidth * size > innerWidth > 0:
+                size = innerWidth / textWidth
+
+    # the default appearance sets the font and color, with the size fixed
+    da = re.sub(r"/[^\s/]+\s+[\d.]+\s+Tf", "/{} {:.2f} Tf".format(name, size),
+        appearance or DEFAULT_APPEARANCE)
+    leading = size * 1.15
+    if flags & MULTILINE:
+        top = height - MARGIN - size
+    else:
+        top = (height - size) / 2.0 + size * 0.22
+    ops = _decoration(characteristics or {}, width, height)
+    ops += [b"/Tx BMC", b"q", "{} {} {:.2f} {:.2f} re W n".format(
+        1, 1, width - 2, height - 2).encode("ascii"), b"BT", da.encode("latin-1")]
+    for i, line in enumerate(lines):
+        lineWidth = stringWidth(line, baseFont, size)
+        x = MARGIN
+        if quadding == 1:
+            x = (width - lineWidth) / 2.0
+        elif quadding == 2:
+            x = width - MARGIN - lineWidth
+        ops.append("1 0 0 1 {:.2f} {:.2f} Tm ".format(x, top - i * leading).encode("ascii")
+            + escape(line) + b" Tj")
+    ops.extend([b"ET", b"Q", b"EMC"])
+
+    xobject = stream(b"\n".join(ops) + b"\n")
+    xobject.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Form"),
+        NameObject("/BBox"): ArrayObject([FloatObject(0), FloatObject(0),
+            FloatObject(width), FloatObject(height)]),
+        NameObject("/Resources"): DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/" + name): font}),
+        }),
+    })
+    return xobject
+
+def _states(widget):
+    "The on states of a check box or radio button widget"
+    ap = widget.get("/AP", DictionaryObject()).getObject()
+    normal = ap.get("/N", DictionaryObject()).getObject()
+    return [str(k) for k in normal.keys() if k != "/Off"] if isinstance(normal, DictionaryObject) else []
+
+def fill_form(template, values, appearances=True):
+    """Set the values of a template's form fields.
+
+    Nothing in the template is modified. Instead, modified copies of the
+    field and widget dictionaries are returned, to be written in place of
+    the originals.
+
+    Args:
+        template (PdfTemplate): The pdf
+        values (dict): Field name to value. Text and choice fields take
+            strings, check boxes ``True``/``False`` (or the name of their on
+            state) and radio buttons the name of the button to turn on.
+
+    Keyword Args:
+        appearances (bool): Generate appearance streams for the text and
+            choice fields. If False (or if a value can't be drawn with the
+            standard fonts), ``/NeedAppearances`` is set instead, which asks
+            the viewer to draw the fields.
+
+    Returns:
+        tuple: ``(replacements, acroform)``, where replacements is a dict of
+        ``(idnum, generation)`` of an original object to the object to write
+        in its place, and acroform is the ``/AcroForm`` entry for the
+        output's catalog
+
+    Raises:
+        KeyError: If a field doesn't exist
+        ValueError: If a value isn't valid for its field
+    """
+    reader = template.pdf
+    rootRef = reader.trailer.raw_get("/Root")
+    root = rootRef.getObject()
+    acroformEntry = root.raw_get("/AcroForm") if "/AcroForm" in root else None
+    replacements = {}
+    needAppearances = not appearances
+
+    def replacement(ref):
+        key = (ref.idnum, ref.generation)
+        if key not in replacements:
+            replacements[key] = _copy(ref.getObject())
+        return replacements[key]
+
+    for name, value in values.items():
+        field = template.fields.get(name)
+        if field is None:
+            raise KeyError("The pdf has no form field named {!r}".format(name))
+        if field.kind == "signature":
+            raise ValueError("Can't fill in signature field {!r}".format(name))
+
+        if field.kind == "button":
+            # check boxes and radio buttons turn on the widget whose on state
+            # matches the value
+            on = None
+            for w in field.widgets:
+                widget = replacement(w.ref)
+                states = _states(widget)
+                state = None
+                if value is True and states:
+                    state = states[0]
+                elif isinstance(value, basestring) and ("/" + value.lstrip("/")) in states:
+                    state = "/" + value.lstrip("/")
+                widget[NameObject("/AS")] = NameObject(state or "/Off")
+                on = on or state
+            if on is None and value not in (False, None, "Off", "/Off"):
+                raise ValueError("{!r} isn't a state of button field {!r}".format(value, name))
+            replacement(field.ref)[NameObject("/V")] = NameObject(on or "/Off")
+            continue
+
+        text = "" if value is None else _text(value)
+        replacement(field.ref)[NameObject("/V")] = createStringObject(text)
+        if not appearances:
+            continue
+        for w in field.widgets:
+            widget = replacement(w.ref)
+            quadding = int(widget.get("/Q", field.ref.getObject().get("/Q", 0)))
+            xobject = text_appearance(text, w.rect, widget.get("/DA", field.appearance),
+                acroformEntry, field.flags, quadding, widget.get("/MK", DictionaryObject()).getObject())
+            if xobject is None:
+                needAppearances = True
+                continue
+            widget[NameObject("/AP")] = DictionaryObject({NameObject("/N"): xobject})
+
+    if needAppearances and acroformEntry is not None:
+        if isinstance(acroformEntry, IndirectObject):
+            replacement(acroformEntry)[NameObject("/NeedAppearances")] = BooleanObject(True)
+        else:
+            acroformEntry = _copy(acroformEntry)
+            acroformEntry[NameObject("/NeedAppearances")] = BooleanObject(True)
+            replacement(rootRef)[NameObject("/AcroForm")] = acroformEntry
+    return replacements, acroformEntry
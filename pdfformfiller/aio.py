@@ -0,0 +1,183 @@
+"""
+Asyncio support for writing filled out pdfs without blocking the event loop.
+
+Rendering and merging text fields is CPU bound, so :func:`.write_async` runs
+:meth:`.PdfFormFiller.write` in an executor thread and hands the output back
+to an async writer in chunks. The pdf is only serialized once it's rendered
+and merged, so the first chunk comes when the whole pdf is ready, not sooner.
+At most :data:`MAX_QUEUED_CHUNKS` chunks wait for the async writer: a slow
+client holds back the executor thread, instead of the whole pdf piling up
+in memory a second time.
+"""
+import asyncio
+import inspect
+from concurrent.futures import (ThreadPoolExecutor, TimeoutError as FutureTimeout,
+    CancelledError as FutureCancelled)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+MAX_QUEUED_CHUNKS = 4
+# how often a thread waiting for room in the queue checks the event loop
+# is still running
+POLL_SECONDS = 0.1
+
+class WriteCancelled(Exception):
+    "Raised in the executor thread to stop writing a cancelled pdf"
+
+class FillLimiter(object):
+    """Limits how many pdfs are written at once.
+
+    A burst of requests in a web server would otherwise queue up an
+    unlimited number of fills on the executor. Fills wait (asynchronously)
+    for a free slot before being handed to the executor, and keep their slot
+    until the executor is done with them, even if they are cancelled.
+
+    Args:
+        limit (int): Maximum number of pdfs being written at once
+
+    Keyword Args:
+        executor (Executor): Thread pool to write the pdfs in. Default is a
+            new ``ThreadPoolExecutor`` with ``limit`` threads.
+    """
+    def __init__(self, limit, executor=None):
+        self.limit = limit
+        self.executor = executor or ThreadPoolExecutor(limit)
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        # created lazily so it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+    def shutdown(self, wait=True):
+        "Shut down the executor"
+        self.executor.shutdown(wait=wait)
+
+class _ChunkWriter(object):
+    "File-like object that hands chunks of output over to the event loop"
+    def __init__(self, loop, queue, chunkSize):
+        self.loop = loop
+        self.queue = queue
+        self.chunkSize = chunkSize
+        self.buffer = []
+        self.size = 0
+        self.position = 0
+        self.cancelled = False
+        self._pending = None
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        if self.cancelled:
+            raise WriteCancelled()
+        self.buffer.append(bytes(data))
+        self.size += len(data)
+        self.position += len(data)
+        if self.size >= self.chunkSize:
+            self.flush()
+        return len(data)
+
+    def put(self, chunk):
+        """Queue a chunk, waiting for room in the queue.
+
+        Raises:
+            WriteCancelled: If the write is cancelled, or the event loop
+                stops, while waiting
+        """
+        if self.cancelled:
+            return
+        try:
+            self._pending = future = asyncio.run_coroutine_threadsafe(
+                self.queue.put(chunk), self.loop)
+        except RuntimeError:
+            # the loop is closed
+            self.cancelled = True
+            raise WriteCancelled()
+        while True:
+            try:
+                future.result(POLL_SECONDS)
+                return
+            except FutureCancelled:
+                self.cancelled = True
+                raise WriteCancelled()
+            except FutureTimeout:
+                if self.cancelled or self.loop.is_closed() or not self.loop.is_running():
+                    self.cancelled = True
+                    future.cancel()
+                    raise WriteCancelled()
+
+    def flush(self):
+        if self.buffer:
+            chunk = b"".join(self.buffer)
+            self.buffer = []
+            self.size = 0
+            self.put(chunk)
+
+    def close(self):
+        self.flush()
+        self.put(None)
+
+    def cancel(self):
+        "Stop the executor thread at its next write (call from the event loop)"
+        self.cancelled = True
+        # stop a put that's waiting for room
+        if self._pending is not None:
+            self._pending.cancel()
+
+def _write(filler, out, kwargs):
+    try:
+        filler.write(out, **kwargs)
+    finally:
+        out.close()
+
+async def _send(outputStream, chunk):
+    "Write a chunk to a sync or async writer"
+    result = outputStream.write(chunk)
+    if inspect.isawaitable(result):
+        await result
+    elif hasattr(outputStream, "drain"):
+        await outputStream.drain()
+
+async def write_async(filler, outputStream, executor=None, limiter=None,
+        chunkSize=DEFAULT_CHUNK_SIZE, **kwargs):
+    """Write a filled out pdf without blocking the event loop.
+
+    See :meth:`.PdfFormFiller.write_async`.
+    """
+    loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)()
+    if limiter is not None:
+        await limiter.semaphore.acquire()
+        if executor is None:
+            executor = limiter.executor
+    queue = asyncio.Queue(MAX_QUEUED_CHUNKS)
+    out = _ChunkWriter(loop, queue, chunkSize)
+    try:
+        future = loop.run_in_executor(executor, _write, filler, out, kwargs)
+    except BaseException:
+        if limiter is not None:
+            limiter.semaphore.release()
+        raise
+    if limiter is not None:
+        future.add_done_callback(lambda f: limiter.semaphore.release())
+
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            await _send(outputStream, chunk)
+        await future
+    except asyncio.CancelledError:
+        # stop the executor thread at its next write
+        out.cancel()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        raise
+    except BaseException:
+        out.cancel()
+        try:
+            await future
+        except Exception:
+            pass
+        raise
@@ -0,0 +1,214 @@
+"""
+Pdf libraries that can do the merging and writing of a fill.
+
+Everything in pdfformfiller is built on PyPDF2, which is pure Python and
+slow to parse and write big templates. A :class:`Backend` does the parts of a
+plain fill that depend on the pdf library instead: reading the template's
+page boxes, drawing the rendered text overlays on top of the pages, and
+writing the result. The text fields are still laid out by reportlab.
+
+* ``"pypdf2"``: the built-in PyPDF2 code. The default, and the only backend
+  that supports every feature.
+* ``"pypdf"``: pypdf (3.0 or later), the maintained successor of PyPDF2.
+* ``"pikepdf"``: pikepdf, which wraps the qpdf C++ library. It opens big
+  templates lazily and merges overlays without parsing the page content.
+  qpdf can't be given a zlib level for one write, so ``compression="fast"``
+  and ``"max"`` both compress with its default level.
+
+``"auto"`` picks the fastest one that's installed. The other backends only
+do plain fills: text fields rendered by reportlab, optionally only on some
+pages. Form fields, images, the direct engine, and incremental or streaming
+writes need the ``"pypdf2"`` backend. Run ``python bench.py`` to compare
+the installed backends on your templates.
+"""
+import importlib
+from io import BytesIO
+
+from .merge import unique_name
+
+BACKENDS = ("pypdf2", "pypdf", "pikepdf")
+AUTO_ORDER = ("pikepdf", "pypdf", "pypdf2")
+MODULES = {"pypdf2": "PyPDF2", "pypdf": "pypdf", "pikepdf": "pikepdf"}
+
+def installed(name):
+    "Whether a backend's library can be imported"
+    try:
+        importlib.import_module(MODULES[name])
+    except ImportError:
+        return False
+    return True
+
+def choose_backend(name):
+    """Check a backend name, resolving ``"auto"`` to the fastest installed
+    backend.
+
+    Raises:
+        ValueError: If the name isn't one of :data:`BACKENDS` or ``"auto"``
+        ImportError: If the backend's library isn't installed
+
+    Returns:
+        str: The backend's name
+    """
+    if name == "auto":
+        for name in AUTO_ORDER:
+            if installed(name):
+                return name
+    if name not in BACKENDS:
+        raise ValueError("backend must be one of auto, {}".format(", ".join(BACKENDS)))
+    if not installed(name):
+        raise ImportError("The {} backend needs {} to be installed".format(name, MODULES[name]))
+    return name
+
+_backends = {}
+
+def get_backend(name):
+    """Get a backend by name (see :func:`choose_backend`).
+
+    Returns:
+        :class:`Backend`, or None for the built-in ``"pypdf2"`` code
+    """
+    name = choose_backend(name)
+    if name == "pypdf2":
+        return None
+    if name not in _backends:
+        _backends[name] = {"pypdf": PypdfBackend, "pikepdf": PikepdfBackend}[name]()
+    return _backends[name]
+
+def _stream(data):
+    # memory maps are file-like already
+    return data if hasattr(data, "seek") else BytesIO(data)
+
+class Backend(object):
+    """Merges and writes fills with a pdf library.
+
+    Templates are opened again for every write (the libraries only read what
+    they need), so a template is never modified and can be written from
+    several threads at once.
+
+    Attributes:
+        name (str): The backend's name
+    """
+    name = None
+
+    def page_boxes(self, data):
+        """Media box of each page of a pdf.
+
+        Args:
+            data (bytes or mmap): The pdf
+
+        Returns:
+            list[tuple]: ``(x1, y1, x2, y2)`` of each page
+        """
+        raise NotImplementedError
+
+    def write(self, data, overlays, outputFile, pagenums=None, level=None, documentId=None):
+        """Draw overlay pages on top of a pdf's pages and write the result.
+
+        Args:
+            data (bytes or mmap): The template pdf
+            overlays (dict): Page number to ``(pdf, index)``, where pdf is
+                the bytes of an overlay pdf (rendered by reportlab) and index
+                is the number of its page to draw on top of that page
+            outputFile (file): Where to write the pdf
+
+        Keyword Args:
+            pagenums (list[int]): Page numbers to write, in order. Default is
+                None (all pages).
+            level (int): zlib level to compress the written streams with (0
+                for none). pikepdf only tells none from compressed, and
+                compresses with qpdf's default level for any other level.
+                Default is None (the library's default).
+            documentId (bytes): Document ID to write in the trailer (pikepdf
+                only keeps it as the first element, and derives the second
+                from the content). Default is None (the library's default).
+        """
+        raise NotImplementedError
+
+    def _open_overlays(self, overlays, open):
+        """Open each overlay pdf once.
+
+        Returns:
+            tuple: Dict of page number to overlay page, and the list of opened
+            pdfs (which have to be kept until the output is written)
+        """
+        opened = {}
+        pages = {}
+        for pagenum, (pdf, index) in overlays.items():
+            if id(pdf) not in opened:
+                opened[id(pdf)] = open(pdf)
+            pages[pagenum] = opened[id(pdf)].pages[index]
+        return pages, list(opened.values())
+
+    def __repr__(self):
+        return "<{} {}>".format(type(self).__name__, self.name)
+
+class PypdfBackend(Backend):
+    "Fills with pypdf"
+    name = "pypdf"
+
+    def __init__(self):
+        self.pypdf = importlib.import_module("pypdf")
+
+    def page_boxes(self, data):
+        reader = self.pypdf.PdfReader(_stream(data))
+        return [tuple(float(n) for n in page.mediabox) for page in reader.pages]
+
+    def write(self, data, overlays, outputFile, pagenums=None, level=None, documentId=None):
+        pypdf = self.pypdf
+        writer = pypdf.PdfWriter(clone_from=pypdf.PdfReader(_stream(data)))
+        overlays, opened = self._open_overlays(overlays,
+            lambda pdf: pypdf.PdfReader(BytesIO(pdf)))
+        for pagenum, overlay in overlays.items():
+            writer.pages[pagenum].merge_page(overlay)
+            if level:
+                writer.pages[pagenum].compress_content_streams(level)
+        if pagenums is not None:
+            pages = [writer.pages[pagenum] for pagenum in pagenums]
+            for i in reversed(range(len(writer.pages))):
+                del writer.pages[i]
+            for page in pages:
+                writer.add_page(page)
+        if documentId is not None:
+            documentId = pypdf.generic.ByteStringObject(documentId)
+            writer._ID = pypdf.generic.ArrayObject([documentId, documentId])
+        writer.write(outputFile)
+
+class PikepdfBackend(Backend):
+    "Fills with pikepdf"
+    name = "pikepdf"
+
+    def __init__(self):
+        self.pikepdf = importlib.import_module("pikepdf")
+
+    def page_boxes(self, data):
+        with self.pikepdf.open(_stream(data)) as pdf:
+            return [tuple(float(n) for n in page.mediabox) for page in pdf.pages]
+
+    def write(self, data, overlays, outputFile, pagenums=None, level=None, documentId=None):
+        pikepdf = self.pikepdf
+        with pikepdf.open(_stream(data)) as pdf:
+            overlays, opened = self._open_overlays(overlays,
+                lambda overlay: pikepdf.open(BytesIO(overlay)))
+            for pagenum, overlay in overlays.items():
+                # the overlay is drawn as a Form XObject, so the page's
+                # content isn't even decoded (unlike with Page.add_overlay)
+                page = pdf.pages[pagenum]
+                form = overlay.as_form_xobject(False)
+                used = set(str(name) for name in page.resources.get("/XObject", {}).keys())
+                name = page.add_resource(form, pikepdf.Name.XObject,
+                    pikepdf.Name(unique_name("/Fm", used)))
+                page.contents_add(b"q\n", prepend=True)
+                page.contents_add("\nQ\nq {} Do Q\n".format(name).encode("ascii"))
+            if pagenums is not None:
+                pages = [pdf.pages[pagenum] for pagenum in pagenums]
+                del pdf.pages[:]
+                pdf.pages.extend(pages)
+            if documentId is not None:
+                # qpdf keeps the first element, and always writes its own
+                # second one: this makes it a hash of the content instead of
+                # the time (static_id would make it the same for every pdf)
+                pdf.trailer.ID = pikepdf.Array([pikepdf.String(documentId)] * 2)
+            # qpdf's zlib level is a process-wide setting, so every level
+            # but 0 compresses the same
+            pdf.save(outputFile, compress_streams=level != 0, recompress_flate=bool(level),
+                deterministic_id=documentId is not None)
@@ -0,0 +1,209 @@
+import os
+import sys
+import time
+from io import BytesIO
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+
+from .template import PdfTemplate
+from .pdfformfiller import PdfFormFiller
+
+class BatchStats(object):
+    """Summary of a :func:`.fill_many` run.
+
+    Attributes:
+        count (int): Number of records filled
+        errors (int): Number of records that failed (only with
+            ``errors="yield"``)
+        failures (list[tuple]): ``(index, exception)`` of each record that
+            failed, in the order they were handed back
+        bytes (int): Total size of all the output pdfs
+        seconds (float): Wall time of the whole run
+        workers (int): Number of worker processes used (0 means the records
+            were filled in the calling process)
+    """
+    def __init__(self, workers):
+        self.count = 0
+        self.errors = 0
+        self.failures = []
+        self.bytes = 0
+        self.seconds = 0.0
+        self.workers = workers
+
+    @property
+    def throughput(self):
+        "Records filled per second"
+        return self.count / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return "<BatchStats count={} seconds={:.3f} throughput={:.1f}/s workers={}>".format(
+            self.count, self.seconds, self.throughput, self.workers)
+
+# per-process state for worker processes, set once by _init_worker
+_worker = {}
+
+def _init_worker(template, layout, kwargs):
+    _worker["template"] = template
+    _worker["layout"] = layout
+    _worker["kwargs"] = kwargs
+
+def _fill(template, layout, kwargs, record):
+    filler = PdfFormFiller(template, **kwargs)
+    layout(filler, record)
+    out = BytesIO()
+    filler.write(out)
+    return out.getvalue()
+
+def _fill_worker(index, record):
+    try:
+        return index, _fill(_worker["template"], _worker["layout"], _worker["kwargs"], record)
+    except Exception as e:
+        # returned rather than raised, so the task's callback is called
+        # (Python 2's apply_async has no error_callback)
+        return index, e
+
+def iter_fill(template, layout, records, workers=None, ordered=True, backlog=4,
+        errors="raise", **kwargs):
+    """Fill out a template once per record, yielding the pdfs as they're done.
+
+    This is the generator behind :func:`.fill_many`. Records are consumed
+    lazily, and at most ``backlog`` records per worker are in flight at any
+    time, so memory use doesn't depend on how many records there are.
+
+    Args:
+        template (str or file or PdfTemplate): The pdf to fill out
+        layout (callable): Called as ``layout(filler, record)`` to add the text
+            fields for a record to a fresh :class:`.PdfFormFiller`. When using
+            worker processes this must be picklable (e.g. a module level
+            function).
+        records (iterable): The records to fill out
+
+    Keyword Args:
+        workers (int): Number of worker processes. Default is None (one per
+            cpu). Use ``0`` to fill everything in the calling process.
+        ordered (bool): Whether to yield results in the same order as the
+            records (default), or as soon as each one is completed.
+        backlog (int): Number of records per worker to queue up ahead.
+        errors (str): What to do when filling out a record fails.
+            ``"raise"`` (default) raises the exception, stopping the run.
+            ``"yield"`` yields the exception in place of the pdf bytes and
+            carries on with the next record.
+        **kwargs: Passed through to :class:`.PdfFormFiller` (e.g. ``style``).
+
+    Yields:
+        tuple: ``(index, record, pdf_bytes)`` for each record
+    """
+    if errors not in ("raise", "yield"):
+        raise ValueError("errors must be 'raise' or 'yield'")
+    if not isinstance(template, PdfTemplate):
+        template = PdfTemplate(template)
+    if workers is None:
+        workers = cpu_count()
+
+    # no pool, just fill each record in turn
+    if not workers:
+        for index, record in enumerate(records):
+            try:
+                data = _fill(template, layout, kwargs, record)
+            except Exception as e:
+                if errors == "raise":
+                    raise
+                data = e
+            yield index, record, data
+        return
+
+    # the template and layout are sent to each worker once, not per record
+    pool = Pool(workers, _init_worker, (template, layout, kwargs))
+    try:
+        pending = OrderedDict()
+        # without ordering, each task puts its index here when it's done
+        done = None if ordered else Queue()
+        limit = workers * max(backlog, 1)
+        records = iter(enumerate(records))
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < limit:
+                try:
+                    index, record = next(records)
+                except StopIteration:
+                    exhausted = True
+                    break
+                callbacks = {}
+                if done is not None:
+                    callbacks["callback"] = lambda _, index=index: done.put(index)
+                    if sys.version_info[0] >= 3:
+                        callbacks["error_callback"] = callbacks["callback"]
+                pending[index] = (record, pool.apply_async(_fill_worker, (index, record),
+                    **callbacks))
+
+            # pick the next result to hand back
+            if ordered:
+                index, (record, result) = pending.popitem(last=False)
+            else:
+                index = done.get()
+                record, result = pending.pop(index)
+            try:
+                data = result.get()[1]
+            except Exception as e:
+                data = e
+            if isinstance(data, Exception) and errors == "raise":
+                raise data
+            yield index, record, data
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def fill_many(template, layout, records, output, workers=None, ordered=True, **kwargs):
+    """Fill out a template once per record, using multiple processes.
+
+    This is the "mail merge" api. Each record is passed to ``layout`` to add
+    its text fields, and the filled out pdf is sent to ``output``.
+
+    Args:
+        template (str or file or PdfTemplate): The pdf to fill out
+        layout (callable): Called as ``layout(filler, record)`` to add the text
+            fields for a record to a fresh :class:`.PdfFormFiller`. When using
+            worker processes this must be picklable (e.g. a module level
+            function).
+        records (iterable): The records to fill out
+        output (str or callable): Either a directory path (pdfs are written as
+            ``0.pdf``, ``1.pdf``, etc.), or a function that is called as
+            ``output(index, record, pdf_bytes)`` for each filled out pdf.
+
+    Keyword Args:
+        workers (int): Number of worker processes. Default is None (one per
+            cpu). Use ``0`` to fill everything in the calling process.
+        ordered (bool): Whether to send results to ``output`` in the same
+            order as the records (default), or as each one is completed.
+        **kwargs: Passed through to :func:`.iter_fill`
+            and :class:`.PdfFormFiller`. With ``errors="yield"``, records
+            that fail aren't sent to ``output``, and are listed with their
+            exceptions in :attr:`.BatchStats.failures`.
+
+    Returns:
+        :class:`.BatchStats`
+    """
+    if workers is None:
+        workers = cpu_count()
+    stats = BatchStats(workers)
+    start = time.time()
+    for index, record, data in iter_fill(template, layout, records,
+            workers=workers, ordered=ordered, **kwargs):
+        if isinstance(data, Exception):
+            stats.errors += 1
+            stats.failures.append((index, data))
+            continue
+        if callable(output):
+            output(index, record, data)
+        else:
+            with open(os.path.join(output, "{}.pdf".format(index)), "wb") as f:
+                f.write(data)
+        stats.count += 1
+        stats.bytes += len(data)
+    stats.seconds = time.time() - start
+    return stats
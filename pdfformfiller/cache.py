@@ -0,0 +1,223 @@
+"""
+Caching filled out pdfs by their content.
+
+A filled out pdf only depends on the template, the text fields (and their
+styles), the form field values and the filler's options, so
+:func:`.fill_key` hashes all of those into a key. With ``deterministic=True``
+the same inputs always give byte-identical pdfs, so a :class:`.PdfFormFiller`
+with a ``cache`` can return the cached bytes for a repeated fill without
+rendering anything.
+
+Caches only need ``get(key)`` and ``put(key, data)`` methods.
+:class:`.MemoryCache` is a size-bounded LRU, :class:`.DiskCache` stores pdfs
+in a directory (also size-bounded) and :class:`.LayeredCache` puts a fast
+cache in front of a slower one.
+"""
+import os
+import errno
+import hashlib
+import tempfile
+from threading import Lock
+from collections import OrderedDict
+from reportlab.lib.styles import ParagraphStyle
+
+# bump this when the output for the same inputs changes
+KEY_VERSION = b"1"
+
+def style_key(style):
+    "Stable description of everything about a style that affects rendering"
+    if style is None:
+        return "None"
+    return repr(sorted((name, repr(getattr(style, name, None)))
+        for name in ParagraphStyle.defaults))
+
+def fill_key(filler, **kwargs):
+    """Hash everything that determines a filler's output.
+
+    Args:
+        filler (PdfFormFiller): The filler
+
+    Keyword Args:
+        **kwargs: Options passed to :meth:`.PdfFormFiller.write`
+
+    Returns:
+        str: Hex digest
+    """
+    h = hashlib.sha256(KEY_VERSION)
+    def add(*values):
+        h.update(repr(values).encode("utf-8"))
+        h.update(b"\0")
+
+    styles = {}
+    def style(s):
+        if id(s) not in styles:
+            styles[id(s)] = style_key(s)
+        return styles[id(s)]
+
+    add(filler.template.digest)
+    add(style(filler.style), tuple(filler.padding), filler.boxes, filler.overlay,
+        filler.engine, filler.appearances, filler.compression, filler.merge,
+        filler.backend)
+    add(sorted(kwargs.items()))
+    add(sorted(filler.fonts.items()),
+        filler.subsets.key() if filler.subsets is not None else None)
+    add(sorted((k, repr(v)) for k, v in filler.formValues.items()))
+    for pagenum in sorted(filler):
+        for field in filler[pagenum]:
+            add(pagenum, field.text, field.x1, field.y1, field.width, field.height,
+                style(field.style), tuple(field.padding))
+    for pagenum in sorted(filler.images):
+        for field in filler.images[pagenum]:
+            add(pagenum, field.image.digest, field.x1, field.y1, field.width, field.height)
+    return h.hexdigest()
+
+class MemoryCache(object):
+    """In-memory LRU cache of pdfs.
+
+    Keyword Args:
+        maxBytes (int): Maximum total size of the cached pdfs. The least
+            recently used pdfs are dropped first. Default is 64MB.
+    """
+    def __init__(self, maxBytes=64 * 1024 * 1024):
+        self.maxBytes = maxBytes
+        self.size = 0
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        "Returns the cached pdf bytes for a key, or None"
+        with self._lock:
+            data = self._cache.pop(key, None)
+            if data is not None:
+                self._cache[key] = data
+            return data
+
+    def put(self, key, data):
+        "Cache the pdf bytes for a key"
+        if len(data) > self.maxBytes:
+            return
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._cache[key] = data
+            self.size += len(data)
+            while self.size > self.maxBytes:
+                _, dropped = self._cache.popitem(last=False)
+                self.size -= len(dropped)
+
+    def __len__(self):
+        return len(self._cache)
+
+class DiskCache(object):
+    """Cache of pdfs stored as files in a directory.
+
+    Pdfs are written atomically (to a temporary file which is renamed), so
+    several processes can share a directory. When the directory gets bigger
+    than ``maxBytes``, the least recently used pdfs are deleted.
+
+    Args:
+        directory (str): Where to store the pdfs (created if needed)
+
+    Keyword Args:
+        maxBytes (int): Maximum total size of the cached pdfs. Default is
+            1GB.
+    """
+    def __init__(self, directory, maxBytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.size = None
+        self._lock = Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pdf")
+
+    def get(self, key):
+        "Returns the cached pdf bytes for a key, or None"
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        try:
+            # mark it as recently used
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        "Cache the pdf bytes for a key"
+        if len(data) > self.maxBytes:
+            return
+        path = self._path(key)
+        try:
+            # an overwritten pdf no longer counts towards the size
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.rename(tmp, path)
+        with self._lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self._entries())
+            else:
+                self.size += len(data) - replaced
+            if self.size > self.maxBytes:
+                self.evict()
+
+    def _entries(self):
+        "``(mtime, size, path)`` of each cached pdf"
+        for name in os.listdir(self.directory):
+            if name.endswith(".pdf"):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        "Delete the least recently used pdfs until the cache fits in maxBytes"
+        entries = sorted(self._entries())
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                pass
+
+class LayeredCache(object):
+    """Several caches, fastest first (e.g. a :class:`.MemoryCache` in front
+    of a :class:`.DiskCache`).
+
+    Pdfs are looked up in each cache in turn, and copied into the faster
+    caches when found in a slower one. New pdfs are put in all the caches.
+    """
+    def __init__(self, *caches):
+        self.caches = caches
+
+    def get(self, key):
+        "Returns the cached pdf bytes for a key, or None"
+        for i, cache in enumerate(self.caches):
+            data = cache.get(key)
+            if data is not None:
+                for faster in self.caches[:i]:
+                    faster.put(key, data)
+                return data
+        return None
+
+    def put(self, key, data):
+        "Cache the pdf bytes for a key"
+        for cache in self.caches:
+            cache.put(key, data)
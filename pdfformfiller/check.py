@@ -0,0 +1,250 @@
+"""
+Checking whether text fits its boxes, without rendering anything.
+
+Text that doesn't fit into its box is shrunk when the pdf is written, which
+is easy to miss in a big batch. :func:`check_fit` and
+:meth:`.PdfFormFiller.validate` measure every field against its box with the
+fonts' width tables (the same measurements as the direct engine, see
+:func:`.solve`) and report how much each one would be shrunk.
+
+With NumPy installed, the values of a field are measured for all the records
+at once: the width of each value on a single line is summed from the font's
+width table, and only the values that don't fit on one line are wrapped
+word by word. Without it every value is wrapped, which is still far faster
+than rendering.
+"""
+import re
+from collections import namedtuple
+from xml.sax.saxutils import unescape
+from reportlab.pdfbase.pdfmetrics import stringWidth, getFont
+from reportlab.lib.fonts import tt2ps
+try:
+    basestring
+except NameError:
+    basestring = str
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .direct import DIRECT_FONTS
+from .fit import solve_words, wrap
+
+FieldFit = namedtuple("FieldFit",
+    ["record", "name", "page", "fits", "shrink", "lines", "overflow"])
+"""
+How a text field fits its box, returned by :func:`check_fit` and
+:meth:`.PdfFormFiller.validate`.
+
+Attributes:
+    record (int or None): Index of the record (None for static fields and
+        for :meth:`.PdfFormFiller.validate`)
+    name (str or int): Name of the layout field, or index of the field on
+        its page for :meth:`.PdfFormFiller.validate`
+    page (int): Page the field is on
+    fits (bool): Whether the text fits without being shrunk
+    shrink (float): Factor the text has to be shrunk by to fit (1.0 if it
+        fits, 0.5 for half size)
+    lines (int): Number of lines the text is drawn on, once shrunk
+    overflow (float): How many points taller than the box (less padding) the
+        text is at full size (0 if it's only shrunk because a word is wider
+        than the box)
+"""
+
+TAG = re.compile(r"<[^>]*>")
+
+def plain_text(text):
+    "Paragraph markup stripped from some text (so it can only be measured approximately)"
+    if "<" in text or "&" in text:
+        return unescape(TAG.sub("", text), {"&quot;": '"', "&apos;": "'", "&nbsp;": u"\xa0"})
+    return text
+
+def measure_font(style):
+    "Font name to measure a style's text with"
+    try:
+        return tt2ps(style.fontName, 0, 0)
+    except ValueError:
+        return style.fontName
+
+_widthTables = {}
+
+def _width_table(fontName):
+    """Width (at size 1000) of each byte of cp1252 text in a standard font.
+    Whitespace is at least as wide as a space, since it's wrapped as one."""
+    if fontName not in _widthTables:
+        table = numpy.array(getFont(fontName).widths[:256], dtype=float)
+        for code in range(256):
+            if bytes(bytearray([code])).decode("cp1252", "replace").isspace():
+                table[code] = max(table[code], table[32])
+        _widthTables[fontName] = table
+    return _widthTables[fontName]
+
+def line_widths(texts, fontName, fontSize):
+    """Width of each text on a single line, for all the texts at once.
+
+    The widths are never less than the widths :func:`.solve` measures.
+    Texts with markup or characters outside of cp1252 get an infinite width,
+    so they're always measured exactly.
+
+    Returns:
+        numpy.ndarray or None: The widths, or None if NumPy isn't installed or
+        the font isn't a standard one
+    """
+    if numpy is None or fontName not in DIRECT_FONTS:
+        return None
+    encoded = []
+    for text in texts:
+        try:
+            encoded.append(text.encode("cp1252"))
+        except UnicodeError:
+            # "<" marks the text to be measured exactly, like markup
+            encoded.append(b"<")
+    codes = numpy.frombuffer(b"".join(encoded), dtype=numpy.uint8)
+    ends = numpy.cumsum([len(data) for data in encoded], dtype=numpy.int64)
+    starts = ends - [len(data) for data in encoded]
+    table = _width_table(fontName) * (fontSize / 1000.0)
+    widths = numpy.concatenate(([0.0], numpy.cumsum(table[codes])))
+    markup = numpy.concatenate(([0], numpy.cumsum((codes == ord("<")) | (codes == ord("&")))))
+    result = widths[ends] - widths[starts]
+    result[markup[ends] > markup[starts]] = numpy.inf
+    return result
+
+_wordWidths = {}
+MAX_WORDS = 65536
+
+def word_widths(words, fontName, fontSize):
+    """Width of each word, remembering the widths of the last
+    :data:`MAX_WORDS` distinct words of each font and size (words repeat a
+    lot between records)."""
+    known = _wordWidths.setdefault((fontName, fontSize), {})
+    if len(known) > MAX_WORDS:
+        known.clear()
+    widths = []
+    for word in words:
+        width = known.get(word)
+        if width is None:
+            width = known[word] = stringWidth(word, fontName, fontSize)
+        widths.append(width)
+    return widths
+
+def fit_texts(texts, style, width, height, padding, onlyOverflow=False):
+    """Measure lots of texts against the same box.
+
+    Args:
+        texts (list[str]): The texts
+        style (ParagraphStyle): Style of the texts
+        width (int or float): Width of the box
+        height (int or float): Height of the box
+        padding (tuple): Padding of the box
+
+    Keyword Args:
+        onlyOverflow (bool): Skip the texts that fit. Default is False.
+
+    Returns:
+        list[tuple]: ``(index, fits, shrink, lines, overflow)`` for each text
+        (see :class:`FieldFit`)
+    """
+    lp, bp, rp, tp = padding
+    innerWidth = width - lp - rp
+    innerHeight = height - tp - bp
+    fontName = measure_font(style)
+    fontSize = style.fontSize
+    leading = style.leading
+    lineWidths = None
+    if leading <= innerHeight:
+        lineWidths = line_widths(texts, fontName, fontSize)
+    if lineWidths is None:
+        oneLine = None
+        indexes = range(len(texts))
+    else:
+        oneLine = (lineWidths <= innerWidth).tolist()
+        indexes = range(len(texts))
+        if onlyOverflow:
+            indexes = numpy.flatnonzero(lineWidths > innerWidth).tolist()
+
+    spaceWidth = stringWidth(" ", fontName, fontSize)
+    results = []
+    for i in indexes:
+        text = texts[i]
+        if oneLine is not None and oneLine[i]:
+            results.append((i, True, 1.0, 1 if text.strip() else 0, 0.0))
+            continue
+        words = plain_text(text).split()
+        widths = word_widths(words, fontName, fontSize)
+        scale, lines = solve_words(words, widths, spaceWidth, leading, innerWidth, innerHeight)
+        if scale == 1.0:
+            if not onlyOverflow:
+                results.append((i, True, 1.0, len(lines), 0.0))
+            continue
+        fullLines = wrap(words, widths, spaceWidth, innerWidth)
+        overflow = max(len(fullLines) * leading - innerHeight, 0.0)
+        results.append((i, False, 1.0 / scale, len(lines), float(overflow)))
+    return results
+
+def _fields(layout, style, padding):
+    "``(name, page, static value, style, width, height, padding)`` of each layout field"
+    if hasattr(layout, "static"):
+        # a compiled LayoutPlan
+        fields = [(name, pagenum, None, field) for name, pagenum, field in layout.fields]
+        fields += [(name, pagenum, field.text, field) for name, pagenum, field in layout.static]
+        for name, pagenum, value, field in fields:
+            yield (name, pagenum, value, field.style or style, field.width, field.height,
+                field.padding or padding)
+        return
+    for field in layout.fields:
+        (x1, top), (x2, bottom) = field.upperLeft, field.lowerRight
+        yield (field.name, field.page, field.value, layout.styles.get(field.style) or style,
+            x2 - x1, bottom - top, field.padding or layout.padding or padding)
+
+def check_fit(layout, records, style=None, padding=None, onlyOverflow=False):
+    """Check which values of a batch of records are too long for their boxes,
+    without rendering anything.
+
+    Args:
+        layout (Layout or LayoutPlan or str): The layout (or path to its
+            JSON file) the records will be filled out with
+        records (iterable[dict]): The records
+
+    Keyword Args:
+        style (ParagraphStyle): Style of fields without one. Default is None
+            (the :class:`.PdfFormFiller` default).
+        padding (tuple): Padding of fields without any. Default is None (the
+            :class:`.PdfFormFiller` default).
+        onlyOverflow (bool): Only return the fields that don't fit. Default
+            is False.
+
+    Returns:
+        list[:class:`FieldFit`]: Each field of each record (fields missing
+        from a record are skipped), in order, after the static fields
+
+    Note:
+        Text is measured the same way as by the direct engine. Reportlab's
+        layout can differ slightly for text right at the edge of its box, and
+        fields with paragraph markup are measured with the markup stripped,
+        so their results are approximate.
+    """
+    from .layout import Layout
+    from .pdfformfiller import DEFAULT_STYLE, DEFAULT_PADDING
+    if isinstance(layout, basestring):
+        layout = Layout.load(layout)
+    records = list(records)
+    results = []
+    fields = _fields(layout, style or DEFAULT_STYLE, padding or DEFAULT_PADDING)
+    for order, (name, page, value, fieldStyle, width, height, fieldPadding) in enumerate(fields):
+        if value is not None:
+            indexes = [None]
+            texts = [value if isinstance(value, basestring) else str(value)]
+        else:
+            indexes = []
+            texts = []
+            for i, record in enumerate(records):
+                text = record.get(name)
+                if text is not None:
+                    indexes.append(i)
+                    texts.append(text if isinstance(text, basestring) else str(text))
+        for i, fits, shrink, lines, overflow in fit_texts(texts, fieldStyle, width, height,
+                fieldPadding, onlyOverflow):
+            results.append((order, FieldFit(indexes[i], name, page, fits, shrink, lines, overflow)))
+    results.sort(key=lambda result: (-1 if result[1].record is None else result[1].record,
+        result[0]))
+    return [result for _, result in results]
@@ -0,0 +1,286 @@
+"""
+Command line mail merge.
+
+Fills out a template once per record of a CSV or JSON lines file (or stdin)
+using a JSON :class:`.Layout`::
+
+    pdfformfiller myform.pdf mylayout.json records.csv -o outdir/
+    pdfformfiller myform.pdf mylayout.json records.jsonl -o filled.zip
+    cat records.jsonl | pdfformfiller myform.pdf mylayout.json -o all.pdf
+
+Records are read lazily and filled by :func:`.iter_fill`, and each pdf is
+written out as soon as it's done, so memory use doesn't depend on the number
+of records. Records that fail are reported and skipped.
+
+With ``--share-template``, combined pdf output draws each page of the
+template from a single shared copy (see :class:`.SharedTemplateWriter`), so
+the output only grows with the text of each record. The records are then
+filled in this process rather than by worker processes.
+
+TrueType fonts for the layout's styles are registered with ``--font``::
+
+    pdfformfiller myform.pdf mylayout.json records.csv -o all.pdf --font DejaVu=DejaVuSans.ttf
+"""
+import io
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from string import Formatter
+import zipfile
+from itertools import chain
+from reportlab.pdfbase.ttfonts import TTFError
+
+from .batch import iter_fill
+from .layout import Layout, LayoutError
+from .template import PdfTemplate
+from .pdfformfiller import PdfFormFiller, OVERLAY_MODES, ENGINES, MERGE_MODES
+from .backends import BACKENDS
+from .serialize import ConcatenatedWriter, SharedTemplateWriter
+from .fonts import FontSubsets, register_font
+
+INPUT_FORMATS = ("csv", "jsonl")
+OUTPUT_FORMATS = ("dir", "zip", "pdf")
+
+def read_records(lines, fmt=None, onError=None):
+    """Parse records lazily from lines of CSV or JSON lines.
+
+    Args:
+        lines (iterable): Lines of text (e.g. an open file)
+
+    Keyword Args:
+        fmt (str): ``"csv"`` or ``"jsonl"``. Default is None (guess from the
+            first line, which is a JSON object for JSON lines).
+        onError (callable): Called as ``onError(lineno, message)`` for lines
+            that can't be parsed, which are skipped. Default is None (raise
+            ``ValueError``).
+
+    Yields:
+        dict: Each record
+    """
+    lines = iter(lines)
+    if fmt is None:
+        first = next(lines, "")
+        fmt = "jsonl" if first.lstrip().startswith("{") else "csv"
+        lines = chain([first], lines)
+
+    if fmt == "csv":
+        for row in csv.DictReader(lines):
+            yield row
+        return
+
+    for lineno, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("record is not a JSON object")
+        except ValueError as e:
+            if onError is None:
+                raise ValueError("line {}: {}".format(lineno, e))
+            onError(lineno, "invalid JSON: {}".format(e))
+            continue
+        yield record
+
+def output_format(path):
+    "Guess the output format from the output path"
+    if path == "-" or path.lower().endswith(".pdf"):
+        return "pdf"
+    if path.lower().endswith(".zip"):
+        return "zip"
+    return "dir"
+
+def filename(pattern, index, record):
+    "Output file name for a record, from a pattern like ``{index}.pdf``"
+    # a record field called "index" doesn't clash with the record's index
+    name = pattern.format(index, **dict(record, index=index))
+    return name.replace("/", "_").replace(os.sep, "_")
+
+def iter_shared(writer, template, layout, records, **kwargs):
+    """Fill out records straight into a :class:`.SharedTemplateWriter`.
+
+    Yields:
+        tuple: ``(index, record, error)`` for each record, where error is
+        the exception if the record failed, or None
+    """
+    for index, record in enumerate(records):
+        try:
+            filler = PdfFormFiller(template, **kwargs)
+            layout(filler, record)
+            # all the record's pages are filled out before any are written,
+            # so a record that fails doesn't leave anything in the output
+            writer.add(filler)
+        except Exception as e:
+            yield index, record, e
+        else:
+            yield index, record, None
+
+class Progress(object):
+    "Reports progress and errors to a stream (usually stderr)"
+    def __init__(self, stream, quiet=False, interval=1.0):
+        self.stream = stream
+        self.quiet = quiet
+        self.interval = interval
+        self.start = self.last = time.time()
+        self.count = 0
+        self.errors = 0
+
+    def error(self, message):
+        self.errors += 1
+        self.stream.write("error: {}\n".format(message))
+
+    def done(self):
+        self.count += 1
+        now = time.time()
+        if not self.quiet and now - self.last >= self.interval:
+            self.last = now
+            self.report()
+
+    def report(self):
+        elapsed = time.time() - self.start
+        self.stream.write("{} filled, {} errors, {:.1f}/s\n".format(
+            self.count, self.errors, self.count / elapsed if elapsed else 0.0))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="pdfformfiller",
+        description="Fill out a pdf template for each record of a CSV or JSON lines file.")
+    parser.add_argument("template", help="the pdf to fill out")
+    parser.add_argument("layout", help="JSON layout of the fields")
+    parser.add_argument("records", nargs="?", default="-",
+        help="CSV or JSON lines file of records (default - for stdin)")
+    parser.add_argument("-o", "--output", required=True,
+        help="output directory, .zip file, or .pdf file (- for stdout) of all the records")
+    parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS,
+        help="output format (default: guessed from the output)")
+    parser.add_argument("-i", "--input-format", choices=INPUT_FORMATS,
+        help="input format (default: guessed from the first line)")
+    parser.add_argument("-n", "--name", default="{index}.pdf",
+        help="file name pattern for directory and zip output, using the record's "
+            "fields and {index} (default {index}.pdf)")
+    parser.add_argument("-w", "--workers", type=int,
+        help="number of worker processes (default: one per cpu, 0 for none)")
+    parser.add_argument("--engine", choices=ENGINES, default="reportlab",
+        help="how to render the text fields (default reportlab)")
+    parser.add_argument("--overlay", choices=OVERLAY_MODES, default="document",
+        help="how to render the reportlab overlays (default document)")
+    parser.add_argument("--merge", choices=MERGE_MODES, default="parse",
+        help="how to merge the text into the pages (default parse)")
+    parser.add_argument("--backend", choices=("auto",) + BACKENDS, default="pypdf2",
+        help="pdf library that merges and writes the pdfs (default pypdf2)")
+    parser.add_argument("--font", action="append", default=[], metavar="NAME=PATH",
+        help="register a TrueType font for the layout's styles to use (can be repeated)")
+    parser.add_argument("--share-template", action="store_true",
+        help="for .pdf output, write the template's pages once and draw them on every "
+            "record's pages (fills in this process, ignoring --workers)")
+    parser.add_argument("-q", "--quiet", action="store_true",
+        help="don't report progress (errors are still reported)")
+    args = parser.parse_args(argv)
+    try:
+        list(Formatter().parse(args.name))
+    except ValueError as e:
+        parser.error("bad --name pattern {!r}: {}".format(args.name, e))
+    return args
+
+def main(argv=None, stdin=None, stdout=None, stderr=None):
+    """Run the command line tool.
+
+    Returns:
+        int: Exit status (0 if every record was filled out, 1 if some failed)
+    """
+    args = parse_args(argv)
+    stderr = stderr or sys.stderr
+    progress = Progress(stderr, quiet=args.quiet)
+
+    try:
+        fonts = {}
+        for font in args.font:
+            name, sep, path = font.partition("=")
+            if not sep:
+                raise ValueError("--font must be NAME=PATH, not {!r}".format(font))
+            register_font(name, path)
+            fonts[name] = path
+        template = PdfTemplate(args.template, backend=args.backend)
+        plan = Layout.load(args.layout).compile(template, fonts=fonts)
+    except (IOError, ImportError, LayoutError, ValueError, TTFError) as e:
+        stderr.write("error: {}\n".format(e))
+        return 2
+
+    fmt = args.format or output_format(args.output)
+    if args.share_template and fmt != "pdf":
+        stderr.write("error: --share-template needs .pdf output\n")
+        return 2
+
+    if args.records == "-":
+        lines = stdin or sys.stdin
+    else:
+        try:
+            lines = io.open(args.records, encoding="utf-8", newline="")
+        except (IOError, OSError) as e:
+            stderr.write("error: {}\n".format(e))
+            return 2
+    records = read_records(lines, args.input_format,
+        lambda lineno, message: progress.error("line {}: {}".format(lineno, message)))
+
+    options = dict(engine=args.engine, overlay=args.overlay, merge=args.merge, fonts=fonts)
+    if fmt == "dir":
+        if not os.path.isdir(args.output):
+            os.makedirs(args.output)
+        def save(index, record, data):
+            with open(os.path.join(args.output, filename(args.name, index, record)), "wb") as f:
+                f.write(data)
+        close = lambda: None
+    elif fmt == "zip":
+        archive = zipfile.ZipFile(args.output, "w", zipfile.ZIP_DEFLATED)
+        save = lambda index, record, data: archive.writestr(filename(args.name, index, record), data)
+        close = archive.close
+    else:
+        if args.output == "-":
+            stream = stdout or getattr(sys.stdout, "buffer", sys.stdout)
+        else:
+            stream = open(args.output, "wb")
+        if args.share_template:
+            combined = SharedTemplateWriter(stream, plan.template)
+            save = lambda index, record, data: None
+        else:
+            combined = ConcatenatedWriter(stream)
+            save = lambda index, record, data: combined.add(data)
+        def close():
+            combined.close()
+            if args.output != "-":
+                stream.close()
+
+    if args.share_template:
+        # the records' TrueType subsets only grow, so once no new characters
+        # turn up, every record embeds the same subset and it's written once
+        results = iter_shared(combined, plan.template, plan, records,
+            subsets=FontSubsets(), **options)
+    else:
+        results = iter_fill(plan.template, plan, records, workers=args.workers,
+            errors="yield", **options)
+    try:
+        for index, record, data in results:
+            if isinstance(data, Exception):
+                progress.error("record {}: {}: {}".format(index, type(data).__name__, data))
+                continue
+            try:
+                save(index, record, data)
+            except (KeyError, IndexError, ValueError, AttributeError, TypeError) as e:
+                progress.error("record {}: bad --name pattern: {!r}".format(index, e))
+                continue
+            except (IOError, OSError) as e:
+                progress.error("record {}: {}".format(index, e))
+                continue
+            progress.done()
+    finally:
+        close()
+        if lines is not sys.stdin and lines is not stdin:
+            lines.close()
+    if not args.quiet:
+        progress.report()
+    return 1 if progress.errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
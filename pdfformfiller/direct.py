@@ -0,0 +1,168 @@
+"""
+Fast rendering of plain text fields directly into a page's content stream.
+
+Rendering a text field with reportlab (see :meth:`.PdfFormFiller.write`)
+means building a ``Frame``, ``Paragraph`` and ``KeepInFrame`` for the field,
+serializing a whole overlay pdf, parsing it again and merging it into the
+page. For plain text in one of the standard 14 pdf fonts, all of that
+boils down to a handful of ``BT ... Tj ... ET`` text operators, so this
+module writes those operators itself and appends them to the page.
+
+Fields that can't be rendered this way (e.g. paragraph markup, embedded
+fonts, justified text) are left for reportlab.
+"""
+from reportlab.pdfbase.pdfmetrics import standardFonts
+from reportlab.lib.fonts import tt2ps
+from reportlab.lib.colors import Color, CMYKColor
+from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT
+from reportlab.lib.rl_accel import fp_str
+from PyPDF2.generic import NameObject, DictionaryObject
+
+from .fit import DEFAULT_FITTER
+from .merge import add_contents, stream
+
+# Symbol and ZapfDingbats have their own built-in encodings
+DIRECT_FONTS = frozenset(standardFonts) - frozenset(["Symbol", "ZapfDingbats"])
+DIRECT_ALIGNMENTS = (TA_LEFT, TA_CENTER, TA_RIGHT)
+
+def font_name(style):
+    """Returns the standard pdf font used by a style, or None if the style's
+    font isn't one that can be rendered directly."""
+    try:
+        name = tt2ps(style.fontName, 0, 0)
+    except ValueError:
+        name = style.fontName
+    return name if name in DIRECT_FONTS else None
+
+def can_render(text, style):
+    "Whether a text field can be rendered without reportlab"
+    if "<" in text or "&" in text:
+        return False
+    if font_name(style) is None or style.alignment not in DIRECT_ALIGNMENTS:
+        return False
+    if style.firstLineIndent or style.leftIndent or style.rightIndent:
+        return False
+    if style.backColor or style.borderWidth or getattr(style, "textTransform", None):
+        return False
+    if isinstance(style.textColor, CMYKColor) or not isinstance(style.textColor, Color):
+        return False
+    try:
+        text.encode("cp1252")
+    except (UnicodeError, AttributeError):
+        return False
+    return True
+
+def escape(text):
+    "Encode a string as a pdf string literal"
+    data = text.encode("cp1252")
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+class DirectRenderer(object):
+    """Renders plain text fields for one page into content stream operators.
+
+    Args:
+        page (PageObject): The page the fields will be added to
+        style (ParagraphStyle): Default style for fields without one
+        boxes (bool or tuple): Bounding box color (see :class:`.PdfFormFiller`)
+        fitter (TextFitter): Used to shrink text that doesn't fit
+
+    Attributes:
+        count (int): Number of fields rendered
+        shrunk (int): Number of those fields that were shrunk to fit
+    """
+    def __init__(self, page, style, boxes=False, fitter=DEFAULT_FITTER):
+        self.page = page
+        self.style = style
+        self.boxes = boxes
+        self.fitter = fitter
+        self.fonts = {}
+        self.ops = []
+        self.count = 0
+        self.shrunk = 0
+        resources = page.get("/Resources", DictionaryObject()).getObject()
+        self.pageFonts = resources.get("/Font", DictionaryObject()).getObject()
+
+    def _font_resource(self, baseFont):
+        "Pick a resource name for a font that doesn't clash with the page's"
+        if baseFont not in self.fonts:
+            used = set(self.pageFonts) | set(self.fonts.values())
+            n = len(self.fonts) + 1
+            while "/FF{}".format(n) in used:
+                n += 1
+            self.fonts[baseFont] = "/FF{}".format(n)
+        return self.fonts[baseFont]
+
+    def add(self, field):
+        """Render a field if possible.
+
+        Returns:
+            bool: False if the field needs to be rendered by reportlab instead
+        """
+        style = field.style or self.style
+        if not can_render(field.text, style):
+            return False
+        lp, bp, rp, tp = field.padding
+        innerWidth = field.width - lp - rp
+        baseFont = font_name(style)
+        fontSize = style.fontSize
+        leading = style.leading
+        scale, lines = self.fitter.fit(field.text, style, baseFont,
+            field.width, field.height, field.padding)
+        self.count += 1
+        if scale != 1.0:
+            self.shrunk += 1
+
+        if self.boxes:
+            self.ops.append(b"q " + fp_str(*self.boxes).encode() + b" RG "
+                + fp_str(field.x1, field.y1, field.width, field.height).encode()
+                + b" re S Q")
+        if not lines:
+            return True
+
+        # each font gets one resource name per page
+        resource = self._font_resource(baseFont)
+
+        # origin is the top left of the text box, scaled like KeepInFrame
+        top = field.y1 + field.height - tp
+        self.ops.append(b"q " + fp_str(1.0 / scale, 0, 0, 1.0 / scale, field.x1 + lp, top).encode() + b" cm")
+        self.ops.append(b"BT " + resource.encode() + b" " + fp_str(fontSize).encode() + b" Tf "
+            + fp_str(*style.textColor.rgb()).encode() + b" rg")
+        availWidth = innerWidth * scale
+        for i, (lineWidth, words) in enumerate(lines):
+            if style.alignment == TA_CENTER:
+                x = (availWidth - lineWidth) / 2.0
+            elif style.alignment == TA_RIGHT:
+                x = availWidth - lineWidth
+            else:
+                x = 0
+            y = -(fontSize + i * leading)
+            self.ops.append(b"1 0 0 1 " + fp_str(x, y).encode() + b" Tm "
+                + escape(" ".join(words)) + b" Tj")
+        self.ops.append(b"ET Q")
+        return True
+
+    def apply(self):
+        """Append the rendered operators to the page.
+
+        The fonts are added to the page's resources and the operators are
+        appended with :func:`.add_contents`. The page is modified, so it
+        should be a copy of the template's page.
+        """
+        if not self.ops:
+            return
+        page = self.page
+        resources = DictionaryObject()
+        resources.update(page.get("/Resources", DictionaryObject()).getObject())
+        fonts = DictionaryObject()
+        fonts.update(resources.get("/Font", DictionaryObject()).getObject())
+        for baseFont, resource in sorted(self.fonts.items()):
+            fonts[NameObject(resource)] = DictionaryObject({
+                NameObject("/Type"): NameObject("/Font"),
+                NameObject("/Subtype"): NameObject("/Type1"),
+                NameObject("/BaseFont"): NameObject("/" + baseFont),
+                NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+            })
+        resources[NameObject("/Font")] = fonts
+        page[NameObject("/Resources")] = resources
+
+        add_contents(page, stream(b"\n".join(self.ops) + b"\n"))
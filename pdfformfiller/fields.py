@@ -0,0 +1,147 @@
+"""
+Compact storage for forms with thousands of text fields.
+
+By default a :class:`.PdfFormFiller` keeps a list of :class:`.TextField`
+tuples per page, which costs a tuple, a list slot and several float objects
+per field. :class:`.FieldTable` stores the same fields in columns instead:
+coordinates are packed into ``array`` columns and styles and paddings are
+interned, so each is only stored once per page.
+"""
+from array import array
+try:
+    from collections.abc import MutableSequence
+except ImportError:
+    from collections import MutableSequence
+
+from .pdfformfiller import TextField
+
+class FieldTable(MutableSequence):
+    """A list-like table of :class:`.TextField` objects.
+
+    It behaves like the list of text fields for a page (indexing returns
+    :class:`.TextField` tuples, and ``append``, ``del``, iteration, etc. all
+    work), but stores the fields in compact columns.
+
+    Args:
+        fields (iterable): Initial :class:`.TextField` objects
+    """
+    __slots__ = ("texts", "x1", "y1", "width", "height", "styleIds", "paddingIds",
+        "_styles", "_paddings", "_styleIndex", "_paddingIndex")
+
+    def __init__(self, fields=()):
+        self.texts = []
+        self.x1 = array("d")
+        self.y1 = array("d")
+        self.width = array("d")
+        self.height = array("d")
+        self.styleIds = array("I")
+        self.paddingIds = array("I")
+        self._styles = []
+        self._paddings = []
+        self._styleIndex = {}
+        self._paddingIndex = {}
+        self.extend(fields)
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__
+            if name != "_styleIndex")
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        # styles are interned by identity, which changes when unpickled
+        self._styleIndex = dict((id(style), i) for i, style in enumerate(self._styles))
+
+    def _style_id(self, style):
+        # styles are interned by identity, None is a valid style
+        key = id(style)
+        if key not in self._styleIndex:
+            self._styleIndex[key] = len(self._styles)
+            self._styles.append(style)
+        return self._styleIndex[key]
+
+    def _padding_id(self, padding):
+        key = tuple(padding)
+        if key not in self._paddingIndex:
+            self._paddingIndex[key] = len(self._paddings)
+            self._paddings.append(key)
+        return self._paddingIndex[key]
+
+    def __len__(self):
+        return len(self.texts)
+
+    def _field(self, i):
+        return TextField(self.texts[i], self.x1[i], self.y1[i], self.width[i],
+            self.height[i], self._styles[self.styleIds[i]],
+            self._paddings[self.paddingIds[i]])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._field(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("field index out of range")
+        return self._field(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._field(i)
+
+    def __setitem__(self, i, field):
+        if isinstance(i, slice):
+            raise TypeError("FieldTable doesn't support slice assignment")
+        self.texts[i] = field.text
+        self.x1[i] = field.x1
+        self.y1[i] = field.y1
+        self.width[i] = field.width
+        self.height[i] = field.height
+        self.styleIds[i] = self._style_id(field.style)
+        self.paddingIds[i] = self._padding_id(field.padding)
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            for j in sorted(range(*i.indices(len(self))), reverse=True):
+                del self[j]
+            return
+        for column in (self.texts, self.x1, self.y1, self.width, self.height,
+                self.styleIds, self.paddingIds):
+            del column[i]
+
+    def insert(self, i, field):
+        self.texts.insert(i, field.text)
+        self.x1.insert(i, field.x1)
+        self.y1.insert(i, field.y1)
+        self.width.insert(i, field.width)
+        self.height.insert(i, field.height)
+        self.styleIds.insert(i, self._style_id(field.style))
+        self.paddingIds.insert(i, self._padding_id(field.padding))
+
+    def append(self, field):
+        self.insert(len(self), field)
+
+    def extend_columns(self, texts, x1, y1, width, height, style, padding):
+        """Append many fields that share a style and padding.
+
+        Args:
+            texts (list[str]): Text of each field
+            x1, y1, width, height (iterable): Bottom left coordinates and size
+                of each field
+            style (ParagraphStyle or None): Style of all the fields
+            padding (tuple): Padding of all the fields
+        """
+        texts = list(texts)
+        columns = [array("d", column) for column in (x1, y1, width, height)]
+        count = len(texts)
+        if any(len(column) != count for column in columns):
+            raise ValueError("Columns must all be the same length")
+        self.texts.extend(texts)
+        self.x1.extend(columns[0])
+        self.y1.extend(columns[1])
+        self.width.extend(columns[2])
+        self.height.extend(columns[3])
+        self.styleIds.extend(array("I", [self._style_id(style)]) * count)
+        self.paddingIds.extend(array("I", [self._padding_id(padding)]) * count)
+
+    def __repr__(self):
+        return "<FieldTable of {} fields>".format(len(self))
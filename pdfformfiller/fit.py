@@ -0,0 +1,258 @@
+"""
+Memoized shrink-to-fit calculations for text fields.
+
+Text that doesn't fit into its box gets shrunk. reportlab's ``KeepInFrame``
+finds the shrink factor by re-wrapping the paragraph at several decreasing
+scales, which is paid for every field of every pdf even though most field
+values (names of states, dates, fixed labels) are the same over and over.
+:class:`.TextFitter` remembers the final scale for each combination of text,
+style and box size in a size-bounded LRU cache, so a repeated value costs a
+dictionary lookup.
+"""
+from threading import Lock
+from collections import namedtuple, OrderedDict
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import KeepInFrame
+from reportlab.platypus.flowables import _listWrapOn, _FUZZ
+
+FitCacheInfo = namedtuple("FitCacheInfo", ["hits", "misses", "maxsize", "currsize"])
+"""
+Cache statistics returned by :meth:`.TextFitter.cache_info`.
+
+Attributes:
+    hits (int): Number of fits looked up in the cache
+    misses (int): Number of fits that had to be calculated
+    maxsize (int): Maximum number of fits kept in the cache
+    currsize (int): Number of fits currently in the cache
+"""
+
+def wrap(words, widths, spaceWidth, maxWidth):
+    """Break words into lines no wider than maxWidth.
+
+    Args:
+        words (list[str]): Words to wrap
+        widths (list[float]): Width of each word
+        spaceWidth (float): Width of the space between words
+        maxWidth (float): Maximum width of a line
+
+    Returns:
+        list[tuple]: ``(width, words)`` for each line
+    """
+    lines = []
+    line = []
+    lineWidth = 0
+    for word, width in zip(words, widths):
+        if line and lineWidth + spaceWidth + width > maxWidth:
+            lines.append((lineWidth, line))
+            line = []
+        lineWidth = lineWidth + spaceWidth + width if line else width
+        line.append(word)
+    if line:
+        lines.append((lineWidth, line))
+    return lines
+
+def solve(text, fontName, fontSize, leading, width, height):
+    """Find how much to shrink some plain text so it fits into a box.
+
+    Like reportlab's ``KeepInFrame``, the text is wrapped to ``width * scale``
+    and then drawn scaled down by ``1 / scale``. Words are measured once with
+    ``stringWidth`` and the smallest scale (i.e. the largest text) for which
+    the text fits is found with a binary search.
+
+    Returns:
+        tuple: ``(scale, lines)`` where lines is a list of ``(width, words)``
+    """
+    words = text.split()
+    widths = [stringWidth(w, fontName, fontSize) for w in words]
+    spaceWidth = stringWidth(" ", fontName, fontSize)
+    return solve_words(words, widths, spaceWidth, leading, width, height)
+
+def solve_words(words, widths, spaceWidth, leading, width, height):
+    """Like :func:`solve`, for words that have already been measured.
+
+    Args:
+        words (list[str]): Words of the text
+        widths (list[float]): Width of each word
+        spaceWidth (float): Width of the space between words
+        leading (float): Height of each line
+        width (float): Width of the box
+        height (float): Height of the box
+
+    Returns:
+        tuple: ``(scale, lines)`` where lines is a list of ``(width, words)``
+    """
+    def fits(scale):
+        lines = wrap(words, widths, spaceWidth, width * scale)
+        ok = (len(lines) * leading <= height * scale
+            and all(w <= width * scale for w, _ in lines))
+        return ok, lines
+
+    ok, lines = fits(1.0)
+    if ok or not words or width <= 0 or height <= 0:
+        return 1.0, lines
+
+    # at this scale everything fits on one line
+    lo = 1.0
+    hi = max(sum(widths) + spaceWidth * (len(words) - 1), 0) / width
+    hi = max(hi, leading / float(height), lo) * 1.0001
+    best = fits(hi)[1]
+    while hi - lo > hi * 1e-4:
+        mid = (lo + hi) / 2.0
+        ok, midLines = fits(mid)
+        if ok:
+            hi, best = mid, midLines
+        else:
+            lo = mid
+    return hi, best
+
+class TextFitter(object):
+    """Calculates (and remembers) how much text fields need to shrink.
+
+    Keyword Args:
+        maxsize (int): Maximum number of fits to remember. The least recently
+            used fits are forgotten first. Default is 4096. Use ``0`` to
+            disable the cache.
+
+    Note:
+        Styles are part of the cache key by identity (along with their font
+        name, size and leading), so reuse the same ``ParagraphStyle``
+        objects between fills to get cache hits.
+
+    """
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    def _get(self, key):
+        with self._lock:
+            try:
+                value = self._cache.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._cache[key] = value
+            self.hits += 1
+            return value
+
+    def _put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._cache[key] = value
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def _key(self, kind, text, style, width, height, padding):
+        return (kind, text, style, style.fontName, style.fontSize, style.leading,
+            width, height, tuple(padding))
+
+    def fit(self, text, style, fontName, width, height, padding):
+        """Shrink plain text to fit in a box.
+
+        Args:
+            text (str): Plain text (no markup) of the field
+            style (ParagraphStyle): Style of the field
+            fontName (str): Standard pdf font name for the style
+            width (int or float): Width of the field
+            height (int or float): Height of the field
+            padding (tuple): Padding of the field
+
+        Returns:
+            tuple: ``(scale, lines)``, see :func:`.solve`
+        """
+        key = self._key("plain", text, style, width, height, padding)
+        value = self._get(key)
+        if value is None:
+            lp, bp, rp, tp = padding
+            value = solve(text, fontName, style.fontSize, style.leading,
+                width - lp - rp, height - tp - bp)
+            self._put(key, value)
+        return value
+
+    def keep_in_frame(self, content, text, style, width, height, padding):
+        """Create a ``KeepInFrame`` that remembers its shrink factor.
+
+        Args:
+            content (list): Flowables to keep in the frame
+            text (str): Text of the field
+            style (ParagraphStyle): Style of the field
+            width (int or float): Width of the field
+            height (int or float): Height of the field
+            padding (tuple): Padding of the field
+
+        Returns:
+            KeepInFrame
+        """
+        key = self._key("frame", text, style, width, height, padding)
+        return CachedKeepInFrame(self, key, width, height, content)
+
+    def cache_info(self):
+        """Returns hit/miss statistics for the cache.
+
+        Returns:
+            :class:`.FitCacheInfo`
+        """
+        with self._lock:
+            return FitCacheInfo(self.hits, self.misses, self.maxsize, len(self._cache))
+
+    def cache_clear(self):
+        "Forget all the remembered fits and reset the statistics"
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+class CachedKeepInFrame(KeepInFrame):
+    """A ``KeepInFrame`` (in shrink mode) whose scale is looked up in a
+    :class:`.TextFitter` instead of being searched for every time. The
+    content is still wrapped once at the final scale so it can be drawn.
+
+    Attributes:
+        passes (int): Number of times the content was wrapped (1 if the
+            scale was cached, more if it had to be searched for)
+    """
+    def __init__(self, fitter, key, maxWidth, maxHeight, content):
+        KeepInFrame.__init__(self, maxWidth, maxHeight, content)
+        self._fitter = fitter
+        self._key = key
+        self.passes = 0
+
+    def _counted_wrap(self, availWidth, availHeight):
+        "KeepInFrame.wrap, counting how many times the content is wrapped"
+        def counter(wrap):
+            def counted(*args):
+                self.passes += 1
+                return wrap(*args)
+            return counted
+        for flowable in self._content:
+            flowable.wrap = counter(flowable.wrap)
+        try:
+            return KeepInFrame.wrap(self, availWidth, availHeight)
+        finally:
+            for flowable in self._content:
+                del flowable.wrap
+
+    def wrap(self, availWidth, availHeight):
+        maxWidth = float(min(self.maxWidth or availWidth, availWidth))
+        maxHeight = float(min(self.maxHeight or availHeight, availHeight))
+        key = self._key + (maxWidth, maxHeight)
+        scale = self._fitter._get(key)
+        if scale is None:
+            size = self._counted_wrap(availWidth, availHeight)
+            self._fitter._put(key, getattr(self, "_scale", 1.0))
+            return size
+
+        W, H = _listWrapOn(self._content, scale * maxWidth, self.canv, fakeWidth=self.fakeWidth)
+        self.passes += 1
+        if scale != 1.0:
+            self._scale = scale
+            W /= scale
+            H /= scale
+        self.width = W - _FUZZ
+        self.height = H - _FUZZ
+        return self.width, self.height
+
+DEFAULT_FITTER = TextFitter()
@@ -0,0 +1,186 @@
+"""
+Embedded TrueType fonts, with one subset shared by every overlay.
+
+The standard pdf fonts only have Latin characters, so text in other scripts
+needs a TrueType font, which reportlab embeds as a subset of the glyphs the
+overlay uses. Glyphs get their codes in the order they're first drawn, so
+every canvas embeds a different subset: with ``overlay="page"`` a 100 page
+pdf carries 100 copies of the font, and every pdf of a batch carries another.
+
+:func:`register_font` parses each font file once per process, and remembers
+the last subsets built from it. :class:`FontSubsets` collects the characters
+the text fields use, and gives them the same codes in every canvas before
+anything is drawn. Every canvas then embeds an identical subset, which the
+writers recognize by its content (see :func:`.font_key`) and write only once.
+"""
+import os
+from threading import Lock
+from collections import OrderedDict
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.lib.fonts import tt2ps
+from PyPDF2.generic import IndirectObject, DictionaryObject, NameObject
+
+from .serialize import font_key
+
+_fonts = {}
+_fontsLock = Lock()
+
+def _remember_subsets(makeSubset, maxsize=16):
+    "Wrap a font face's ``makeSubset`` to remember the subsets it built"
+    subsets = OrderedDict()
+    lock = Lock()
+    def cached(subset):
+        key = tuple(subset)
+        with lock:
+            data = subsets.pop(key, None)
+            if data is not None:
+                subsets[key] = data
+                return data
+        data = makeSubset(subset)
+        with lock:
+            subsets[key] = data
+            while len(subsets) > maxsize:
+                subsets.popitem(last=False)
+        return data
+    return cached
+
+def register_font(name, path, subfontIndex=0):
+    """Register a TrueType font with reportlab, so styles can use it by name.
+
+    Each font file is parsed once per process: registering the same name
+    and file again (e.g. for every filler of a batch) reuses the parsed font.
+
+    Args:
+        name (str): Font name for styles to use (``fontName``)
+        path (str): Path to the ``.ttf`` (or ``.ttc``) file
+
+    Keyword Args:
+        subfontIndex (int): Font to use from a ``.ttc`` collection
+
+    Returns:
+        TTFont: The registered font
+    """
+    key = (name, os.path.realpath(path), subfontIndex)
+    with _fontsLock:
+        font = _fonts.get(key)
+        if font is None:
+            font = _fonts[key] = TTFont(name, path, subfontIndex=subfontIndex)
+            font.face.makeSubset = _remember_subsets(font.face.makeSubset)
+        if name not in pdfmetrics.getRegisteredFontNames() or pdfmetrics.getFont(name) is not font:
+            pdfmetrics.registerFont(font)
+    return font
+
+def truetype_font(fontName):
+    """The registered TrueType font for a style's font name.
+
+    Returns:
+        TTFont or None: None for the standard fonts (and fonts that aren't
+        registered)
+    """
+    try:
+        fontName = tt2ps(fontName, 0, 0)
+    except ValueError:
+        pass
+    if fontName not in pdfmetrics.getRegisteredFontNames():
+        return None
+    font = pdfmetrics.getFont(fontName)
+    return font if isinstance(font, TTFont) else None
+
+class FontSubsets(object):
+    """The characters of each TrueType font used by some text fields.
+
+    Every filler collects the characters of its own fields before it renders
+    them, so all of its overlays share one subset. To share one subset
+    between all the pdfs of a batch (e.g. written with a
+    :class:`.SharedTemplateWriter`), pass the same ``FontSubsets`` to every
+    filler as ``subsets`` and :meth:`add_filler` all of them before writing
+    any.
+
+    Attributes:
+        chars (dict): Font name to its characters, in the order they were
+            added (which is the order they're given their codes in)
+    """
+    def __init__(self):
+        self.chars = {}
+        self._lock = Lock()
+
+    def add(self, fontName, text):
+        """Add the characters of some text.
+
+        Returns:
+            bool: False if the font isn't a TrueType font (nothing is added)
+        """
+        font = truetype_font(fontName)
+        if font is None:
+            return False
+        with self._lock:
+            chars = self.chars.setdefault(font.fontName, OrderedDict())
+            for char in text:
+                if char not in chars:
+                    chars[char] = None
+        return True
+
+    def add_filler(self, filler):
+        "Add the characters of all of a filler's text fields"
+        fonts = {}
+        for pagenum in sorted(filler):
+            for field in filler[pagenum]:
+                style = field.style or filler.style
+                if id(style) not in fonts:
+                    fonts[id(style)] = truetype_font(style.fontName) is not None
+                if fonts[id(style)]:
+                    self.add(style.fontName, field.text)
+
+    def assign(self, doc):
+        """Give the characters their codes in a reportlab document, before
+        anything is drawn on it.
+
+        Args:
+            doc (PDFDocument): The document of a canvas (``canvas._doc``)
+        """
+        for fontName, text in self.key():
+            pdfmetrics.getFont(fontName).splitString(text, doc)
+
+    def key(self):
+        """The characters of every font, e.g. for a cache key.
+
+        Returns:
+            tuple: ``(fontName, characters)`` for each font, by name
+        """
+        with self._lock:
+            return tuple(sorted((fontName, u"".join(chars))
+                for fontName, chars in self.chars.items()))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+def share_fonts(pages):
+    """Point the font resources of overlay pages at one copy of each
+    identical font (e.g. the same subset embedded by each page's canvas), so
+    it's only written once.
+
+    Args:
+        pages (list[PageObject]): The overlay pages (modified in place)
+    """
+    shared = {}
+    for page in pages:
+        resources = page.get("/Resources")
+        fonts = resources.getObject().get("/Font") if resources is not None else None
+        if fonts is None:
+            continue
+        fonts = fonts.getObject()
+        if not isinstance(fonts, DictionaryObject):
+            continue
+        for name, ref in list(fonts.items()):
+            if not isinstance(ref, IndirectObject):
+                continue
+            key = font_key(ref.getObject())
+            if key is not None:
+                fonts[NameObject(name)] = shared.setdefault(key, ref)
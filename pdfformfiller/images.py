@@ -0,0 +1,228 @@
+"""
+Images (signatures, logos) stamped onto pages as shared image XObjects.
+
+Drawing an image with reportlab embeds it in the overlay pdf, so a logo on
+every page of every pdf is decoded, compressed and written over and over.
+Here each distinct image is converted to an image XObject once, kept in an
+:class:`.ImageCache` shared by all fillers, and referenced from the pages
+that use it. Writers copy it once per output pdf no matter how many pages
+draw it, and :class:`.ConcatenatedWriter` writes it once for a whole batch.
+"""
+import zlib
+import hashlib
+from io import BytesIO
+from threading import Lock
+from collections import namedtuple, OrderedDict
+from reportlab.lib.utils import ImageReader
+from reportlab.lib.rl_accel import fp_str
+from PyPDF2.generic import (IndirectObject, NameObject, NumberObject, DictionaryObject,
+    ArrayObject, EncodedStreamObject)
+try:
+    basestring
+except NameError:
+    basestring = str
+
+from .merge import add_contents, stream, unique_name
+
+COLOR_SPACES = {"L": "/DeviceGray", "RGB": "/DeviceRGB", "CMYK": "/DeviceCMYK"}
+
+ImageField = namedtuple("ImageField", ["image", "x1", "y1", "width", "height"])
+"""
+An image added with :meth:`.PdfFormFiller.add_image`.
+
+Attributes:
+    image (SharedImage): The image
+    x1 (float): Distance from the left of the page to the left of the image
+    y1 (float): Distance from the bottom of the page to the bottom of the
+        image
+    width (float): Width the image is drawn at
+    height (float): Height the image is drawn at
+"""
+
+def _stream(data, attributes):
+    obj = EncodedStreamObject()
+    obj._data = data
+    for key, value in attributes.items():
+        obj[NameObject(key)] = value
+    return obj
+
+def image_xobject(reader):
+    """Convert an image to a pdf image XObject.
+
+    JPEGs are embedded as they are. Everything else is Flate compressed,
+    with any transparency as a soft mask.
+
+    Args:
+        reader (ImageReader): The image
+
+    Returns:
+        EncodedStreamObject
+    """
+    width, height = reader.getSize()
+    attributes = {
+        "/Type": NameObject("/XObject"),
+        "/Subtype": NameObject("/Image"),
+        "/Width": NumberObject(width),
+        "/Height": NumberObject(height),
+        "/BitsPerComponent": NumberObject(8),
+    }
+    jpeg = reader.jpeg_fh()
+    if jpeg is not None and reader._image.mode in ("L", "RGB"):
+        jpeg.seek(0)
+        attributes["/ColorSpace"] = NameObject(COLOR_SPACES[reader._image.mode])
+        attributes["/Filter"] = NameObject("/DCTDecode")
+        return _stream(jpeg.read(), attributes)
+
+    data = reader.getRGBData()
+    attributes["/ColorSpace"] = NameObject(COLOR_SPACES[reader.mode])
+    attributes["/Filter"] = NameObject("/FlateDecode")
+    if reader.mode == "CMYK":
+        # PIL's CMYK is inverted compared to pdf's
+        attributes["/Decode"] = ArrayObject(NumberObject(n) for n in (1, 0) * 4)
+    alpha = getattr(reader, "_dataA", None)
+    if alpha is not None:
+        attributes["/SMask"] = image_xobject(alpha)
+    return _stream(zlib.compress(data), attributes)
+
+class SharedImage(object):
+    """An image XObject that can be drawn on any number of pages and pdfs.
+
+    The image is the "pdf" its XObject belongs to (``ref`` points at it), so
+    writers treat it like an object of another pdf and copy it once per
+    output, however many pages refer to it.
+
+    Attributes:
+        digest (str): SHA-256 hex digest of the image
+        width (int): Width of the image in pixels
+        height (int): Height of the image in pixels
+        xobject (StreamObject): The image XObject
+        ref (IndirectObject): Reference to the XObject
+    """
+    def __init__(self, xobject, digest):
+        self.xobject = xobject
+        self.digest = digest
+        self.width = int(xobject["/Width"])
+        self.height = int(xobject["/Height"])
+        self.ref = IndirectObject(1, 0, self)
+
+    def getObject(self, ref):
+        return self.xobject
+
+    def __repr__(self):
+        return "<SharedImage {}x{} {}>".format(self.width, self.height, self.digest[:12])
+
+class ImageCache(object):
+    """Converted images, shared by all the fillers that use the cache.
+
+    Images are looked up by their content, so the same logo loaded from a
+    file for every record is only converted once.
+
+    Keyword Args:
+        maxsize (int): Maximum number of images to keep. The least recently
+            used images are dropped first. Default is 128.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, image):
+        """Convert an image, or return the cached conversion.
+
+        Args:
+            image (str or bytes or file or PIL.Image or SharedImage): Path to
+                an image file, the file's bytes, a file-like object, or a PIL
+                image
+
+        Returns:
+            :class:`.SharedImage`
+        """
+        if isinstance(image, SharedImage):
+            return image
+        if isinstance(image, basestring):
+            with open(image, "rb") as f:
+                data = f.read()
+        elif isinstance(image, bytes):
+            data = image
+        elif hasattr(image, "read"):
+            data = image.read()
+        else:
+            # PIL image
+            data = None
+            h = hashlib.sha256(repr((image.mode, image.size)).encode("ascii"))
+            h.update(image.tobytes())
+            digest = h.hexdigest()
+        if data is not None:
+            digest = hashlib.sha256(data).hexdigest()
+
+        with self._lock:
+            shared = self._cache.pop(digest, None)
+            if shared is not None:
+                self._cache[digest] = shared
+                return shared
+
+        reader = ImageReader(image if data is None else BytesIO(data))
+        shared = SharedImage(image_xobject(reader), digest)
+        with self._lock:
+            self._cache[digest] = shared
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return shared
+
+    def __len__(self):
+        return len(self._cache)
+
+DEFAULT_IMAGE_CACHE = ImageCache()
+
+def place(image, x1, y1, width, height, preserveAspectRatio=True):
+    """Fit an image into a box.
+
+    Args:
+        image (SharedImage): The image
+        x1, y1, width, height (float): The box, with a bottom left origin
+
+    Keyword Args:
+        preserveAspectRatio (bool): Scale the image to fit in the box
+            without stretching it, centered in the box. Otherwise the image
+            fills the box. Default is ``True``.
+
+    Returns:
+        :class:`.ImageField`
+    """
+    if preserveAspectRatio:
+        scale = min(float(width) / image.width, float(height) / image.height)
+        drawnWidth, drawnHeight = image.width * scale, image.height * scale
+        x1 += (width - drawnWidth) / 2.0
+        y1 += (height - drawnHeight) / 2.0
+        width, height = drawnWidth, drawnHeight
+    return ImageField(image, x1, y1, width, height)
+
+def stamp_images(page, fields):
+    """Draw images onto a page.
+
+    Each image is added to the page's ``/XObject`` resources once and drawn
+    with a ``Do`` operator appended with :func:`.add_contents`. The page is
+    modified, so it should be a copy of the template's page.
+
+    Args:
+        page (PageObject): Page to draw on
+        fields (list[:class:`.ImageField`]): The images and where to draw them
+    """
+    if not fields:
+        return
+    resources = DictionaryObject()
+    resources.update(page.get("/Resources", DictionaryObject()).getObject())
+    xobjects = DictionaryObject()
+    xobjects.update(resources.get("/XObject", DictionaryObject()).getObject())
+    names = {}
+    ops = []
+    for field in fields:
+        name = names.get(id(field.image))
+        if name is None:
+            name = names[id(field.image)] = unique_name("/Im", xobjects)
+            xobjects[name] = field.image.ref
+        ops.append("q {} cm {} Do Q".format(
+            fp_str(field.width, 0, 0, field.height, field.x1, field.y1), name).encode("ascii"))
+    resources[NameObject("/XObject")] = xobjects
+    page[NameObject("/Resources")] = resources
+    add_contents(page, stream(b"\n".join(ops) + b"\n"))
@@ -0,0 +1,281 @@
+"""
+Named field layouts, loaded from JSON and compiled against a template.
+
+Instead of hundreds of hard coded :meth:`.PdfFormFiller.add_text` calls, a
+layout names each field and gives its page, box, style and padding::
+
+    {
+        "styles": {
+            "small": {"fontName": "Helvetica", "fontSize": 8, "leading": 10}
+        },
+        "fields": [
+            {"name": "name", "page": 0, "box": [[50, 50], [500, 100]]},
+            {"name": "ssn", "page": 0, "box": [[50, 120], [300, 140]],
+             "style": "small", "padding": [2, 2, 2, 2]},
+            {"name": "agency", "page": 0, "box": [[50, 700], [300, 720]],
+             "value": "Department of Forms"}
+        ]
+    }
+
+Compiling the layout against a :class:`.PdfTemplate` checks every box
+against its page and does all the coordinate conversion and style lookups
+once, so filling out a record is just ``plan.fill({"name": ..., "ssn": ...})``.
+
+Fields with a ``value`` are static: they are the same for every record, so
+compiling the layout renders them into a copy of the template once, and
+only the other fields are rendered for each record.
+"""
+import json
+from collections import namedtuple
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.colors import toColor
+from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT, TA_JUSTIFY
+try:
+    basestring
+except NameError:
+    basestring = str
+
+from .template import PdfTemplate
+from .pdfformfiller import PdfFormFiller, TextField, DEFAULT_STYLE
+
+def _text(value):
+    return value if isinstance(value, basestring) else str(value)
+
+ALIGNMENTS = {"left": TA_LEFT, "center": TA_CENTER, "right": TA_RIGHT, "justify": TA_JUSTIFY}
+COLOR_ATTRIBUTES = ("textColor", "backColor", "borderColor")
+
+LayoutField = namedtuple("LayoutField",
+    ["name", "page", "upperLeft", "lowerRight", "style", "padding", "value"])
+LayoutField.__new__.__defaults__ = (None,)
+"""
+A named text field in a :class:`.Layout`. Coordinates use the same top left
+origin as :meth:`.PdfFormFiller.add_text`.
+
+Attributes:
+    name (str): Name of the field (the key for its value in a record)
+    page (int): Page of the pdf the field is on (0 is first page)
+    upperLeft (tuple): (x, y) coordinates for the top left corner
+    lowerRight (tuple): (x, y) coordinates for the bottom right corner
+    style (str or None): Name of the field's style in the layout
+    padding (tuple or None): Custom padding for the field
+    value (str or None): Text of a static field, which is the same for every
+        record (None for normal fields)
+"""
+
+class LayoutError(ValueError):
+    "Raised when a layout is invalid or doesn't fit its template"
+
+def make_style(name, attributes, parent=DEFAULT_STYLE):
+    """Create a ``ParagraphStyle`` from a dict of (JSON friendly) attributes.
+
+    Alignments can be given as ``"left"``, ``"center"``, ``"right"`` or
+    ``"justify"``, and colors as names or hex strings (e.g. ``"#FF0000"``).
+    Attributes that aren't given are inherited from ``parent``.
+    """
+    attributes = dict(attributes)
+    if isinstance(attributes.get("alignment"), basestring):
+        try:
+            attributes["alignment"] = ALIGNMENTS[attributes["alignment"].lower()]
+        except KeyError:
+            raise LayoutError("Unknown alignment {!r} in style {!r}".format(
+                attributes["alignment"], name))
+    for key in COLOR_ATTRIBUTES:
+        if isinstance(attributes.get(key), basestring):
+            attributes[key] = toColor(attributes[key])
+    return ParagraphStyle(name, parent=parent, **attributes)
+
+class Layout(object):
+    """A set of named text fields.
+
+    Args:
+        fields (list[:class:`.LayoutField`]): The fields
+
+    Keyword Args:
+        styles (dict): Style name to ``ParagraphStyle`` used by the fields
+        padding (tuple): Default padding for the fields. Default is None (i.e.
+            inherit padding from the filler).
+    """
+    def __init__(self, fields, styles=None, padding=None):
+        self.fields = list(fields)
+        self.styles = dict(styles or {})
+        self.padding = padding
+        names = set()
+        for field in self.fields:
+            if field.name in names:
+                raise LayoutError("Duplicate field name {!r}".format(field.name))
+            names.add(field.name)
+            if field.style is not None and field.style not in self.styles:
+                raise LayoutError("Unknown style {!r} for field {!r}".format(field.style, field.name))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a layout from a dict (e.g. parsed JSON).
+
+        Returns:
+            :class:`.Layout`
+        """
+        styles = {}
+        for name, attributes in data.get("styles", {}).items():
+            styles[name] = make_style(name, attributes)
+        fields = []
+        for i, field in enumerate(data.get("fields", [])):
+            try:
+                upperLeft, lowerRight = field["box"]
+                fields.append(LayoutField(
+                    name=field["name"],
+                    page=int(field.get("page", 0)),
+                    upperLeft=tuple(upperLeft),
+                    lowerRight=tuple(lowerRight),
+                    style=field.get("style"),
+                    padding=tuple(field["padding"]) if field.get("padding") else None,
+                    value=field.get("value"),
+                ))
+            except (KeyError, TypeError, ValueError) as e:
+                raise LayoutError("Invalid field #{} in layout: {!r}".format(i, e))
+        padding = data.get("padding")
+        return cls(fields, styles, tuple(padding) if padding else None)
+
+    @classmethod
+    def load(cls, layout):
+        """Load a layout from a JSON file.
+
+        Args:
+            layout (str or file): Path to a JSON file, or a file-like object
+
+        Returns:
+            :class:`.Layout`
+        """
+        if isinstance(layout, basestring):
+            with open(layout) as f:
+                return cls.from_dict(json.load(f))
+        return cls.from_dict(json.load(layout))
+
+    def compile(self, template, bake=True, **kwargs):
+        """Compile the layout for a template.
+
+        Args:
+            template (str or file or PdfTemplate): The pdf to fill out
+
+        Keyword Args:
+            bake (bool): Render the static fields (the ones with a
+                ``value``) into a copy of the template now, instead of for
+                every record. Default is ``True``.
+            **kwargs: Passed through to the :class:`.PdfFormFiller` that
+                renders the static fields (e.g. ``style``).
+
+        Returns:
+            :class:`.LayoutPlan`
+
+        Raises:
+            LayoutError: If a field is on a page that doesn't exist or its box
+                doesn't fit on its page.
+        """
+        if not isinstance(template, PdfTemplate):
+            template = PdfTemplate(template)
+        return LayoutPlan(self, template, bake, **kwargs)
+
+class LayoutPlan(object):
+    """A :class:`.Layout` compiled for a template.
+
+    All the coordinates are converted and styles resolved, so filling out a
+    record only creates the text fields. Plans can be pickled (e.g. to send
+    to worker processes), but the template isn't included, so pass one to
+    :meth:`fill` after unpickling. Plans can also be used directly as the
+    ``layout`` of :func:`.fill_many` (pass it ``plan.template``, which has
+    the static fields baked in).
+
+    Attributes:
+        template (PdfTemplate or None): The template to fill out, which is
+            the compiled template with the static fields rendered into it
+            (if there are any and they were baked)
+        fields (list[tuple]): ``(name, pagenum, TextField)`` for each field,
+            where the TextField has no text yet
+        static (list[tuple]): ``(name, pagenum, TextField)`` for each static
+            field
+    """
+    def __init__(self, layout, template, bake=True, **kwargs):
+        self.template = template
+        self.fields = []
+        self.static = []
+        self.bakedDigest = None
+        for field in layout.fields:
+            if not 0 <= field.page < len(template):
+                raise LayoutError("Field {!r} is on page {} but the pdf has {} pages".format(
+                    field.name, field.page, len(template)))
+            width, height = template.pageSizes[field.page]
+            (x1, top), (x2, bottom) = field.upperLeft, field.lowerRight
+            if not (0 <= x1 < x2 <= width and 0 <= top < bottom <= height):
+                raise LayoutError("Field {!r} box {} doesn't fit on page {} ({}x{})".format(
+                    field.name, (field.upperLeft, field.lowerRight), field.page, width, height))
+
+            # input origin is top left, needs to switch to bottom left
+            fields = self.fields if field.value is None else self.static
+            fields.append((field.name, field.page, TextField(
+                text=None if field.value is None else _text(field.value),
+                x1=x1,
+                y1=height - bottom,
+                width=(x2 - x1),
+                height=(bottom - top),
+                style=layout.styles.get(field.style),
+                padding=field.padding or layout.padding,
+            )))
+
+        if bake and self.static:
+            filler = PdfFormFiller(template, **kwargs)
+            self._add_static(filler)
+            self.template = filler.to_template()
+            self.bakedDigest = self.template.digest
+
+    def _add_static(self, filler):
+        for name, pagenum, field in self.static:
+            filler[pagenum].append(field._replace(padding=field.padding or filler.padding))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["template"] = None
+        return state
+
+    def add_to(self, filler, values):
+        """Add the text fields for a record to a filler.
+
+        Fields that are missing from ``values`` (or are None) are skipped.
+        The static fields are added too, unless the filler's template already
+        has them baked in.
+
+        Args:
+            filler (PdfFormFiller): Filler for the plan's template
+            values (dict): Field name to text
+        """
+        if self.static and filler.template.digest != self.bakedDigest:
+            self._add_static(filler)
+        for name, pagenum, field in self.fields:
+            value = values.get(name)
+            if value is None:
+                continue
+            filler[pagenum].append(field._replace(
+                text=_text(value),
+                padding=field.padding or filler.padding,
+            ))
+
+    __call__ = add_to
+
+    def fill(self, values, template=None, **kwargs):
+        """Create a filler with the text fields for a record.
+
+        Args:
+            values (dict): Field name to text
+
+        Keyword Args:
+            template (PdfTemplate): Template to fill out. Default is the
+                template the plan was compiled for.
+            **kwargs: Passed through to :class:`.PdfFormFiller`
+
+        Returns:
+            :class:`.PdfFormFiller`
+        """
+        template = template or self.template
+        if template is None:
+            raise LayoutError("No template to fill out (unpickled plans need one passed in)")
+        filler = PdfFormFiller(template, **kwargs)
+        self.add_to(filler, values)
+        return filler
@@ -0,0 +1,137 @@
+"""
+Merging overlays into pages without touching the page's own content.
+
+PyPDF2's ``PageObject.mergePage`` decodes the page's content stream, parses
+it into operators, renames resources and re-encodes everything. The helpers
+here leave the original content stream bytes alone instead: the original
+content is wrapped in ``q``/``Q`` and the overlay is appended as another
+entry in the page's ``/Contents`` array. Only the (small) overlay content is
+ever parsed, and only when its resource names clash with the page's.
+
+:func:`form_xobject` goes a step further for batches: it turns a page's
+content into a Form XObject, so many pages can draw the same content.
+"""
+from PyPDF2.pdf import PageObject
+from PyPDF2.generic import (NameObject, DictionaryObject, ArrayObject,
+    DecodedStreamObject, EncodedStreamObject, StreamObject)
+
+RESOURCE_TYPES = ("/ExtGState", "/ColorSpace", "/Pattern", "/Shading",
+    "/XObject", "/Font", "/Properties")
+
+PAGE_ATTRIBUTES = ("/MediaBox", "/CropBox", "/BleedBox", "/TrimBox", "/ArtBox",
+    "/Rotate", "/UserUnit", "/Group")
+"""Page entries that describe how the page is displayed, as opposed to what's
+drawn on it (which :func:`form_xobject` moves into the Form XObject)."""
+
+def stream(data):
+    "Create a content stream object from bytes"
+    obj = DecodedStreamObject()
+    obj.setData(data)
+    return obj
+
+def unique_name(name, used):
+    "Pick a resource name based on name that isn't in used"
+    n = 1
+    while "{}_{}".format(name, n) in used:
+        n += 1
+    return NameObject("{}_{}".format(name, n))
+
+def add_contents(page, *streams):
+    """Append content streams to a page.
+
+    The page's existing content is wrapped in ``q``/``Q`` so it can't change
+    the graphics state the new content is drawn with. The page is modified,
+    so it should be a copy of the template's page.
+
+    Args:
+        page (PageObject): Page to add the content to
+        *streams (StreamObject or IndirectObject): The content to add
+    """
+    contents = ArrayObject([stream(b"q\n")])
+    if "/Contents" in page:
+        original = page.raw_get("/Contents")
+        if isinstance(original.getObject(), ArrayObject):
+            contents.extend(original.getObject())
+        else:
+            contents.append(original)
+    contents.append(stream(b"\nQ\n"))
+    contents.extend(streams)
+    page[NameObject("/Contents")] = contents
+
+def append_overlay(page, overlay):
+    """Merge an overlay page on top of a page.
+
+    The overlay's resources are added to a copy of the page's resources
+    (renaming any that clash), and the overlay's content stream is appended
+    to the page's ``/Contents``.
+
+    Args:
+        page (PageObject): Page to merge into (modified in place, so it should
+            be a copy of the template's page)
+        overlay (PageObject): Page to draw on top
+    """
+    original = page.get("/Resources", DictionaryObject()).getObject()
+    extra = overlay.get("/Resources", DictionaryObject()).getObject()
+    resources = DictionaryObject()
+    resources.update(original)
+    rename = {}
+    for resourceType in RESOURCE_TYPES:
+        if resourceType not in extra:
+            continue
+        merged = DictionaryObject()
+        merged.update(original.get(resourceType, DictionaryObject()).getObject())
+        for name, value in extra[resourceType].getObject().items():
+            value = extra[resourceType].getObject().raw_get(name)
+            if name in merged:
+                rename[name] = unique_name(name, merged)
+                name = rename[name]
+            merged[NameObject(name)] = value
+        resources[NameObject(resourceType)] = merged
+    if "/ProcSet" in extra or "/ProcSet" in original:
+        procs = set(original.get("/ProcSet", [])) | set(extra.get("/ProcSet", []))
+        resources[NameObject("/ProcSet")] = ArrayObject(NameObject(p) for p in sorted(procs))
+    page[NameObject("/Resources")] = resources
+
+    # only parse the overlay's content if some resources were renamed
+    if "/Contents" not in overlay:
+        return
+    if rename:
+        content = PageObject._contentStreamRename(overlay.getContents(), rename, overlay.pdf)
+        add_contents(page, stream(content.getData()))
+    else:
+        content = overlay.raw_get("/Contents")
+        if isinstance(content.getObject(), ArrayObject):
+            add_contents(page, *content.getObject())
+        else:
+            add_contents(page, content)
+
+def form_xobject(page):
+    """Convert a page's content into a Form XObject that draws it.
+
+    A single content stream is reused as it is, still encoded. Several
+    content streams are decoded and joined into one.
+
+    Args:
+        page (PageObject): The page (not modified)
+
+    Returns:
+        StreamObject: The Form XObject, with the page's resources and a
+        bounding box of its media box
+    """
+    contents = page.raw_get("/Contents").getObject() if "/Contents" in page else None
+    if isinstance(contents, ArrayObject):
+        form = stream(b"\n".join(c.getObject().getData() for c in contents))
+    elif isinstance(contents, EncodedStreamObject):
+        form = EncodedStreamObject()
+        form._data = contents._data
+        for key in ("/Filter", "/DecodeParms"):
+            if key in contents:
+                form[NameObject(key)] = contents.raw_get(key)
+    else:
+        form = stream(contents.getData() if contents is not None else b"")
+    form[NameObject("/Type")] = NameObject("/XObject")
+    form[NameObject("/Subtype")] = NameObject("/Form")
+    form[NameObject("/BBox")] = page.mediaBox
+    if "/Resources" in page:
+        form[NameObject("/Resources")] = page.raw_get("/Resources")
+    return form
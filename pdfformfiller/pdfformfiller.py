@@ -1,13 +1,33 @@
 from io import BytesIO
-from collections import namedtuple, defaultdict
-from PyPDF2 import PdfFileWriter, PdfFileReader
+from collections import namedtuple, defaultdict, OrderedDict
+from PyPDF2 import PdfFileReader
+from PyPDF2.pdf import PageObject
+from PyPDF2.generic import NameObject, ArrayObject, ByteStringObject, NullObject
 from reportlab.pdfgen.canvas import Canvas
-from reportlab.platypus import Paragraph, Frame, KeepInFrame
+from reportlab.platypus import Paragraph, Frame
 from reportlab.lib.styles import getSampleStyleSheet
 try:
     basestring
 except NameError:
     basestring = str
+try:
+    xrange
+except NameError:
+    xrange = range
+
+from .template import PdfTemplate
+from .backends import get_backend
+from .direct import DirectRenderer
+from .fit import DEFAULT_FITTER
+from .check import FieldFit, fit_texts
+from .merge import append_overlay
+from .serialize import (write_incremental, ReplacingWriter, StreamingWriter,
+    COMPRESSION_LEVELS)
+from .acroform import fill_form, subset_form
+from .images import DEFAULT_IMAGE_CACHE, place, stamp_images
+from .cache import fill_key
+from .stats import NULL_STATS
+from .fonts import FontSubsets, register_font, share_fonts
 
 TextField = namedtuple("TextField",
     ["text", "x1", "y1", "width", "height", "style", "padding"])
@@ -32,13 +52,18 @@ DEFAULT_STYLE.fontSize = 20
 DEFAULT_STYLE.leading = 24
 DEFAULT_PADDING = (0, 0, 0, 0)
 DEFAULT_BOX_COLOR = (255, 0, 0)
+OVERLAY_MODES = ("document", "page")
+ENGINES = ("reportlab", "direct")
+MERGE_MODES = ("parse", "append")
 
 class PdfFormFiller(defaultdict):
     """Add text fields to a PDF. Useful for programmatically filling out forms.
 
     Args:
-        pdf (str or file): The pdf to which to add text fields. Can be a string
-            path to a file, or a file-like object.
+        pdf (str or file or PdfTemplate): The pdf to which to add text fields.
+            Can be a string path to a file, a file-like object, or an already
+            parsed :class:`.PdfTemplate` (which is much faster if you are
+            filling out the same pdf many times).
 
     Keyword Args:
         style (ParagraphStyle): Custom style to apply to text fields. Default
@@ -50,11 +75,80 @@ class PdfFormFiller(defaultdict):
         boxes (bool or tuple): Whether to show the text field bounding boxes in
             the final pdf. Can be ``False`` (default), ``True`` (default color
             red), or an ``(r, g, b)`` tuple for the bounding box color.
+        overlay (str): How the text fields are rendered before being merged
+            into the pdf. ``"document"`` (default) renders all the pages into
+            a single overlay pdf, which is much faster for pdfs with lots of
+            pages. ``"page"`` renders a separate overlay pdf for each page.
+        merge (str): How the rendered text fields are merged into the pages.
+            ``"parse"`` (default) uses PyPDF2's ``mergePage``, which parses
+            and re-encodes the page's whole content stream. ``"append"``
+            leaves the page's content untouched and appends the text fields
+            after it (see :func:`.append_overlay`), so merging costs the same
+            for a dense scanned page as for a blank one.
+        engine (str): How text fields are rendered. ``"reportlab"`` (default)
+            lays out every field as a reportlab ``Paragraph``. ``"direct"``
+            writes plain text fields in the standard pdf fonts straight into
+            the page's content stream, which is much faster, and only uses
+            reportlab for fields it can't handle (e.g. markup like ``<b>``).
+            Text that doesn't fit is shrunk to the largest size that fits.
+        fitter (TextFitter): Calculates and remembers how much text needs to
+            shrink to fit in its box. Default is a cache shared by all
+            fillers. Pass your own :class:`.TextFitter` to control the cache
+            size or keep separate statistics.
+        compact (bool): Store each page's text fields in a compact
+            :class:`.FieldTable` instead of a list of :class:`.TextField`
+            tuples. Uses much less memory for forms with thousands of fields.
+            Default is ``False``.
+        stats (FillStats): Records the time spent in each phase of
+            :meth:`write` (and parsing the template), with per page timings
+            and counts. Default is None (nothing is recorded).
+        appearances (bool): Whether to generate appearance streams for form
+            fields filled out with :meth:`set_field`. Default is ``True``. If
+            ``False``, the pdf viewer is asked to draw the fields instead
+            (with ``/NeedAppearances``).
+        deterministic (bool): Always write byte-identical pdfs for the same
+            template, fields and options, with a document ID derived from
+            them (see :func:`.fill_key`). Default is ``False``. Resources of
+            the text overlays are always merged into the pages with
+            ``merge="append"``, since ``mergePage`` renames clashing
+            resources with random names.
+        cache (MemoryCache or DiskCache or LayeredCache): Cache of written
+            pdfs. A write with the same template, fields and options as a
+            cached one writes the cached bytes without rendering anything.
+            Implies ``deterministic``. Default is None (no cache).
+        compression (str): How to compress the content streams of the text
+            fields and merged pages: ``"none"`` (fastest), ``"fast"`` or
+            ``"max"`` (smallest). The template's own compressed streams are
+            copied as they are. The pikepdf backend compresses ``"fast"``
+            and ``"max"`` the same. Default is None (reportlab's overlays
+            are compressed and merged content isn't).
+        images (ImageCache): Converted images for :meth:`add_image`. Default
+            is a cache shared by all fillers, so an image used by many
+            fillers is only converted once.
+        backend (str): Pdf library that merges and writes the pdf:
+            ``"pypdf2"``, ``"pypdf"``, ``"pikepdf"`` or ``"auto"`` (see
+            :mod:`.backends`). Backends other than ``"pypdf2"`` only support
+            text fields rendered by reportlab, on all or selected pages.
+            Default is None (the template's backend, which is ``"pypdf2"``
+            unless the template was created with another one).
+        fonts (dict): Font name to path of a TrueType font file to register
+            (see :func:`.register_font`), for styles to use by name. Each
+            file is only parsed once per process. Default is None.
+        subsets (FontSubsets): Characters to embed for the TrueType fonts.
+            Default is None (the characters of this filler's text fields,
+            so every page embeds the same subset). Pass one
+            :class:`.FontSubsets` to all the fillers of a batch to share the
+            subset between them too.
 
     Attributes:
-        N (list[:class:`.TextField`]): List of the added text fields for page N.
-            For example, to delete the 2nd text field from the 4th page, do
+        N (list[:class:`.TextField`]): List of the added text fields for page N
+            (a :class:`.FieldTable` if ``compact`` is True). For example, to
+            delete the 2nd text field from the 4th page, do
             ``del filler[3][1]``. Note: This attribute is an integer, not "N".
+        formValues (dict): Form field name to value for the fields set with
+            :meth:`set_field`
+        images (dict): Page number to list of :class:`.ImageField` added with
+            :meth:`add_image`
 
     Note:
         Coordinates use ``points``, which represent 1/72 inch. The origin for
@@ -68,12 +162,56 @@ class PdfFormFiller(defaultdict):
             pdftoppm -png -r 72 myform.pdf myform
 
     """
-    def __init__(self, pdf, style=DEFAULT_STYLE, padding=DEFAULT_PADDING, boxes=False):
-        super(PdfFormFiller, self).__init__(lambda: [])
-        self.pdf = PdfFileReader(open(pdf, "rb") if isinstance(pdf, basestring) else pdf)
+    def __init__(self, pdf, style=DEFAULT_STYLE, padding=DEFAULT_PADDING, boxes=False,
+            overlay="document", engine="reportlab", fitter=DEFAULT_FITTER, compact=False,
+            stats=None, appearances=True, deterministic=False, cache=None, compression=None,
+            images=DEFAULT_IMAGE_CACHE, merge="parse", backend=None, fonts=None, subsets=None):
+        if compact:
+            from .fields import FieldTable
+            super(PdfFormFiller, self).__init__(FieldTable)
+        else:
+            super(PdfFormFiller, self).__init__(lambda: [])
+        self.stats = stats or NULL_STATS
+        if not isinstance(pdf, PdfTemplate):
+            with self.stats.timer("template"):
+                pdf = PdfTemplate(pdf, preload=False, backend=backend or "pypdf2")
+        self.template = pdf
+        self._backend = get_backend(backend or pdf.backend)
+        self.backend = self._backend.name if self._backend is not None else "pypdf2"
         self.style = style
         self.padding = padding
         self.boxes = DEFAULT_BOX_COLOR if boxes and not isinstance(boxes, (list, tuple)) else boxes
+        if overlay not in OVERLAY_MODES:
+            raise ValueError("overlay must be one of {}".format(", ".join(OVERLAY_MODES)))
+        self.overlay = overlay
+        if merge not in MERGE_MODES:
+            raise ValueError("merge must be one of {}".format(", ".join(MERGE_MODES)))
+        self.merge = merge
+        if engine not in ENGINES:
+            raise ValueError("engine must be one of {}".format(", ".join(ENGINES)))
+        if engine == "direct" and self._backend is not None:
+            raise ValueError("The direct engine needs the pypdf2 backend")
+        self.engine = engine
+        if compression is not None and compression not in COMPRESSION_LEVELS:
+            raise ValueError("compression must be one of {}".format(
+                ", ".join(sorted(COMPRESSION_LEVELS))))
+        self.compression = compression
+        self.fitter = fitter
+        self.appearances = appearances
+        self.cache = cache
+        self.deterministic = deterministic or cache is not None
+        self.formValues = {}
+        self.imageCache = images
+        self.images = defaultdict(list)
+        self.fonts = dict(fonts or {})
+        for name, path in sorted(self.fonts.items()):
+            register_font(name, path)
+        self.subsets = subsets
+
+    @property
+    def pdf(self):
+        "The template's parsed pdf"
+        return self.template.pdf
 
     def add_text(self, text, pagenum, upperLeft, lowerRight, style=None, padding=None):
         """Add a text field with a bounding box.
@@ -103,11 +241,11 @@ class PdfFormFiller(defaultdict):
         """
 
         # input origin is top left, needs to switch to bottom left
-        mediaBox = self.pdf.getPage(pagenum).mediaBox
+        pageHeight = self.template.pageSizes[pagenum][1]
         x1 = upperLeft[0]
         x2 = lowerRight[0]
-        y1 = mediaBox[3] - mediaBox[1] - lowerRight[1]
-        y2 = mediaBox[3] - mediaBox[1] - upperLeft[1]
+        y1 = pageHeight - lowerRight[1]
+        y2 = pageHeight - upperLeft[1]
 
         self[pagenum].append(TextField(
             text=text,
@@ -119,7 +257,384 @@ class PdfFormFiller(defaultdict):
             padding=(padding or self.padding),
         ))
 
-    def write(self, outputFile):
+    def add_texts(self, pagenum, texts, boxes, style=None, padding=None):
+        """Add many text fields to a page at once.
+
+        This is the same as calling :meth:`add_text` for each text and box,
+        but much faster for pages with lots of fields (e.g. tables).
+
+        Args:
+            pagenum (int): Page of the pdf to insert the fields (0 is first page)
+            texts (list[str]): Contents of each text field
+            boxes (list[tuple]): ``(upperLeft, lowerRight)`` coordinates of the
+                bounding box for each text field (see :meth:`add_text`)
+
+        Keyword Args:
+            style (ParagraphStyle): Custom style to apply to all the fields.
+            padding (tuple): Custom padding to apply to all the fields.
+
+        Returns:
+            None
+        """
+        # input origin is top left, needs to switch to bottom left
+        pageHeight = self.template.pageSizes[pagenum][1]
+        texts = list(texts)
+        boxes = list(boxes)
+        if len(texts) != len(boxes):
+            raise ValueError("There must be one box for each text")
+        x1 = [upperLeft[0] for upperLeft, _ in boxes]
+        y1 = [pageHeight - lowerRight[1] for _, lowerRight in boxes]
+        width = [lowerRight[0] - upperLeft[0] for upperLeft, lowerRight in boxes]
+        height = [(pageHeight - upperLeft[1]) - y for (upperLeft, _), y in zip(boxes, y1)]
+        padding = padding or self.padding
+
+        fields = self[pagenum]
+        if hasattr(fields, "extend_columns"):
+            fields.extend_columns(texts, x1, y1, width, height, style, padding)
+        else:
+            fields.extend(TextField(*field + (style, padding))
+                for field in zip(texts, x1, y1, width, height))
+
+    def add_image(self, image, pagenum, upperLeft, lowerRight, preserveAspectRatio=True):
+        """Add an image (e.g. a signature or logo) with a bounding box.
+
+        Each distinct image is converted once (see :class:`.ImageCache`) and
+        written once per pdf, however many pages and fillers draw it. Images
+        are drawn over the page and under the text fields.
+
+        Args:
+            image (str or bytes or file or PIL.Image): Path to an image file,
+                the file's bytes, a file-like object, or a PIL image
+            pagenum (int): Page of the pdf to draw the image on (0 is first
+                page)
+            upperLeft (tuple): (x, y) coordinates for top left corner
+                of bounding box rectangle
+            lowerRight (tuple): (x, y) coordinates for bottom right corner
+                of bounding box rectangle
+
+        Keyword Args:
+            preserveAspectRatio (bool): Scale the image to fit in the box
+                without stretching it (centered in the box). Default is
+                ``True``. Otherwise the image is stretched to fill the box.
+
+        Returns:
+            None
+        """
+        shared = self.imageCache.get(image)
+
+        # input origin is top left, needs to switch to bottom left
+        pageHeight = self.template.pageSizes[pagenum][1]
+        x1 = upperLeft[0]
+        y1 = pageHeight - lowerRight[1]
+        self.images[pagenum].append(place(shared, x1, y1, lowerRight[0] - x1,
+            lowerRight[1] - upperLeft[1], preserveAspectRatio))
+
+    def set_field(self, name, value):
+        """Fill out one of the pdf's own (interactive) form fields.
+
+        This sets the field's value in the pdf instead of drawing text on the
+        page, which is much faster than :meth:`add_text` and keeps the form
+        fillable. The fields are listed in :attr:`.PdfTemplate.fields`.
+
+        Args:
+            name (str): Fully qualified name of the field
+            value (str or bool): Text for text and choice fields, ``True`` or
+                ``False`` for check boxes, or the name of the button to turn
+                on for radio buttons
+
+        Raises:
+            KeyError: If the pdf has no field with that name
+
+        Returns:
+            None
+        """
+        field = self.template.fields.get(name)
+        if field is None:
+            raise KeyError("The pdf has no form field named {!r}".format(name))
+        if field.kind == "signature":
+            raise ValueError("Can't fill in signature field {!r}".format(name))
+        self.formValues[name] = value
+
+    def to_template(self, incremental=False):
+        """Write the filled out pdf into a new :class:`.PdfTemplate`.
+
+        This is useful for text that is the same every time the pdf is filled
+        out (e.g. an agency name): add it to a filler once, bake it into a
+        template, and fill out that template instead, so the text isn't
+        rendered again for each fill.
+
+        Keyword Args:
+            incremental (bool): See :meth:`write`
+
+        Returns:
+            :class:`.PdfTemplate`
+        """
+        out = BytesIO()
+        self.write(out, incremental=incremental)
+        out.seek(0)
+        return PdfTemplate(out, preload=self.template.preloaded, backend=self.template.backend)
+
+    def _draw_fields(self, canvas, fields, pagenum=None):
+        "Draw text fields onto a canvas"
+        stats = self.stats
+        if self.boxes:
+            canvas.setStrokeColorRGB(*self.boxes)
+        for field in fields:
+            frame = Frame(field.x1, field.y1, field.width, field.height,
+                *field.padding, showBoundary=bool(self.boxes))
+            style = field.style or self.style
+            story = [Paragraph(field.text, style)]
+            story_inframe = self.fitter.keep_in_frame(story, field.text, style,
+                field.width, field.height, field.padding)
+            frame.addFromList([story_inframe], canvas)
+            if stats.enabled:
+                stats.count("fields", 1, pagenum)
+                stats.count("passes", story_inframe.passes, pagenum)
+                if getattr(story_inframe, "_scale", 1.0) != 1.0:
+                    stats.count("shrunk", 1, pagenum)
+
+    @property
+    def _merge(self):
+        "How overlays are merged into the pages of full writes"
+        return "append" if self.deterministic else self.merge
+
+    @property
+    def _level(self):
+        "zlib level to compress the written streams with"
+        return COMPRESSION_LEVELS.get(self.compression, 0)
+
+    @property
+    def _pageCompression(self):
+        "reportlab's overlay compression (the writer compresses them instead)"
+        return None if self.compression is None else 0
+
+    def _render_packets(self, fields, subsets=None):
+        """Render text fields into overlay pdfs.
+
+        Args:
+            fields (dict): Page number to list of text fields
+
+        Keyword Args:
+            subsets (FontSubsets): The filler's TrueType font characters.
+                Default is None (collected from the fields).
+
+        Returns:
+            dict: Page number to ``(pdf, index)`` for each page with text
+            fields, where pdf is the bytes of an overlay pdf and index is the
+            number of the page of it to draw on top of the page
+        """
+        pagenums = [n for n in sorted(fields) if len(fields[n]) > 0]
+        packets = {}
+        stats = self.stats
+        if subsets is None and pagenums:
+            subsets = self._font_subsets()
+
+        # one canvas per page (slow, but each page's overlay is independent)
+        if self.overlay == "page":
+            for pagenum in pagenums:
+                packet = BytesIO()
+                canvas = Canvas(packet, pagesize=self.template.pageSizes[pagenum],
+                    invariant=self.deterministic, pageCompression=self._pageCompression)
+                subsets.assign(canvas._doc)
+                with stats.timer("layout", pagenum):
+                    self._draw_fields(canvas, fields[pagenum], pagenum)
+                with stats.timer("serialize", pagenum):
+                    canvas.save()
+                stats.count("overlayBytes", packet.tell(), pagenum)
+                packets[pagenum] = (packet.getvalue(), 0)
+            return packets
+
+        # one canvas for the whole document, page N of the overlay gets
+        # merged into the Nth page with text fields
+        if pagenums:
+            packet = BytesIO()
+            canvas = Canvas(packet, invariant=self.deterministic,
+                pageCompression=self._pageCompression)
+            subsets.assign(canvas._doc)
+            for pagenum in pagenums:
+                with stats.timer("layout", pagenum):
+                    canvas.setPageSize(self.template.pageSizes[pagenum])
+                    self._draw_fields(canvas, fields[pagenum], pagenum)
+                    canvas.showPage()
+            with stats.timer("serialize"):
+                canvas.save()
+            stats.count("overlayBytes", packet.tell())
+            data = packet.getvalue()
+            for i, pagenum in enumerate(pagenums):
+                packets[pagenum] = (data, i)
+        return packets
+
+    def _render_overlays(self, fields, subsets=None):
+        """Render text fields into overlay pages.
+
+        Args:
+            fields (dict): Page number to list of text fields
+
+        Keyword Args:
+            subsets (FontSubsets): See :meth:`_render_packets`
+
+        Returns:
+            dict: Page number to overlay ``PageObject`` for each page with
+            text fields
+        """
+        overlays = {}
+        readers = {}
+        stats = self.stats
+        for pagenum, (data, index) in sorted(self._render_packets(fields, subsets).items()):
+            with stats.timer("reparse", pagenum if self.overlay == "page" else None):
+                if id(data) not in readers:
+                    readers[id(data)] = PdfFileReader(BytesIO(data))
+                overlays[pagenum] = readers[id(data)].getPage(index)
+        if len(readers) > 1:
+            share_fonts([overlays[pagenum] for pagenum in sorted(overlays)])
+        return overlays
+
+    def _font_subsets(self):
+        "Characters of the TrueType fonts to embed (see :class:`.FontSubsets`)"
+        subsets = self.subsets if self.subsets is not None else FontSubsets()
+        subsets.add_filler(self)
+        return subsets
+
+    def _fill_pages(self, merge, pagenums=None, bases=None, subsets=None):
+        """Copy the template's pages and add the text fields to them.
+
+        Args:
+            merge (str): ``"parse"`` to merge reportlab overlays with
+                ``mergePage``, or ``"append"`` to append them to the page's
+                content without parsing it (see :func:`.append_overlay`)
+
+        Keyword Args:
+            pagenums (iterable): Page numbers to copy and fill. Default is
+                None (all pages). Fields on other pages aren't rendered.
+            bases (dict): Page number to the page to copy and fill instead of
+                the template's page (see :class:`.SharedTemplateWriter`)
+            subsets (FontSubsets): See :meth:`_render_packets`
+
+        Returns:
+            tuple: Dict of page number to page, and the set of page numbers
+            that were modified
+        """
+        if pagenums is None:
+            pagenums = xrange(len(self.template))
+
+        # copy the pages so the (possibly shared) template isn't modified
+        stats = self.stats
+        pages = {}
+        for pagenum in pagenums:
+            original = (bases or self.template.pages)[pagenum]
+            page = PageObject(self.pdf, original.indirectRef)
+            page.update(original)
+            pages[pagenum] = page
+
+        # images go under the text fields
+        for pagenum in pages:
+            images = self.images.get(pagenum)
+            if images:
+                with stats.timer("merge", pagenum):
+                    stamp_images(pages[pagenum], images)
+                stats.count("images", len(images), pagenum)
+
+        # render the plain text fields directly into the pages if we can
+        fields = dict((pagenum, self[pagenum]) for pagenum in pages if pagenum in self)
+        direct = {}
+        if self.engine == "direct":
+            for pagenum in list(fields):
+                with stats.timer("render", pagenum):
+                    renderer = DirectRenderer(pages[pagenum], self.style, self.boxes, self.fitter)
+                    fields[pagenum] = [f for f in fields[pagenum] if not renderer.add(f)]
+                if renderer.count:
+                    stats.count("fields", renderer.count, pagenum)
+                    stats.count("shrunk", renderer.shrunk, pagenum)
+                if renderer.ops:
+                    direct[pagenum] = renderer
+
+        # render the remaining text fields for all the pages that have any
+        overlays = self._render_overlays(fields, subsets)
+
+        # insert text fields if any for each page
+        for pagenum, overlay in overlays.items():
+            with stats.timer("merge", pagenum):
+                if merge == "append":
+                    append_overlay(pages[pagenum], overlay)
+                else:
+                    pages[pagenum].mergePage(overlay)
+        for pagenum, renderer in direct.items():
+            with stats.timer("merge", pagenum):
+                renderer.apply()
+        modified = set(overlays) | set(direct)
+        modified.update(n for n in pages if self.images.get(n))
+        stats.count("pages", len(modified))
+        return pages, modified
+
+    def filled_pages(self):
+        """Page numbers of the pages with text fields, images or form fields
+        set with :meth:`set_field`.
+
+        Returns:
+            list[int]: Sorted page numbers
+        """
+        pagenums = set(self._drawn_pages())
+        for name in self.formValues:
+            pagenums.update(w.page for w in self.template.fields[name].widgets
+                if w.page is not None)
+        return sorted(pagenums)
+
+    def validate(self, onlyOverflow=False):
+        """Check which text fields don't fit their boxes, without rendering
+        anything (see :func:`.check_fit`).
+
+        Keyword Args:
+            onlyOverflow (bool): Only return the fields that don't fit.
+                Default is False.
+
+        Returns:
+            list[:class:`.FieldFit`]: Each text field, by page and in the
+            order they were added
+        """
+        results = []
+        for pagenum in sorted(self):
+            # fields in the same box and style are measured together
+            groups = OrderedDict()
+            for i, field in enumerate(self[pagenum]):
+                style = field.style or self.style
+                key = (id(style), field.width, field.height, tuple(field.padding))
+                if key not in groups:
+                    groups[key] = (style, [], [])
+                groups[key][1].append(i)
+                groups[key][2].append(field.text)
+            for (_, width, height, padding), (style, indexes, texts) in groups.items():
+                for i, fits, shrink, lines, overflow in fit_texts(texts, style, width, height,
+                        padding, onlyOverflow):
+                    results.append(FieldFit(None, indexes[i], pagenum, fits, shrink, lines,
+                        overflow))
+        results.sort(key=lambda result: (result.page, result.name))
+        return results
+
+    def _drawn_pages(self):
+        "Page numbers of the pages with text fields or images"
+        return sorted(set(n for n in self if len(self[n]) > 0)
+            | set(n for n in self.images if self.images[n]))
+
+    def _select_pages(self, pages, onlyFilledPages):
+        "Page numbers to write (see :meth:`write`), or None for all pages"
+        if pages is None and not onlyFilledPages:
+            return None
+        numPages = len(self.template)
+        if pages is None:
+            pages = xrange(numPages)
+        pagenums = []
+        for pagenum in pages:
+            if not -numPages <= pagenum < numPages:
+                raise ValueError("Page {} doesn't exist (the pdf has {} pages)".format(
+                    pagenum, numPages))
+            pagenums.append(pagenum % numPages)
+        if onlyFilledPages:
+            filled = set(self.filled_pages())
+            pagenums = [pagenum for pagenum in pagenums if pagenum in filled]
+        return pagenums
+
+    def write(self, outputFile, incremental=False, pages=None, onlyFilledPages=False,
+            streaming=False):
         """Writes the modified pdf to a file.
 
         This method merges the original pdf with all of the added text fields
@@ -130,43 +645,272 @@ class PdfFormFiller(defaultdict):
             outputFile (str or file): Output file to write to. Can be string
                 path or any file-like object.
 
+        Keyword Args:
+            incremental (bool): Write the original pdf bytes unchanged,
+                followed by an incremental update containing only the pages
+                with text fields and their new content. This is much faster
+                and smaller for large pdfs, since the time and size depend on
+                the number of text fields, not the size of the original pdf.
+                Default is ``False`` (rewrite the whole pdf).
+            pages (iterable): Page numbers to write, in order. Only these
+                pages are copied and filled out, so the time and size of the
+                write depend on the selected pages, not the whole pdf. Form
+                fields without a widget on any of the pages are dropped.
+                Default is None (all pages).
+            onlyFilledPages (bool): Only write the pages (of ``pages``) with
+                text fields, images or form fields set (see
+                :meth:`filled_pages`).
+                Default is ``False``.
+            streaming (bool): Fill out and write one page at a time, so
+                memory use depends on the biggest page instead of the whole
+                pdf. If the template isn't preloaded (e.g. the filler was
+                created from a path), the objects parsed for each page are
+                dropped once it's written. Default is ``False``.
+
+        Raises:
+            ValueError: If a page doesn't exist, or pages are selected for an
+                incremental update
+
         Returns:
             None
         """
+        if isinstance(outputFile, basestring):
+            with open(outputFile, "wb") as f:
+                return self.write(f, incremental=incremental, pages=pages,
+                    onlyFilledPages=onlyFilledPages, streaming=streaming)
 
-        # iterate through original pdf pages
-        output = PdfFileWriter()
-        for pagenum in xrange(self.pdf.numPages):
-            existing_page = self.pdf.getPage(pagenum)
+        pagenums = self._select_pages(pages, onlyFilledPages)
+        if incremental and pagenums is not None:
+            raise ValueError("Pages can't be selected for incremental updates")
+        if incremental and streaming:
+            raise ValueError("Incremental updates can't be streamed")
+        self._check_backend(incremental, streaming)
 
-            # insert text fields if any for this page
-            if len(self[pagenum]) > 0:
-                mediaBox = self.pdf.getPage(pagenum).mediaBox
-                pagesize = (mediaBox[2] - mediaBox[0], mediaBox[3] - mediaBox[1])
-                packet = BytesIO()
-                canvas = Canvas(packet, pagesize=pagesize)
-                if self.boxes:
-                    canvas.setStrokeColorRGB(*self.boxes)
-
-                for field in self[pagenum]:
-                    frame = Frame(field.x1, field.y1, field.width, field.height,
-                        *field.padding, showBoundary=bool(self.boxes))
-                    style = field.style or self.style
-                    story = [Paragraph(field.text, style)]
-                    story_inframe = KeepInFrame(field.width, field.height, story)
-                    frame.addFromList([story_inframe], canvas)
+        stats = self.stats
+        with stats.timer("total"):
+            key = None
+            if self.deterministic:
+                key = fill_key(self, incremental=incremental, pages=pagenums,
+                    streaming=streaming)
+            if self._backend is not None:
+                write = self._write_backend
+            else:
+                write = self._write_streaming if streaming else self._write
+            if self.cache is None:
+                write(outputFile, incremental, key, pagenums)
+            else:
+                data = self.cache.get(key)
+                if data is None:
+                    stats.count("cacheMisses")
+                    out = BytesIO()
+                    write(out, incremental, key, pagenums)
+                    data = out.getvalue()
+                    self.cache.put(key, data)
+                else:
+                    stats.count("cacheHits")
+                outputFile.write(data)
+        stats.count("writes")
+        stats.finish()
 
-                canvas.save()
-                packet.seek(0)
-                new_pdf = PdfFileReader(packet)
-                existing_page.mergePage(new_pdf.getPage(0))
-            output.addPage(existing_page)
+    def _check_backend(self, incremental=False, streaming=False):
+        "Raise ValueError if the write needs features the backend doesn't have"
+        if self._backend is None:
+            return
+        needed = [name for name, used in (("incremental updates", incremental),
+            ("streaming", streaming), ("form fields", self.formValues),
+            ("images", any(self.images.values()))) if used]
+        if needed:
+            raise ValueError("The {} backend doesn't support {}".format(
+                self.backend, ", ".join(needed)))
 
-        # write the final pdf to the file
-        if isinstance(outputFile, basestring):
-            outputFile = open(outputFile, "wb")
-            output.write(outputFile)
-            outputFile.close()
-        else:
+    def _write_backend(self, outputFile, incremental, key, pagenums=None, overlays=None):
+        "Render the text fields and merge and write them with the backend"
+        stats = self.stats
+        if overlays is None:
+            overlays = self._render_packets(dict((n, self[n]) for n in self
+                if pagenums is None or n in pagenums))
+        if pagenums is not None:
+            overlays = dict((n, overlay) for n, overlay in overlays.items() if n in pagenums)
+        stats.count("pages", len(overlays))
+        documentId = None
+        if key is not None:
+            documentId = bytes(bytearray.fromhex(key[:32]))
+        with stats.timer("write"):
+            self._backend.write(self.template.data, overlays, outputFile, pagenums,
+                None if self.compression is None else self._level, documentId)
+
+    def _write(self, outputFile, incremental, key, pagenums=None):
+        "Render and write the pdf (see :meth:`write`)"
+        stats = self.stats
+        replacements, acroform = {}, None
+        if self.formValues or not incremental:
+            with stats.timer("form"):
+                replacements, acroform = fill_form(self.template, self.formValues,
+                    self.appearances)
+        if incremental:
+            # only the pages with text fields or images are written
+            pages, modified = self._fill_pages("append", self._drawn_pages())
+            with stats.timer("write"):
+                write_incremental(self.template, dict((n, pages[n]) for n in modified),
+                    outputFile, objects=replacements, level=self._level)
+            return
+
+        pages, modified = self._fill_pages(self._merge, pagenums)
+        self._write_pages(outputFile, [pages[n] for n in pagenums or sorted(pages)],
+            replacements, acroform, key, pagenums)
+
+    def _write_streaming(self, outputFile, incremental, key, pagenums=None):
+        "Fill out and write one page at a time (see :meth:`write`)"
+        stats = self.stats
+        with stats.timer("form"):
+            replacements, acroform = fill_form(self.template, self.formValues,
+                self.appearances)
+        if pagenums is None:
+            pagenums = list(xrange(len(self.template)))
+        elif acroform is not None:
+            acroform = subset_form(self.template, acroform, pagenums, replacements)
+
+        with stats.timer("write"):
+            output = StreamingWriter(outputFile, self.template, pagenums, replacements,
+                self._level)
+        # the fields of every page are only looked through once
+        subsets = self._font_subsets()
+        def add(pagenum):
+            pages, modified = self._fill_pages("append", [pagenum], subsets=subsets)
+            with stats.timer("write", pagenum):
+                output.add(pagenum, pages[pagenum])
+        for pagenum in pagenums:
+            if self.template.preloaded:
+                add(pagenum)
+            else:
+                # everything the page needed has been written, so drop the
+                # objects parsed for it
+                with self.template._forget_parsed():
+                    add(pagenum)
+
+        with stats.timer("write"):
+            catalog, trailer = {}, {}
+            if acroform is not None:
+                catalog[NameObject("/AcroForm")] = acroform
+            if key is not None:
+                documentId = ByteStringObject(bytes(bytearray.fromhex(key[:32])))
+                trailer[NameObject("/ID")] = ArrayObject([documentId, documentId])
+            output.close(catalog, trailer)
+
+    def _write_pages(self, outputFile, pages, replacements, acroform, key, pagenums=None):
+        "Write filled out pages as a new pdf"
+        with self.stats.timer("write"):
+            if pagenums is not None:
+                # references to the pages that aren't written (e.g. from
+                # annotations) would copy them and the whole page tree
+                replacements = dict(replacements)
+                written = set(pagenums)
+                for pagenum, page in enumerate(self.template.pages):
+                    if pagenum not in written and page.indirectRef is not None:
+                        ref = page.indirectRef
+                        replacements[(ref.idnum, ref.generation)] = NullObject()
+                if acroform is not None:
+                    acroform = subset_form(self.template, acroform, pagenums, replacements)
+
+            output = ReplacingWriter(self.pdf, replacements, self._level)
+            for page in pages:
+                # the writer changes the pages it's given, so give it copies
+                copy = PageObject(self.pdf, page.indirectRef)
+                copy.update(page)
+                output.addPage(copy)
+            # keep the pdf's interactive form
+            if acroform is not None:
+                output._root_object[NameObject("/AcroForm")] = acroform
+            if key is not None:
+                documentId = ByteStringObject(bytes(bytearray.fromhex(key[:32])))
+                output._ID = ArrayObject([documentId, documentId])
+
+            # write the final pdf to the file
             output.write(outputFile)
 
+    def write_pages(self, pages=None, onlyFilledPages=False):
+        """Write each page as a separate single page pdf.
+
+        All the pages are filled out in one pass (e.g. with one overlay for
+        the whole document), and then each one is written on its own.
+
+        Keyword Args:
+            pages (iterable): Page numbers to write (see :meth:`write`).
+                Default is None (all pages).
+            onlyFilledPages (bool): Only write the pages with text fields,
+                images or form fields set. Default is ``False``.
+
+        Returns:
+            OrderedDict: Page number to pdf bytes
+        """
+        pagenums = self._select_pages(pages, onlyFilledPages)
+        if pagenums is None:
+            pagenums = list(xrange(len(self.template)))
+        self._check_backend()
+        stats = self.stats
+        with stats.timer("total"):
+            if self._backend is not None:
+                overlays = self._render_packets(dict((n, self[n]) for n in self
+                    if n in pagenums))
+            else:
+                with stats.timer("form"):
+                    replacements, acroform = fill_form(self.template, self.formValues,
+                        self.appearances)
+                pages, modified = self._fill_pages(self._merge, pagenums)
+            results = OrderedDict()
+            for pagenum in pagenums:
+                key = None
+                if self.deterministic:
+                    key = fill_key(self, incremental=False, pages=[pagenum], streaming=False)
+                out = BytesIO()
+                if self._backend is not None:
+                    self._write_backend(out, False, key, [pagenum], overlays)
+                else:
+                    self._write_pages(out, [pages[pagenum]], replacements, acroform, key,
+                        [pagenum])
+                results[pagenum] = out.getvalue()
+        stats.count("writes", len(results))
+        stats.finish()
+        return results
+
+    def write_async(self, outputStream, executor=None, limiter=None, chunkSize=None, **kwargs):
+        """Writes the modified pdf without blocking the asyncio event loop.
+
+        The rendering and merging is done by :meth:`write` in an executor
+        thread, and the output is written to ``outputStream`` in chunks once
+        the pdf is serialized. Only a few chunks are buffered, so a slow
+        ``outputStream`` holds back the executor thread. Cancelling the
+        returned coroutine stops the write.
+
+        Args:
+            outputStream: Where to write the pdf. Anything with a ``write``
+                method, which can be a coroutine (e.g. aiohttp's
+                ``StreamResponse``) or be followed by ``await drain()`` (e.g.
+                asyncio's ``StreamWriter``).
+
+        Keyword Args:
+            executor (Executor): Thread pool to write the pdf in. Default is
+                the event loop's default executor (or the limiter's executor).
+            limiter (FillLimiter): Limits how many pdfs are written at once.
+            chunkSize (int): Number of bytes to write to ``outputStream`` at a
+                time. Default is 64KB.
+            **kwargs: Passed through to :meth:`write` (e.g. ``incremental``).
+
+        Returns:
+            Coroutine, which returns None
+
+        Example::
+
+            limiter = FillLimiter(4)
+
+            async def handler(request):
+                response = web.StreamResponse()
+                await response.prepare(request)
+                filler = template.filler()
+                filler.add_text(request.query["name"], 0, (50, 50), (500, 100))
+                await filler.write_async(response, limiter=limiter)
+                return response
+        """
+        from .aio import write_async, DEFAULT_CHUNK_SIZE
+        return write_async(self, outputStream, executor=executor, limiter=limiter,
+            chunkSize=chunkSize or DEFAULT_CHUNK_SIZE, **kwargs)
@@ -0,0 +1,674 @@
+"""
+Low level pdf object serialization.
+
+``PdfFileWriter`` builds the whole output document in memory and then writes
+every object of it. :class:`.ObjectWriter` is a much simpler writer that
+writes objects to the output as soon as they're added, which lets us write
+incremental updates (only the objects that changed, appended to the original
+pdf bytes), and concatenate lots of pdfs without keeping them all in memory.
+:class:`.SharedTemplateWriter` writes a whole batch of filled out copies of a
+template into one pdf, with the template's content written only once.
+
+Both writers can Flate compress the uncompressed streams they write (see
+:data:`COMPRESSION_LEVELS`). PyPDF2 can't write object streams or cross
+reference streams, so objects and the cross reference table are always
+written uncompressed.
+"""
+import re
+import zlib
+import hashlib
+from io import BytesIO
+from PyPDF2 import PdfFileReader, PdfFileWriter
+from PyPDF2.pdf import PageObject
+from PyPDF2.generic import (IndirectObject, DictionaryObject, ArrayObject,
+    StreamObject, DecodedStreamObject, EncodedStreamObject, NameObject,
+    NumberObject, NullObject)
+
+from .merge import PAGE_ATTRIBUTES, form_xobject, stream as content_stream
+
+# ReplacingWriter and PdfTemplate hook into PyPDF2 1.x internals, which
+# PyPDF2 2.x renamed (the replacements would silently not be made)
+if not hasattr(PdfFileWriter, "_sweepIndirectReferences"):
+    raise ImportError("pdfformfiller needs PyPDF2 1.x (PyPDF2>=1.25.1,<2)")
+
+COMPRESSION_LEVELS = {"none": 0, "fast": 1, "max": 9}
+"""
+zlib level of each ``compression`` option of :class:`.PdfFormFiller`.
+``"none"`` writes the new content streams uncompressed, which is fastest.
+"""
+
+def compress(stream, level):
+    """Flate compress an uncompressed stream.
+
+    Args:
+        stream (StreamObject): The stream
+        level (int): zlib compression level (0 for no compression)
+
+    Returns:
+        StreamObject: A new compressed stream, or ``stream`` itself if it
+        already has a filter or compressing it doesn't make it smaller
+    """
+    if not level or not isinstance(stream, DecodedStreamObject) or "/Filter" in stream:
+        return stream
+    data = stream._data
+    compressed = zlib.compress(data, level)
+    if len(compressed) >= len(data):
+        return stream
+    new = EncodedStreamObject()
+    new.update(stream)
+    new[NameObject("/Filter")] = NameObject("/FlateDecode")
+    new._data = compressed
+    return new
+
+def image_key(obj):
+    """Content key of an image XObject, used to write identical images
+    (e.g. the same logo in every pdf of a batch) only once.
+
+    Returns:
+        str: Hex digest, or None if the object isn't an image
+    """
+    if not isinstance(obj, StreamObject) or obj.get("/Subtype") != "/Image":
+        return None
+    h = hashlib.sha256(obj._data)
+    for key, value in sorted(obj.items()):
+        if key == "/SMask":
+            value = image_key(value.getObject())
+        elif key == "/Length":
+            continue
+        h.update(repr((key, value)).encode("utf-8"))
+    return h.hexdigest()
+
+def _digest(obj, h, seen):
+    "Hash an object and everything it references"
+    if isinstance(obj, IndirectObject):
+        key = (id(obj.pdf), obj.idnum, obj.generation)
+        if key in seen:
+            h.update(b"R")
+            return
+        seen.add(key)
+        obj = obj.getObject()
+    if isinstance(obj, StreamObject):
+        h.update(hashlib.sha256(obj._data).digest())
+    if isinstance(obj, DictionaryObject):
+        for key, value in sorted(obj.items()):
+            if key != "/Length":
+                h.update(repr(key).encode("utf-8"))
+                _digest(value, h, seen)
+    elif isinstance(obj, ArrayObject):
+        h.update(b"[")
+        for value in obj:
+            _digest(value, h, seen)
+        h.update(b"]")
+    else:
+        h.update(repr(obj).encode("utf-8"))
+    h.update(b"\0")
+
+def font_key(obj):
+    """Content key of a font dictionary and everything it references (e.g.
+    an embedded TrueType subset), used to write the fonts of a batch only
+    once. The font's ``/Name``, which is just the resource name it was
+    created with, isn't part of the key.
+
+    Returns:
+        str: Hex digest, or None if the object isn't a font
+    """
+    if not isinstance(obj, DictionaryObject) or obj.get("/Type") != "/Font":
+        return None
+    h = hashlib.sha256()
+    _digest(DictionaryObject((key, value) for key, value in obj.items() if key != "/Name"),
+        h, set())
+    return h.hexdigest()
+
+class ObjectWriter(object):
+    """Writes pdf objects to a stream, keeping track of their offsets.
+
+    References to objects that belong to another pdf (e.g. an overlay
+    generated by reportlab) are given new object numbers in the output and
+    the referenced objects are copied (once each). Images and fonts are
+    also only written once, even if they come from different pdfs.
+    References to objects of the ``keep`` pdf are left as they are.
+
+    Args:
+        stream (file): Output file-like object
+        nextId (int): First free object number
+
+    Keyword Args:
+        keep (PdfFileReader): Pdf whose object references are kept as is
+        offset (int): Number of bytes already in the output stream
+        level (int): zlib level to compress uncompressed streams with.
+            Default is 0 (write them as they are).
+    """
+    def __init__(self, stream, nextId, keep=None, offset=0, level=0):
+        self.stream = stream
+        self.nextId = nextId
+        self.keep = keep
+        self.offset = offset
+        self.level = level
+        self.offsets = {}
+        self._copied = {}
+        self._shared = {}
+
+    def forget(self, keep=()):
+        """Forget which objects of other pdfs were copied.
+
+        Call this when done with a pdf whose objects were copied (e.g. when
+        concatenating pdfs), so the memo doesn't keep growing and a new pdf
+        object can't be mistaken for an old one with the same id. Images
+        and fonts that were written are remembered by their content, so they
+        can still be reused.
+
+        Keyword Args:
+            keep (iterable): Pdfs whose copied objects are still remembered
+        """
+        kept = dict((id(pdf), self._copied.get(id(pdf), {})) for pdf in keep)
+        self._copied.clear()
+        self._copied.update(kept)
+
+    def alias(self, ref, obj):
+        """Write references to an object of another pdf as something else,
+        instead of copying the object.
+
+        Args:
+            ref (IndirectObject): Reference to the object of the other pdf
+            obj (PdfObject): What to write in its place, e.g. a reference to
+                a copy that's written separately (like a page), or a
+                ``NullObject`` for objects that shouldn't be written
+        """
+        self._copied.setdefault(id(ref.pdf), {})[(ref.idnum, ref.generation)] = obj
+
+    def write(self, data):
+        "Write raw bytes to the output"
+        self.stream.write(data)
+        self.offset += len(data)
+
+    def reserve(self):
+        """Allocate an object number.
+
+        Returns:
+            IndirectObject: Reference to the new object
+        """
+        ref = IndirectObject(self.nextId, 0, None)
+        self.nextId += 1
+        return ref
+
+    def copy(self, obj):
+        """Copy an object, replacing references to other pdfs with references
+        to copies of those objects in the output. Direct streams are written
+        as new objects.
+
+        Returns:
+            The copied object (the original object is not modified)
+        """
+        if isinstance(obj, IndirectObject):
+            if obj.pdf is None or obj.pdf is self.keep:
+                return obj
+            copied = self._copied.setdefault(id(obj.pdf), {})
+            key = (obj.idnum, obj.generation)
+            if key not in copied:
+                target = obj.getObject()
+                sharedKey = image_key(target) or font_key(target)
+                if sharedKey is not None and sharedKey in self._shared:
+                    copied[key] = self._shared[sharedKey]
+                else:
+                    ref = copied[key] = self.reserve()
+                    if sharedKey is not None:
+                        self._shared[sharedKey] = ref
+                    self.write_object(ref, target)
+            return copied[key]
+        elif isinstance(obj, StreamObject):
+            ref = self.reserve()
+            self.write_object(ref, obj)
+            return ref
+        elif isinstance(obj, DictionaryObject):
+            new = DictionaryObject()
+            for key, value in obj.items():
+                new[key] = self.copy(value)
+            return new
+        elif isinstance(obj, ArrayObject):
+            return ArrayObject(self.copy(value) for value in obj)
+        return obj
+
+    def write_object(self, ref, obj):
+        """Write an object to the output.
+
+        Args:
+            ref (IndirectObject): Object number to write the object as
+            obj (PdfObject): The object (references in it are copied)
+        """
+        if isinstance(obj, StreamObject):
+            if isinstance(obj, DecodedStreamObject):
+                new = DecodedStreamObject()
+                new._data = obj.getData()
+            else:
+                new = EncodedStreamObject()
+                new._data = obj._data
+            for key, value in obj.items():
+                new[key] = self.copy(value)
+            obj = compress(new, self.level)
+        elif isinstance(obj, (DictionaryObject, ArrayObject)):
+            obj = self.copy(obj)
+        buf = BytesIO()
+        buf.write("{} {} obj\n".format(ref.idnum, ref.generation).encode("ascii"))
+        obj.writeToStream(buf, None)
+        buf.write(b"\nendobj\n")
+        self.offsets[ref.idnum] = (self.offset, ref.generation)
+        self.write(buf.getvalue())
+
+    def write_xref(self, trailer):
+        """Write the cross reference table and trailer for the written
+        objects, ending the pdf (or the incremental update).
+
+        Args:
+            trailer (DictionaryObject): Trailer entries. ``/Size`` is filled
+                in automatically.
+        """
+        start = self.offset
+        ids = sorted(self.offsets)
+        out = [b"xref\n"]
+        if not self.keep:
+            ids = [0] + ids
+        i = 0
+        while i < len(ids):
+            # group consecutive object numbers into subsections
+            j = i
+            while j + 1 < len(ids) and ids[j + 1] == ids[j] + 1:
+                j += 1
+            out.append("{} {}\n".format(ids[i], j - i + 1).encode("ascii"))
+            for idnum in ids[i:j + 1]:
+                if idnum == 0 and idnum not in self.offsets:
+                    out.append(b"0000000000 65535 f \n")
+                else:
+                    offset, generation = self.offsets[idnum]
+                    out.append("{:010d} {:05d} n \n".format(offset, generation).encode("ascii"))
+            i = j + 1
+        self.write(b"".join(out))
+
+        trailer = DictionaryObject(trailer)
+        trailer[NameObject("/Size")] = NumberObject(self.nextId)
+        buf = BytesIO()
+        buf.write(b"trailer\n")
+        trailer.writeToStream(buf, None)
+        buf.write("\nstartxref\n{}\n%%EOF\n".format(start).encode("ascii"))
+        self.write(buf.getvalue())
+
+class ConcatenatedWriter(object):
+    """Writes the pages of many pdfs into one pdf, one pdf at a time.
+
+    Each pdf's pages (and everything they reference) are written to the
+    output as soon as the pdf is added, so memory use doesn't grow with the
+    number of pdfs. Only the list of page references is kept until
+    :meth:`close` writes the page tree.
+
+    Args:
+        stream (file): Output file-like object
+    """
+    def __init__(self, stream):
+        header = b"%PDF-1.3\n%\xe2\xe3\xcf\xd3\n"
+        stream.write(header)
+        self.writer = ObjectWriter(stream, 1, offset=len(header))
+        self.root = self.writer.reserve()
+        self.pagesRef = self.writer.reserve()
+        self.kids = ArrayObject()
+
+    def add(self, pdf):
+        """Append the pages of a pdf.
+
+        Args:
+            pdf (bytes or PdfFileReader): The pdf to add
+        """
+        if isinstance(pdf, bytes):
+            pdf = PdfFileReader(BytesIO(pdf))
+        refs = []
+        for pagenum in range(pdf.getNumPages()):
+            original = pdf.getPage(pagenum)
+            ref = self.writer.reserve()
+            # references back to the page (e.g. from annotations) point to
+            # the copy, not to the original page and its page tree
+            self.writer.alias(original.indirectRef, ref)
+            refs.append((ref, original))
+        for ref, original in refs:
+            page = DictionaryObject()
+            page.update(original)
+            page[NameObject("/Parent")] = self.pagesRef
+            self.writer.write_object(ref, page)
+            self.kids.append(ref)
+        self.writer.forget()
+
+    def close(self):
+        "Write the page tree, catalog and cross reference table"
+        self.writer.write_object(self.pagesRef, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): self.kids,
+            NameObject("/Count"): NumberObject(len(self.kids)),
+        }))
+        self.writer.write_object(self.root, DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): self.pagesRef,
+        }))
+        self.writer.write_xref(DictionaryObject({NameObject("/Root"): self.root}))
+
+class StreamingWriter(object):
+    """Writes a new pdf from a template one page at a time.
+
+    Each page (and everything it references that wasn't written yet) is
+    written to the output as soon as it's added, so the filled out page can
+    be thrown away. References to the template's pages point to the written
+    pages (or null, for pages that aren't written). A page that's written
+    more than once is written as a separate copy each time, and references
+    to it point to the first copy.
+
+    Args:
+        stream (file): Output file-like object
+        template (PdfTemplate): The pdf the pages come from
+        pagenums (list[int]): Page numbers that will be written, in order
+            (pages can be repeated)
+
+    Keyword Args:
+        replacements (dict): ``(idnum, generation)`` of objects of the
+            template to the objects to write in their place
+        level (int): zlib level to compress uncompressed streams with.
+            Default is 0 (write them as they are).
+    """
+    def __init__(self, stream, template, pagenums, replacements=None, level=0):
+        header = b"%PDF-1.3\n%\xe2\xe3\xcf\xd3\n"
+        stream.write(header)
+        self.writer = ObjectWriter(stream, 1, offset=len(header), level=level)
+        self.root = self.writer.reserve()
+        self.pagesRef = self.writer.reserve()
+        self.template = template
+        self.pagenums = list(pagenums)
+        self.kids = [self.writer.reserve() for pagenum in self.pagenums]
+        self.refs = {}
+        for pagenum, ref in zip(self.pagenums, self.kids):
+            self.refs.setdefault(pagenum, []).append(ref)
+        for pagenum, page in enumerate(template.pages):
+            if page.indirectRef is not None:
+                self.writer.alias(page.indirectRef, self.refs[pagenum][0]
+                    if pagenum in self.refs else NullObject())
+        self._added = dict((pagenum, 0) for pagenum in self.refs)
+
+        replaced = []
+        for (idnum, generation), obj in sorted((replacements or {}).items()):
+            ref = self.writer.reserve()
+            self.writer.alias(IndirectObject(idnum, generation, template.pdf), ref)
+            replaced.append((ref, obj))
+        for ref, obj in replaced:
+            self.writer.write_object(ref, obj)
+
+    def add(self, pagenum, page):
+        """Write a page (the next copy of it, for repeated pages).
+
+        Args:
+            pagenum (int): The page's number in the template
+            page (PageObject): The filled out page
+        """
+        new = DictionaryObject()
+        new.update(page)
+        new[NameObject("/Parent")] = self.pagesRef
+        self.writer.write_object(self.refs[pagenum][self._added[pagenum]], new)
+        self._added[pagenum] += 1
+        # the page's overlays are thrown away, so forget their objects
+        self.writer.forget(keep=[self.template.pdf])
+
+    def close(self, catalog=None, trailer=None):
+        """Write the page tree, catalog and cross reference table.
+
+        Keyword Args:
+            catalog (dict): Extra catalog entries (e.g. ``/AcroForm``)
+            trailer (dict): Extra trailer entries (e.g. ``/ID``)
+        """
+        self.writer.write_object(self.pagesRef, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(self.kids),
+            NameObject("/Count"): NumberObject(len(self.pagenums)),
+        }))
+        root = DictionaryObject(catalog or {})
+        root[NameObject("/Type")] = NameObject("/Catalog")
+        root[NameObject("/Pages")] = self.pagesRef
+        self.writer.write_object(self.root, root)
+        entries = DictionaryObject(trailer or {})
+        entries[NameObject("/Root")] = self.root
+        self.writer.write_xref(entries)
+
+class SharedTemplateWriter(object):
+    """Writes many filled out copies of a template into one pdf, drawing the
+    template's pages from shared Form XObjects.
+
+    Concatenating the pdfs written by :meth:`.PdfFormFiller.write` repeats
+    the template's content in every copy. Here each page of the template is
+    written once, as a Form XObject (see :func:`.form_xobject`), the first
+    time it's needed. Every filled out page is then a small page that draws
+    it, followed by that filler's text fields and images, so the output
+    grows with the fields rather than with the template.
+
+    The template's annotations (including form fields) aren't copied, since
+    an annotation can only belong to one page.
+
+    Args:
+        stream (file): Output file-like object
+        template (PdfTemplate): The template all the fillers fill out
+
+    Keyword Args:
+        level (int): zlib level to compress uncompressed streams with.
+            Default is 0 (write them as they are). The template's content is
+            always compressed, since it's only written once.
+    """
+    def __init__(self, stream, template, level=0):
+        header = b"%PDF-1.3\n%\xe2\xe3\xcf\xd3\n"
+        stream.write(header)
+        self.writer = ObjectWriter(stream, 1, offset=len(header), level=level)
+        self.root = self.writer.reserve()
+        self.pagesRef = self.writer.reserve()
+        self.template = template
+        self.kids = ArrayObject()
+        self.stubs = {}
+        self.objects = []
+        for page in template.pages:
+            if page.indirectRef is not None:
+                self.writer.alias(page.indirectRef, NullObject())
+
+    def getObject(self, ref):
+        # the stubs' objects belong to the writer, like objects of another
+        # pdf, so they're only written (once) when a page refers to them
+        return self.objects[ref.idnum - 1]
+
+    def _ref(self, obj):
+        self.objects.append(obj)
+        return IndirectObject(len(self.objects), 0, self)
+
+    def _stub(self, pagenum):
+        "Page that only draws the Form XObject of a template page"
+        if pagenum not in self.stubs:
+            original = self.template.pages[pagenum]
+            form = self._ref(compress(form_xobject(original), self.writer.level or 6))
+            stub = PageObject()
+            for key in PAGE_ATTRIBUTES:
+                if key in original:
+                    stub[NameObject(key)] = original.raw_get(key)
+            stub[NameObject("/Type")] = NameObject("/Page")
+            stub[NameObject("/Resources")] = DictionaryObject({
+                NameObject("/XObject"): DictionaryObject({NameObject("/Tpl"): form}),
+            })
+            stub[NameObject("/Contents")] = self._ref(content_stream(b"/Tpl Do\n"))
+            self.stubs[pagenum] = stub
+        return self.stubs[pagenum]
+
+    def add(self, filler):
+        """Fill out and write every page of the template.
+
+        Args:
+            filler (PdfFormFiller): Filler of this writer's template
+
+        Raises:
+            ValueError: If the filler fills out a different template, or sets
+                form fields (see :meth:`.PdfFormFiller.set_field`)
+        """
+        if filler.template.digest != self.template.digest:
+            raise ValueError("The filler's template isn't the writer's template")
+        if filler.formValues:
+            raise ValueError("Form fields can't be set when the template's pages are shared")
+        pagenums = range(len(self.template))
+        pages, modified = filler._fill_pages("append", pagenums,
+            bases=dict((pagenum, self._stub(pagenum)) for pagenum in pagenums))
+        for pagenum in pagenums:
+            page = pages[pagenum]
+            page[NameObject("/Parent")] = self.pagesRef
+            ref = self.writer.reserve()
+            self.writer.write_object(ref, page)
+            self.kids.append(ref)
+        # the filler's overlays are thrown away, so forget their objects
+        self.writer.forget(keep=[self.template.pdf, self])
+
+    def close(self):
+        "Write the page tree, catalog and cross reference table"
+        self.writer.write_object(self.pagesRef, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): self.kids,
+            NameObject("/Count"): NumberObject(len(self.kids)),
+        }))
+        self.writer.write_object(self.root, DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): self.pagesRef,
+        }))
+        self.writer.write_xref(DictionaryObject({NameObject("/Root"): self.root}))
+
+class ReplacingWriter(PdfFileWriter):
+    """A ``PdfFileWriter`` that never modifies the pdf it copies objects
+    from, and writes replacements in place of some of them.
+
+    ``PdfFileWriter`` rewrites the references inside every object it copies
+    in place, so the source pdf ends up pointing at the writer's objects,
+    and two writers copying from the same pdf at once corrupt each other.
+    This writer copies each container (dictionary, array or stream
+    dictionary) before changing it instead. The copies are shallow, so
+    stream data and everything else is shared with the source pdf.
+
+    References to a replaced object (e.g. a form field whose value was
+    changed) are pointed at the replacement, and the original object is
+    never copied.
+
+    Args:
+        pdf (PdfFileReader): The pdf whose objects are replaced
+        replacements (dict): ``(idnum, generation)`` of an object of ``pdf``
+            to the object to write in its place
+
+    Keyword Args:
+        level (int): zlib level to compress uncompressed streams with.
+            Default is 0 (write them as they are).
+    """
+    def __init__(self, pdf, replacements, level=0):
+        PdfFileWriter.__init__(self)
+        self._replaced = pdf
+        self._replacements = replacements
+        self._level = level
+
+    def _sweepIndirectReferences(self, externMap, data):
+        if not isinstance(data, IndirectObject):
+            return self._copy(externMap, data)
+
+        if data.pdf is self:
+            # the writer's own objects (the catalog, page tree and pages
+            # added to it) can be changed in place
+            if data.idnum not in self.stack:
+                self.stack.append(data.idnum)
+                obj = self.getObject(data)
+                if isinstance(obj, DictionaryObject):
+                    for key, value in list(obj.items()):
+                        obj[key] = self._copy_value(externMap, value)
+                elif isinstance(obj, ArrayObject):
+                    for i, value in enumerate(obj):
+                        obj[i] = self._copy_value(externMap, value)
+            return data
+
+        done = externMap.get(data.pdf, {}).get(data.generation, {}).get(data.idnum)
+        if done is not None:
+            return done
+        key = (data.idnum, data.generation)
+        if data.pdf is self._replaced and key in self._replacements:
+            obj = self._replacements[key]
+        else:
+            try:
+                obj = data.pdf.getObject(data)
+            except ValueError:
+                return NullObject()
+        self._objects.append(None)
+        ref = IndirectObject(len(self._objects), 0, self)
+        externMap.setdefault(data.pdf, {}).setdefault(data.generation, {})[data.idnum] = ref
+        self._objects[ref.idnum - 1] = self._copy(externMap, obj)
+        return ref
+
+    def _copy_value(self, externMap, value):
+        "Copy a value inside a container (direct streams become new objects)"
+        value = self._sweepIndirectReferences(externMap, value)
+        if isinstance(value, StreamObject):
+            value = self._addObject(value)
+        return value
+
+    def _copy(self, externMap, obj):
+        "Shallow copy of an object with all of its references swept"
+        if isinstance(obj, StreamObject):
+            new = DecodedStreamObject() if isinstance(obj, DecodedStreamObject) else EncodedStreamObject()
+            new._data = obj._data
+        elif isinstance(obj, DictionaryObject):
+            new = DictionaryObject()
+        elif isinstance(obj, ArrayObject):
+            return ArrayObject(self._copy_value(externMap, value) for value in obj)
+        else:
+            return obj
+        for key, value in obj.items():
+            new[key] = self._copy_value(externMap, value)
+        return compress(new, self._level)
+
+def find_startxref(data):
+    "Find the offset of the last cross reference section in pdf bytes"
+    match = re.search(br"startxref\s+(\d+)\s*%%EOF\s*$", bytes(data[-1024:]))
+    if not match:
+        raise ValueError("Can't find startxref at the end of the pdf")
+    return int(match.group(1))
+
+def write_incremental(template, pages, outputFile, objects=None, level=0):
+    """Write a pdf incremental update.
+
+    The original pdf bytes are written unchanged, followed by an update
+    section containing only the modified pages and the new objects they
+    reference, and a new cross reference table pointing back to the
+    original one.
+
+    Args:
+        template (PdfTemplate): The original pdf
+        pages (dict): Page number to modified ``PageObject``
+        outputFile (file): File-like object to write to
+
+    Keyword Args:
+        objects (dict): ``(idnum, generation)`` of other modified objects of
+            the original pdf (e.g. form fields) to their new versions
+        level (int): zlib level to compress the new uncompressed streams
+            with. Default is 0 (write them as they are).
+    """
+    reader = template.pdf
+    if reader.isEncrypted:
+        raise ValueError("Incremental updates of encrypted pdfs aren't supported")
+    data = template.data
+    outputFile.write(data)
+    offset = len(data)
+    if not pages and not objects:
+        return
+    if data[-1:] != b"\n":
+        outputFile.write(b"\n")
+        offset += 1
+
+    trailer = reader.trailer
+    writer = ObjectWriter(outputFile, int(trailer["/Size"]), keep=reader, offset=offset,
+        level=level)
+    for pagenum in sorted(pages):
+        ref = template.pages[pagenum].indirectRef
+        writer.write_object(ref, pages[pagenum])
+    for (idnum, generation), obj in sorted((objects or {}).items()):
+        writer.write_object(IndirectObject(idnum, generation, reader), obj)
+
+    new = DictionaryObject()
+    for key in ("/Root", "/Info", "/ID"):
+        if key in trailer:
+            new[NameObject(key)] = trailer.raw_get(key)
+    new[NameObject("/Prev")] = NumberObject(find_startxref(data))
+    writer.write_xref(new)
@@ -0,0 +1,169 @@
+"""
+Timing and counters for finding out where the time in a fill goes.
+
+Pass a :class:`.FillStats` to a :class:`.PdfFormFiller` and every
+:meth:`.PdfFormFiller.write` records the wall time of each phase (parsing
+the template, laying out paragraphs, serializing and re-parsing the overlay,
+merging, writing the output) along with per page timings and counts. When
+no stats object is given, a shared do-nothing :data:`NULL_STATS` is used, so
+the instrumentation costs a couple of method calls per page.
+"""
+import time
+from threading import Lock
+
+clock = getattr(time, "perf_counter", time.time)
+
+PHASES = ("template", "form", "render", "layout", "serialize", "reparse", "merge", "write",
+    "total")
+"""
+Phases timed by :class:`.FillStats`:
+
+* ``template``: parsing the template pdf (only when the filler parses it)
+* ``form``: filling out the pdf's own form fields (see :meth:`.PdfFormFiller.set_field`)
+* ``render``: writing plain text fields with the ``"direct"`` engine
+* ``layout``: laying out and drawing reportlab paragraphs
+* ``serialize``: saving the reportlab overlay canvas to pdf bytes
+* ``reparse``: parsing the overlay pdf back in with PyPDF2
+* ``merge``: merging the overlays and direct content into the pages
+* ``write``: serializing the output pdf
+* ``total``: the whole :meth:`.PdfFormFiller.write` call
+"""
+
+class _Timer(object):
+    "Context manager that records the time spent in a phase"
+    __slots__ = ("stats", "phase", "pagenum", "start")
+
+    def __init__(self, stats, phase, pagenum):
+        self.stats = stats
+        self.phase = phase
+        self.pagenum = pagenum
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.record(self.phase, clock() - self.start, self.pagenum)
+        return False
+
+class _NullTimer(object):
+    "Context manager that does nothing"
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class FillStats(object):
+    """Records wall time and counts per phase and per page.
+
+    One stats object can be shared by many fillers (and threads), in which
+    case it adds up all of their writes.
+
+    Keyword Args:
+        callback (callable): Called as ``callback(stats)`` at the end of
+            every :meth:`.PdfFormFiller.write`, e.g. to send
+            :meth:`as_dict` to a metrics pipeline (and then :meth:`reset`).
+
+    Attributes:
+        seconds (dict): Phase name to total wall time (see :data:`PHASES`)
+        calls (dict): Phase name to number of times it was timed
+        counts (dict): Counter name to total, e.g. ``fields`` (text fields
+            rendered), ``shrunk`` (fields shrunk to fit), ``passes``
+            (paragraph layout passes, including shrink iterations, for the
+            reportlab engine), ``overlayBytes`` (size of the reportlab
+            overlay pdfs), ``images`` (images drawn), ``cacheHits``,
+            ``cacheMisses``, ``pages`` and ``writes``
+        pages (dict): Page number to a dict with the ``seconds`` and
+            ``counts`` for that page
+    """
+    enabled = True
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        "Forget everything recorded so far"
+        self.seconds = {}
+        self.calls = {}
+        self.counts = {}
+        self.pages = {}
+
+    def _page(self, pagenum):
+        if pagenum not in self.pages:
+            self.pages[pagenum] = {"seconds": {}, "counts": {}}
+        return self.pages[pagenum]
+
+    def timer(self, phase, pagenum=None):
+        """Time a phase.
+
+        Returns:
+            A context manager that records the time spent inside it
+        """
+        return _Timer(self, phase, pagenum)
+
+    def record(self, phase, seconds, pagenum=None):
+        "Add the wall time of a phase (and optionally a page)"
+        with self._lock:
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+            self.calls[phase] = self.calls.get(phase, 0) + 1
+            if pagenum is not None:
+                page = self._page(pagenum)["seconds"]
+                page[phase] = page.get(phase, 0.0) + seconds
+
+    def count(self, name, n=1, pagenum=None):
+        "Add to a counter (and optionally the page's counter)"
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+            if pagenum is not None:
+                page = self._page(pagenum)["counts"]
+                page[name] = page.get(name, 0) + n
+
+    def finish(self):
+        "Called at the end of each write"
+        if self.callback is not None:
+            self.callback(self)
+
+    def as_dict(self):
+        """Export everything recorded so far.
+
+        Returns:
+            dict: ``{"seconds": ..., "calls": ..., "counts": ..., "pages":
+            ...}``, a copy of the attributes of the same names
+        """
+        with self._lock:
+            return {
+                "seconds": dict(self.seconds),
+                "calls": dict(self.calls),
+                "counts": dict(self.counts),
+                "pages": dict((n, {"seconds": dict(p["seconds"]), "counts": dict(p["counts"])})
+                    for n, p in self.pages.items()),
+            }
+
+    def __repr__(self):
+        return "<FillStats {}>".format(" ".join("{}={:.3f}s".format(phase, self.seconds[phase])
+            for phase in PHASES if phase in self.seconds))
+
+class NullStats(object):
+    "Stats that record nothing, used when a filler has no :class:`.FillStats`"
+    enabled = False
+
+    def timer(self, phase, pagenum=None):
+        return _NULL_TIMER
+
+    def record(self, phase, seconds, pagenum=None):
+        pass
+
+    def count(self, name, n=1, pagenum=None):
+        pass
+
+    def finish(self):
+        pass
+
+NULL_STATS = NullStats()
@@ -0,0 +1,209 @@
+import mmap
+import hashlib
+from io import BytesIO
+from threading import RLock, local
+from contextlib import contextmanager
+from PyPDF2 import PdfFileReader
+from PyPDF2.generic import IndirectObject, DictionaryObject, ArrayObject
+
+from .backends import choose_backend, get_backend
+try:
+    basestring
+except NameError:
+    basestring = str
+
+def _lock_reads(reader):
+    """Make a reader's lazy object parsing thread-safe.
+
+    Parsing an object the first time it's used seeks and reads the reader's
+    stream, so only one thread at a time can do it. Objects that were already
+    parsed are returned without locking.
+
+    Returns:
+        tuple: The lock, and a thread local whose ``parsed`` set (if a thread
+        sets one) collects the ``resolvedObjects`` keys the thread parses
+    """
+    lock = RLock()
+    reads = local()
+    getObject = reader.getObject
+    def lockedGetObject(indirectReference):
+        key = (indirectReference.generation, indirectReference.idnum)
+        obj = reader.resolvedObjects.get(key)
+        if obj is not None:
+            return obj
+        with lock:
+            parsed = getattr(reads, "parsed", None)
+            if parsed is not None and key not in reader.resolvedObjects:
+                parsed.add(key)
+            return getObject(indirectReference)
+    reader.getObject = lockedGetObject
+    return lock, reads
+
+def _map(f):
+    "Read-only memory map of a file"
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class PdfTemplate(object):
+    """A parsed pdf that can be filled out many times.
+
+    Parsing a pdf is usually the most expensive part of filling out a short
+    form, so if you are filling out the same pdf over and over again (e.g.
+    in a web service), you can parse it once with this class and then create
+    as many :class:`.PdfFormFiller` instances from it as you want. The fillers
+    all share the same parsed pages, so creating one is very cheap, and they
+    can be written from several threads at once (writing never modifies the
+    template).
+
+    Args:
+        pdf (str or file): The pdf to parse. Can be a string path to a file,
+            or a file-like object.
+
+    Keyword Args:
+        preload (bool): Whether to resolve every object used by the pages
+            up front. Default is ``True``, which makes the first fill as fast
+            as every other fill (otherwise objects are read from the pdf
+            lazily the first time they are written).
+        mmap (bool): Memory-map the pdf file instead of reading it into
+            memory (only for paths). The operating system then only keeps
+            the parts of the pdf that are used in memory, which, with
+            ``preload=False`` and a streaming write (see
+            :meth:`.PdfFormFiller.write`), keeps memory use low for huge
+            pdfs. Default is ``False``.
+        backend (str): Pdf library that fills out the template (see
+            :mod:`.backends`). ``"auto"`` picks the fastest one installed.
+            With a backend other than ``"pypdf2"`` (default), PyPDF2 only
+            parses the pdf if a feature that needs it is used.
+
+    Attributes:
+        pdf (PdfFileReader): The parsed pdf. This should be treated as
+            read-only.
+        pages (list[PageObject]): The parsed pages
+        backend (str): Name of the backend
+        mediaBoxes (list[tuple]): ``(x1, y1, x2, y2)`` media box of each page.
+        pageSizes (list[tuple]): ``(width, height)`` of each page.
+        fields (OrderedDict): The pdf's interactive form fields (see
+            :func:`.discover`), found the first time this is used.
+        digest (str): SHA-256 hex digest of the pdf bytes
+
+    Note:
+        Templates can be pickled (e.g. to send to worker processes). Only the
+        original pdf bytes are pickled, and the pdf is parsed again when
+        unpickled.
+
+    """
+    def __init__(self, pdf, preload=True, mmap=False, backend="pypdf2"):
+        if isinstance(pdf, basestring):
+            with open(pdf, "rb") as f:
+                data = _map(f) if mmap else f.read()
+        else:
+            data = pdf.read()
+        self._load(data, preload, backend)
+
+    def _load(self, data, preload, backend):
+        self.data = data
+        self.backend = choose_backend(backend)
+        self.preloaded = preload
+        self._pdf = None
+        self._pages = None
+        self._parseLock = RLock()
+        self._readLock = self._reads = None
+        self._fields = None
+        self._digest = None
+        if self.backend == "pypdf2":
+            self.mediaBoxes = [tuple(float(n) for n in page.mediaBox) for page in self.pages]
+        else:
+            self.mediaBoxes = get_backend(self.backend).page_boxes(data)
+        self.pageSizes = [(box[2] - box[0], box[3] - box[1]) for box in self.mediaBoxes]
+
+    def _parse(self):
+        "Parse the pdf with PyPDF2"
+        with self._parseLock:
+            if self._pages is not None:
+                return
+            data = self.data
+            # memory maps are file-like already
+            pdf = PdfFileReader(data if isinstance(data, mmap.mmap) else BytesIO(data))
+            self._readLock, self._reads = _lock_reads(pdf)
+            self._pdf = pdf
+            self._pages = [pdf.getPage(i) for i in range(pdf.numPages)]
+            if self.preloaded:
+                self._preload()
+
+    @property
+    def pdf(self):
+        if self._pages is None:
+            self._parse()
+        return self._pdf
+
+    @property
+    def pages(self):
+        if self._pages is None:
+            self._parse()
+        return self._pages
+
+    def _preload(self):
+        "Resolve all the indirect objects reachable from the pages"
+        seen = set()
+        stack = list(self.pages)
+        while stack:
+            obj = stack.pop()
+            if isinstance(obj, IndirectObject):
+                key = (obj.idnum, obj.generation)
+                if key in seen:
+                    continue
+                seen.add(key)
+                stack.append(obj.getObject())
+            elif isinstance(obj, DictionaryObject):
+                stack.extend(v for k, v in obj.items() if k != "/Parent")
+            elif isinstance(obj, ArrayObject):
+                stack.extend(obj)
+
+    @contextmanager
+    def _forget_parsed(self):
+        """Forget the objects this thread parses in the block when it ends
+        (they're parsed again if they're needed), e.g. after writing a page
+        of a huge pdf. Objects parsed by other threads are kept."""
+        reader = self.pdf
+        self._reads.parsed = parsed = set()
+        try:
+            yield
+        finally:
+            self._reads.parsed = None
+            with self._readLock:
+                for key in parsed:
+                    reader.resolvedObjects.pop(key, None)
+
+    @property
+    def fields(self):
+        if self._fields is None:
+            from .acroform import discover
+            self._fields = discover(self)
+        return self._fields
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.data).hexdigest()
+        return self._digest
+
+    def __len__(self):
+        return len(self.mediaBoxes)
+
+    def __getstate__(self):
+        return {"data": bytes(self.data), "preload": self.preloaded, "backend": self.backend}
+
+    def __setstate__(self, state):
+        self._load(state["data"], state["preload"], state.get("backend", "pypdf2"))
+
+    def filler(self, **kwargs):
+        """Create a new :class:`.PdfFormFiller` for this template.
+
+        Keyword Args:
+            **kwargs: Passed through to :class:`.PdfFormFiller` (e.g.
+                ``style``, ``padding``, ``boxes``).
+
+        Returns:
+            :class:`.PdfFormFiller`
+        """
+        from .pdfformfiller import PdfFormFiller
+        return PdfFormFiller(self, **kwargs)
@@ -1,4 +1,7 @@
-from distutils.core import setup
+try:
+    from setuptools import setup
+except ImportError:
+    from distutils.core import setup
 
 setup(
     name = "PdfFormFiller",
@@ -12,9 +15,17 @@ setup(
     url = "https://github.com/diafygi/pdfformfiller",
     download_url = "https://github.com/diafygi/pdfformfiller/archive/0.4.tar.gz",
     install_requires = [
-        "PyPDF2>=1.25.1",
+        "PyPDF2>=1.25.1,<2",
         "reportlab>=3.3.0",
     ],
+    extras_require = {
+        "pypdf": ["pypdf>=3.0"],
+        "pikepdf": ["pikepdf"],
+        "numpy": ["numpy"],
+    },
+    entry_points = {
+        "console_scripts": ["pdfformfiller = pdfformfiller.cli:main"],
+    },
     classifiers = [
         "Programming Language :: Python",
         "Programming Language :: Python :: 3",
@@ -1,12 +1,83 @@
+import os
+import asyncio
 import unittest
-from io import BytesIO
+from io import BytesIO, StringIO
+from contextlib import redirect_stderr
 from hashlib import sha256
 from base64 import b64decode
 from subprocess import Popen, PIPE
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, mkdtemp
+from pickle import dumps, loads
+from concurrent.futures import ThreadPoolExecutor
+from PyPDF2 import PdfFileReader
+from PyPDF2.generic import ArrayObject
+import reportlab
 from reportlab.lib.styles import ParagraphStyle
+from reportlab.pdfgen.canvas import Canvas
 
-from pdfformfiller import PdfFormFiller
+from pdfformfiller import (PdfFormFiller, PdfTemplate, fill_many, FillLimiter,
+    Layout, LayoutError, FillStats, check_fit)
+from pdfformfiller.pdfformfiller import MERGE_MODES
+from pdfformfiller.fit import TextFitter, solve
+from pdfformfiller.cli import main as cli_main
+from pdfformfiller.batch import iter_fill
+from pdfformfiller.acroform import field_boxes
+from pdfformfiller.cache import MemoryCache, DiskCache, LayeredCache
+from pdfformfiller.images import ImageCache
+from pdfformfiller.backends import installed
+from pdfformfiller.serialize import ConcatenatedWriter, SharedTemplateWriter
+from pdfformfiller.fonts import FontSubsets, register_font
+
+def make_pdf(pages, pagesize=(612, 792)):
+    "Generate a blank pdf with several pages"
+    packet = BytesIO()
+    canvas = Canvas(packet, pagesize=pagesize)
+    for pagenum in range(pages):
+        canvas.drawString(100, 600, "Page {}".format(pagenum))
+        canvas.showPage()
+    canvas.save()
+    packet.seek(0)
+    return packet
+
+def make_form():
+    "Generate a pdf with a text field, a check box and radio buttons"
+    packet = BytesIO()
+    canvas = Canvas(packet, pagesize=(612, 792))
+    form = canvas.acroForm
+    form.textfield(name="name", x=50, y=650, width=300, height=24, value="")
+    form.checkbox(name="agree", x=50, y=600, size=20, checked=False)
+    form.radio(name="color", value="red", x=50, y=550, selected=False)
+    form.radio(name="color", value="blue", x=100, y=550, selected=False)
+    canvas.showPage()
+    canvas.save()
+    packet.seek(0)
+    return packet
+
+def make_image(size=(40, 20), color=(0, 0, 255, 128), fmt="PNG"):
+    "Generate image file bytes"
+    from PIL import Image
+    packet = BytesIO()
+    Image.new("RGBA" if fmt == "PNG" else "RGB", size, color[:4 if fmt == "PNG" else 3]).save(
+        packet, fmt)
+    return packet.getvalue()
+
+class AsyncCollector(object):
+    "Async writer that keeps the chunks written to it"
+    def __init__(self, fail=False):
+        self.chunks = []
+        self.fail = fail
+
+    def write(self, data):
+        if self.fail:
+            raise IOError("client went away")
+        self.chunks.append(data)
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(None)
+        return future
+
+def name_layout(filler, record):
+    "Example layout used for batch tests"
+    filler.add_text(record, 0, (50, 50), (500, 100))
 
 class TestPdfFormFiller(unittest.TestCase):
     """ Tests for PdfFormFiller """
@@ -29,6 +100,18 @@ class TestPdfFormFiller(unittest.TestCase):
             "pdf hash ({}) doesn't match expected hashes ({})".format(
                 pdf_hash, known_hash))
 
+    def assertTextCount(self, pdf, text, count, pagenum=0):
+        "Check how many times some text is drawn on a page of the pdf"
+        pdf.seek(0)
+        page = PdfFileReader(pdf).getPage(pagenum)
+        contents = page.getContents()
+        if isinstance(contents, ArrayObject):
+            content = b"\n".join(c.getObject().getData() for c in contents)
+        else:
+            content = contents.getData()
+        content = content.replace(b"\\040", b" ")
+        self.assertEqual(content.count(text.encode("latin-1")), count)
+
     def test_no_fields(self):
         "Still exports even when no text fields are added"
         filler = PdfFormFiller(self.pdf)
@@ -97,6 +180,838 @@ class TestPdfFormFiller(unittest.TestCase):
         filler.write(self.out)
         self.assertHashOutput(self.out, "2a195aa2ce8a1cc40465cffb39bcc187bd4555679611589083b8019fbe0933ef")
 
+    def test_template_reuse(self):
+        "parsed templates can be filled many times"
+        template = PdfTemplate(self.pdf)
+        for i in range(3):
+            filler = template.filler()
+            filler.add_text("Joe Smith", 0, (50, 50), (500, 100))
+            out = BytesIO()
+            filler.write(out)
+            self.assertTextCount(out, "Joe Smith", 1)
+            self.assertTextCount(out, "Hello World", 1)
+
+    def test_template_pickle(self):
+        "parsed templates can be pickled"
+        template = loads(dumps(PdfTemplate(self.pdf)))
+        self.assertEqual(template.pageSizes, [(612, 792)])
+        filler = PdfFormFiller(template)
+        filler.add_text("Joe Smith", 0, (50, 50), (500, 100))
+        filler.write(self.out)
+        self.assertTextCount(self.out, "Joe Smith", 1)
+
+    def test_fill_many(self):
+        "batches can be filled with worker processes"
+        names = ["Joe Smith", "Jane Doe", "Bob Jones", "Ann Lee", "Tim Fay"]
+        results = []
+        template = PdfTemplate(self.pdf)
+        stats = fill_many(template, name_layout, iter(names),
+            lambda i, record, data: results.append((i, record, data)), workers=2)
+        self.assertEqual(stats.count, len(names))
+        self.assertEqual([r[0] for r in results], list(range(len(names))))
+        for i, name, data in results:
+            self.assertTextCount(BytesIO(data), name, 1)
+
+        # without ordering, results and errors are handed back as they're done
+        results = dict((i, data) for i, record, data in iter_fill(template, name_layout,
+            names + [None], workers=2, ordered=False, errors="yield"))
+        self.assertEqual(sorted(results), list(range(len(names) + 1)))
+        self.assertIsInstance(results.pop(len(names)), Exception)
+        for i, data in results.items():
+            self.assertTextCount(BytesIO(data), names[i], 1)
+
+        # failed records are kept with their exceptions, or stop the run
+        results = []
+        stats = fill_many(template, name_layout, names + [None],
+            lambda i, record, data: results.append(i), workers=2, errors="yield")
+        self.assertEqual(len(results), len(names))
+        self.assertEqual([i for i, e in stats.failures], [len(names)])
+        self.assertIsInstance(stats.failures[0][1], Exception)
+        self.assertEqual(stats.errors, 1)
+        with self.assertRaises(Exception):
+            fill_many(template, name_layout, [None], lambda i, record, data: None,
+                workers=2, ordered=False)
+
+    def test_fill_many_directory(self):
+        "batches can be written to a directory without worker processes"
+        outdir = mkdtemp()
+        fill_many(self.pdf, name_layout, ["Joe Smith", "Jane Doe"], outdir, workers=0)
+        with open(os.path.join(outdir, "1.pdf"), "rb") as f:
+            self.assertTextCount(f, "Jane Doe", 1)
+
+    def test_overlay_modes(self):
+        "document and page overlays put text on the same pages"
+        for overlay in ("document", "page"):
+            pdf = make_pdf(3, pagesize=(300, 400))
+            filler = PdfFormFiller(pdf, overlay=overlay)
+            filler.add_text("Joe Smith", 0, (50, 50), (250, 100))
+            filler.add_text("Jane Doe", 2, (50, 50), (250, 100))
+            out = BytesIO()
+            filler.write(out)
+            self.assertTextCount(out, "Joe Smith", 1, pagenum=0)
+            self.assertTextCount(out, "Joe Smith", 0, pagenum=1)
+            self.assertTextCount(out, "Jane Doe", 0, pagenum=1)
+            self.assertTextCount(out, "Jane Doe", 1, pagenum=2)
+            out.seek(0)
+            self.assertEqual(PdfFileReader(out).getPage(2).mediaBox[3], 400)
+
+    def test_direct_engine(self):
+        "plain text is written straight into the page content"
+        filler = PdfFormFiller(self.pdf, engine="direct")
+        filler.add_text("Joe Smith", 0, (50, 50), (500, 100))
+        filler.add_text("Jane (Doe)", 0, (50, 200), (500, 250))
+        filler.write(self.out)
+        self.assertTextCount(self.out, "Joe Smith", 1)
+        self.assertTextCount(self.out, "Jane \\(Doe\\)", 1)
+        self.assertTextCount(self.out, "Hello World", 1)
+        self.out.seek(0)
+        fonts = PdfFileReader(self.out).getPage(0)["/Resources"]["/Font"]
+        self.assertEqual(fonts["/FF1"]["/BaseFont"], "/Times-Roman")
+        self.assertIn("/F1", fonts)
+
+    def test_direct_engine_fallback(self):
+        "markup still gets rendered by reportlab"
+        filler = PdfFormFiller(self.pdf, engine="direct")
+        filler.add_text("<b>Joe</b> Smith", 0, (50, 50), (500, 100))
+        filler.add_text("Jane Doe", 0, (50, 200), (500, 250))
+        filler.write(self.out)
+        self.assertTextCount(self.out, "Joe", 1)
+        self.assertTextCount(self.out, "Jane Doe", 1)
+
+    def test_fit_cache(self):
+        "repeated text fields reuse the shrink calculation"
+        fitter = TextFitter(maxsize=2)
+        for engine in ("reportlab", "direct", "reportlab", "direct"):
+            filler = PdfFormFiller(PdfTemplate(BytesIO(hello_world_pdf)), engine=engine, fitter=fitter)
+            filler.add_text("Joe Smith " * 30, 0, (50, 50), (500, 100))
+            filler.write(BytesIO())
+        info = fitter.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (2, 2, 2))
+        filler.add_text("Jane Doe", 0, (50, 200), (500, 250))
+        filler.write(BytesIO())
+        self.assertEqual(fitter.cache_info().currsize, 2)
+        fitter.cache_clear()
+        self.assertEqual(fitter.cache_info(), (0, 0, 2, 0))
+
+    def test_fit_solve(self):
+        "shrunk text fits in its box"
+        scale, lines = solve("Joe Smith " * 30, "Times-Roman", 20, 24, 438, 38)
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(len(lines) * 24 / scale <= 38)
+        self.assertTrue(max(w for w, _ in lines) / scale <= 438)
+        self.assertEqual(solve("Joe Smith", "Times-Roman", 20, 24, 438, 38)[0], 1.0)
+
+    def test_check_fit(self):
+        "checking records reports the fields that would be shrunk, like the direct engine"
+        layout = Layout.load(StringIO(example_layout))
+        records = [{"name": "Joe Smith", "ssn": "123-45-6789"},
+            {"name": "Joe Smith " * 30, "ssn": u"\u4e2d " * 100}, {"ssn": None}]
+        results = check_fit(layout, records)
+        self.assertEqual([(r.record, r.name, r.fits) for r in results], [(0, "name", True),
+            (0, "ssn", True), (1, "name", False), (1, "ssn", False)])
+        self.assertEqual(results[0].lines, 1)
+        self.assertEqual(results[0].shrink, 1.0)
+        self.assertEqual(results[2].shrink, 1.0 / solve("Joe Smith " * 30,
+            "Times-Roman", 20, 24, 450, 50)[0])
+        self.assertGreater(results[2].overflow, 0)
+        self.assertEqual(check_fit(layout, records, onlyOverflow=True), results[2:])
+
+        stats = FillStats()
+        filler = PdfFormFiller(self.pdf, engine="direct", stats=stats)
+        layout.compile(filler.template).add_to(filler, records[1])
+        filler.add_text("Joe Smith", 0, (50, 200), (500, 250))
+        results = filler.validate()
+        self.assertEqual([(r.page, r.name) for r in results], [(0, 0), (0, 1), (0, 2)])
+        filler.write(self.out)
+        self.assertEqual(stats.as_dict()["pages"][0]["counts"]["shrunk"],
+            sum(not r.fits for r in results))
+
+    def test_incremental(self):
+        "incremental updates append to the original pdf"
+        for engine in ("reportlab", "direct"):
+            pdf = make_pdf(3)
+            original = pdf.getvalue()
+            filler = PdfFormFiller(pdf, engine=engine)
+            filler.add_text("Joe Smith", 1, (50, 50), (500, 100))
+            out = BytesIO()
+            filler.write(out, incremental=True)
+            self.assertTrue(out.getvalue().startswith(original))
+            self.assertTextCount(out, "Page 1", 1, pagenum=1)
+            self.assertTextCount(out, "Joe Smith", 1, pagenum=1)
+            self.assertTextCount(out, "Joe Smith", 0, pagenum=0)
+            out.seek(0)
+            self.assertEqual(PdfFileReader(out).numPages, 3)
+
+    def test_incremental_no_fields(self):
+        "incremental updates without text fields are just the original pdf"
+        filler = PdfFormFiller(self.pdf)
+        filler.write(self.out, incremental=True)
+        self.assertEqual(self.out.getvalue(), hello_world_pdf)
+
+    def test_write_async(self):
+        "pdfs can be streamed to async writers in chunks"
+        limiter = FillLimiter(2)
+        filler = PdfFormFiller(self.pdf)
+        filler.add_text("Joe Smith", 0, (50, 50), (500, 100))
+        out = AsyncCollector()
+        asyncio.run(filler.write_async(out, limiter=limiter, chunkSize=256))
+        self.assertTrue(len(out.chunks) > 1)
+        self.assertTextCount(BytesIO(b"".join(out.chunks)), "Joe Smith", 1)
+        limiter.shutdown()
+
+    def test_write_async_error(self):
+        "errors writing the output stop the write"
+        limiter = FillLimiter(1)
+        filler = PdfFormFiller(self.pdf)
+        filler.add_text("Joe Smith", 0, (50, 50), (500, 100))
+        with self.assertRaises(IOError):
+            asyncio.run(filler.write_async(AsyncCollector(fail=True), limiter=limiter, chunkSize=256))
+        # the slot is given back once the executor is done
+        limiter.shutdown()
+        self.assertFalse(limiter.semaphore.locked())
+
+    def test_write_async_cancel(self):
+        "a stuck client holds back the executor thread until it's cancelled"
+        limiter = FillLimiter(1)
+        filler = PdfFormFiller(make_pdf(20))
+        filler.add_text("Joe Smith", 0, (50, 50), (500, 100))
+        stuck = []
+        class StuckWriter(object):
+            def write(self, data):
+                stuck.append(data)
+                return asyncio.get_event_loop().create_future()
+        async def write():
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(filler.write_async(StuckWriter(), limiter=limiter,
+                    chunkSize=256), 0.5)
+            # the executor thread stops instead of waiting for room forever,
+            # and gives back its slot
+            await asyncio.wait_for(limiter.semaphore.acquire(), 10)
+        asyncio.run(write())
+        self.assertEqual(len(stuck), 1)
+        limiter.shutdown()
+
+    def test_write_async_loop_closed(self):
+        "the executor thread stops if the event loop stops while it waits"
+        filler = PdfFormFiller(make_pdf(20))
+        filler.add_text("Joe Smith", 0, (50, 50), (500, 100))
+        class StuckWriter(object):
+            def write(self, data):
+                return asyncio.get_event_loop().create_future()
+        executor = ThreadPoolExecutor(1)
+        loop = asyncio.new_event_loop()
+        task = loop.create_task(filler.write_async(StuckWriter(), executor=executor,
+            chunkSize=256))
+        loop.run_until_complete(asyncio.sleep(0.3))
+        # the loop has stopped with the thread's queue full, so nothing makes
+        # room in it
+        finished = executor.submit(lambda: None)
+        self.assertIsNone(finished.result(10))
+        executor.shutdown()
+        task.cancel()
+        loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+        loop.close()
+
+    def test_layout(self):
+        "layouts can be loaded from json and filled out"
+        layout = Layout.load(StringIO(example_layout))
+        plan = layout.compile(PdfTemplate(self.pdf))
+        filler = plan.fill({"name": "Joe Smith", "ssn": 123456789})
+        self.assertEqual(len(filler[0]), 2)
+        self.assertEqual(filler[0][0].y1, 792 - 100)
+        self.assertEqual(filler[0][1].style.fontSize, 8)
+        self.assertEqual(filler[0][1].padding, (2, 2, 2, 2))
+        filler.write(self.out)
+        self.assertTextCount(self.out, "Joe Smith", 1)
+        self.assertTextCount(self.out, "123456789", 1)
+
+        # compiled layouts can be sent to worker processes
+        results = []
+        fill_many(plan.template, loads(dumps(plan)), [{"name": "Jane Doe"}],
+            lambda i, record, data: results.append(data), workers=1)
+        self.assertTextCount(BytesIO(results[0]), "Jane Doe", 1)
+
+    def test_layout_validation(self):
+        "layout boxes have to fit on their pages"
+        template = PdfTemplate(self.pdf)
+        layout = Layout.from_dict({"fields": [{"name": "a", "box": [[50, 50], [700, 100]]}]})
+        self.assertRaises(LayoutError, layout.compile, template)
+        layout = Layout.from_dict({"fields": [{"name": "a", "page": 1, "box": [[50, 50], [70, 100]]}]})
+        self.assertRaises(LayoutError, layout.compile, template)
+        self.assertRaises(LayoutError, Layout.from_dict, {"fields": [{"name": "a"}]})
+        self.assertRaises(LayoutError, Layout.from_dict,
+            {"fields": [{"name": "a", "box": [[50, 50], [70, 100]], "style": "nope"}]})
+
+    def test_static_fields(self):
+        "static layout fields are baked into the template once"
+        template = PdfTemplate(self.pdf)
+        layout = Layout.from_dict({"fields": [
+            {"name": "name", "box": [[50, 50], [500, 100]]},
+            {"name": "agency", "box": [[50, 200], [500, 250]], "value": "Department of Forms"},
+        ]})
+        plan = layout.compile(template)
+        self.assertNotEqual(plan.template.digest, template.digest)
+        self.assertEqual(len(plan.fields), 1)
+        filler = plan.fill({"name": "Joe Smith"})
+        self.assertEqual(len(filler[0]), 1)
+        filler.write(self.out)
+        self.assertTextCount(self.out, "Joe Smith", 1)
+        self.assertTextCount(self.out, "Department of Forms", 1)
+
+        # filling out the original template still adds the static fields
+        for plan, template in ((plan, template), (layout.compile(template, bake=False), None)):
+            out = BytesIO()
+            plan.fill({"name": "Jane Doe"}, template=template).write(out)
+            self.assertTextCount(out, "Jane Doe", 1)
+            self.assertTextCount(out, "Department of Forms", 1)
+
+    def test_add_texts(self):
+        "bulk added fields match fields added one at a time"
+        template = PdfTemplate(self.pdf)
+        boxes = [((50, 50 + i * 20), (500, 65 + i * 20.5)) for i in range(30)]
+        texts = ["Row {}".format(i) for i in range(30)]
+        single = PdfFormFiller(template)
+        for text, (upperLeft, lowerRight) in zip(texts, boxes):
+            single.add_text(text, 0, upperLeft, lowerRight)
+        for compact in (False, True):
+            filler = PdfFormFiller(template, compact=compact)
+            filler.add_texts(0, texts, boxes)
+            self.assertEqual(list(filler[0]), single[0])
+        self.assertRaises(ValueError, filler.add_texts, 0, texts, boxes[1:])
+
+    def test_field_table(self):
+        "compact field tables work like lists of text fields"
+        filler = PdfFormFiller(self.pdf, compact=True, engine="direct")
+        filler.add_text("Joe Smith", 0, (50, 50), (500, 100))
+        filler.add_text("Jane Doe", 0, (50, 200), (500, 250), padding=[6, 6, 6, 6])
+        filler.add_text("Bob Jones", 0, (50, 300), (500, 350))
+        del filler[0][2]
+        self.assertEqual(len(filler[0]), 2)
+        self.assertEqual(filler[0][-1].text, "Jane Doe")
+        self.assertEqual(filler[0][-1].padding, (6, 6, 6, 6))
+        self.assertEqual(loads(dumps(filler[0]))[0], filler[0][0])
+        filler.write(self.out)
+        self.assertTextCount(self.out, "Joe Smith", 1)
+        self.assertTextCount(self.out, "Jane Doe", 1)
+        self.assertTextCount(self.out, "Bob Jones", 0)
+
+    def test_stats(self):
+        "write records per phase and per page stats"
+        written = []
+        stats = FillStats(callback=lambda s: written.append(s.as_dict()))
+        filler = PdfFormFiller(self.pdf, stats=stats, fitter=TextFitter())
+        filler.add_text("Joe Smith " * 30, 0, (50, 50), (500, 100))
+        filler.add_text("Joe Smith", 0, (50, 200), (500, 250))
+        filler.write(self.out)
+        self.assertEqual(len(written), 1)
+        result = written[0]
+        for phase in ("template", "layout", "serialize", "reparse", "merge", "write", "total"):
+            self.assertIn(phase, result["seconds"])
+        self.assertEqual(result["counts"]["fields"], 2)
+        self.assertEqual(result["counts"]["shrunk"], 1)
+        self.assertTrue(result["counts"]["passes"] > 2)
+        self.assertTrue(result["counts"]["overlayBytes"] > 0)
+        self.assertEqual(result["pages"][0]["counts"]["fields"], 2)
+        self.assertIn("layout", result["pages"][0]["seconds"])
+
+        stats.reset()
+        filler = PdfFormFiller(BytesIO(hello_world_pdf), stats=stats, engine="direct")
+        filler.add_text("Joe Smith", 0, (50, 50), (500, 100))
+        filler.write(BytesIO())
+        self.assertEqual(stats.counts["fields"], 1)
+        self.assertIn("render", stats.seconds)
+        self.assertNotIn("layout", stats.seconds)
+
+    def test_cli(self):
+        "fills records from csv or json lines, skipping ones that fail"
+        tmpdir = mkdtemp()
+        template = os.path.join(tmpdir, "template.pdf")
+        with open(template, "wb") as f:
+            f.write(hello_world_pdf)
+        layout = os.path.join(tmpdir, "layout.json")
+        with open(layout, "w") as f:
+            f.write(example_layout)
+        records = os.path.join(tmpdir, "records.csv")
+        with open(records, "w") as f:
+            f.write("name,ssn\nJoe Smith,123\n<b>Jane Doe,456\nBob Jones,789\n")
+
+        outdir = os.path.join(tmpdir, "out")
+        errors = StringIO()
+        status = cli_main([template, layout, records, "-o", outdir, "-w", "0",
+            "-n", "{name}.pdf", "-q"], stderr=errors)
+        self.assertEqual(status, 1)
+        self.assertEqual(sorted(os.listdir(outdir)), ["Bob Jones.pdf", "Joe Smith.pdf"])
+        self.assertIn("record 1", errors.getvalue())
+
+        combined = BytesIO()
+        stdin = StringIO(u'{"name": "Joe Smith"}\nnot json\n{"name": "Jane Doe"}\n')
+        status = cli_main([template, layout, "-o", "-", "-w", "0", "-q"],
+            stdin=stdin, stdout=combined, stderr=StringIO())
+        self.assertEqual(status, 1)
+        self.assertEqual(PdfFileReader(combined).getNumPages(), 2)
+        self.assertTextCount(combined, "Joe Smith", 1, pagenum=0)
+        self.assertTextCount(combined, "Jane Doe", 1, pagenum=1)
+
+        shared = BytesIO()
+        stdin = StringIO(u'{"name": "Joe Smith"}\n{"name": "<b>Jane Doe"}\n{"name": "Bob Jones"}\n')
+        status = cli_main([template, layout, "-o", "-", "--share-template", "-q"],
+            stdin=stdin, stdout=shared, stderr=StringIO())
+        self.assertEqual(status, 1)
+        self.assertEqual(PdfFileReader(shared).getNumPages(), 2)
+        self.assertTextCount(shared, "Bob Jones", 1, pagenum=1)
+        self.assertEqual(cli_main([template, layout, "-o", outdir, "--share-template"],
+            stderr=StringIO()), 2)
+        self.assertEqual(cli_main([template, layout, "-o", outdir, "--font", "Vera"],
+            stderr=StringIO()), 2)
+
+        # a malformed --name pattern is rejected up front, and one that only
+        # fails for some records skips them
+        with redirect_stderr(StringIO()):
+            with self.assertRaises(SystemExit) as e:
+                cli_main([template, layout, records, "-o", outdir, "-n", "{name"])
+        self.assertEqual(e.exception.code, 2)
+        errors = StringIO()
+        status = cli_main([template, layout, records, "-o", outdir, "-w", "0",
+            "-n", "{name.missing}.pdf", "-q"], stderr=errors)
+        self.assertEqual(status, 1)
+        self.assertEqual(errors.getvalue().count("bad --name pattern"), 2)
+        self.assertEqual(cli_main([template, layout, "-o", outdir, "--font",
+            "Vera=" + os.path.join(tmpdir, "missing.ttf")], stderr=StringIO()), 2)
+
+        # a record field called "index" doesn't break the pattern, and a name
+        # that can't be written only skips its record
+        with open(records, "w") as f:
+            f.write("index,name\n7,Joe Smith\n8,\n")
+        outdir = os.path.join(tmpdir, "indexed")
+        errors = StringIO()
+        status = cli_main([template, layout, records, "-o", outdir, "-w", "0",
+            "-n", "{index}-{name}.pdf", "-q"], stderr=errors)
+        self.assertEqual(status, 0)
+        self.assertEqual(sorted(os.listdir(outdir)), ["0-Joe Smith.pdf", "1-.pdf"])
+        errors = StringIO()
+        status = cli_main([template, layout, records, "-o", outdir, "-w", "0",
+            "-n", "{name}", "-q"], stderr=errors)
+        self.assertEqual(status, 1)
+        self.assertIn("record 1", errors.getvalue())
+        self.assertIn("Joe Smith", os.listdir(outdir))
+
+        # an unreadable records file is an argument error
+        errors = StringIO()
+        self.assertEqual(cli_main([template, layout, os.path.join(tmpdir, "missing.csv"),
+            "-o", outdir], stderr=errors), 2)
+        self.assertIn("missing.csv", errors.getvalue())
+
+    def test_acroform(self):
+        "fills out the pdf's own form fields"
+        template = PdfTemplate(make_form())
+        self.assertEqual(list(template.fields), ["name", "agree", "color"])
+        self.assertEqual(field_boxes(template)["name"], [(0, (50, 118), (350, 142))])
+        for incremental in (False, True):
+            filler = template.filler()
+            filler.set_field("name", "Joe Smith")
+            filler.set_field("agree", True)
+            filler.set_field("color", "blue")
+            out = BytesIO()
+            filler.write(out, incremental=incremental)
+            out.seek(0)
+            reader = PdfFileReader(out)
+            values = dict((k, v.get("/V")) for k, v in reader.getFields().items())
+            self.assertEqual(values, {"name": "Joe Smith", "agree": "/Yes", "color": "/blue"})
+            self.assertTextCount(out, "Joe Smith", 0)
+        self.assertEqual(template.fields["name"].value, "")
+        self.assertRaises(KeyError, filler.set_field, "nope", "x")
+
+        filler = template.filler(appearances=False)
+        filler.set_field("name", "Joe Smith")
+        out = BytesIO()
+        filler.write(out)
+        out.seek(0)
+        acroform = PdfFileReader(out).trailer["/Root"]["/AcroForm"]
+        self.assertTrue(acroform["/NeedAppearances"])
+
+    def test_deterministic(self):
+        "deterministic output only depends on the inputs"
+        outputs = []
+        for i in range(2):
+            filler = PdfFormFiller(BytesIO(hello_world_pdf), deterministic=True)
+            filler.add_text("Joe Smith", 0, (50, 50), (500, 100))
+            filler.add_text("Jane <b>Doe</b>", 0, (50, 150), (500, 200))
+            out = BytesIO()
+            filler.write(out)
+            outputs.append(out.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertIn(b"/ID", outputs[0])
+        self.assertTextCount(BytesIO(outputs[0]), "Joe Smith", 1)
+
+    def test_shared_writes(self):
+        "writing never modifies the template, so fillers can share it across threads"
+        template = PdfTemplate(make_form(), preload=False)
+        def fill(i):
+            filler = template.filler(deterministic=True)
+            filler.add_text("Record {}".format(i % 4), 0, (50, 50), (500, 100))
+            filler.set_field("name", "Joe Smith")
+            outputs = []
+            for _ in range(2):
+                out = BytesIO()
+                filler.write(out)
+                outputs.append(out.getvalue())
+            return outputs
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(fill, range(16)))
+        for i, (first, second) in enumerate(results):
+            self.assertEqual(first, second)
+            self.assertEqual(first, results[i % 4][0])
+        self.assertTextCount(BytesIO(results[0][0]), "Record 0", 1)
+        self.assertEqual(template.pdf.getPage(0).getContents().getData(),
+            PdfFileReader(make_form()).getPage(0).getContents().getData())
+
+    def test_shared_streaming(self):
+        "streaming writes of a shared template only forget their own parsed objects"
+        template = PdfTemplate(make_pdf(20), preload=False)
+        def fill(i):
+            filler = template.filler(deterministic=True)
+            for pagenum in range(20):
+                filler.add_text("Record {} {}".format(i % 4, pagenum), pagenum, (50, 50),
+                    (500, 100))
+            out = BytesIO()
+            filler.write(out, streaming=i % 2 == 0)
+            return out.getvalue()
+        expected = [fill(i) for i in range(4)]
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(fill, range(32)))
+        for i, output in enumerate(results):
+            self.assertEqual(output, expected[i % 4])
+        self.assertTextCount(BytesIO(results[2]), "Record 2 19", 1, pagenum=19)
+
+    def test_select_pages(self):
+        "only the selected pages are written"
+        template = PdfTemplate(make_pdf(5))
+        filler = template.filler(deterministic=True)
+        filler.add_text("Joe Smith", 1, (50, 50), (500, 100))
+        filler.add_text("Jane Doe", 3, (50, 50), (500, 100))
+        self.assertEqual(filler.filled_pages(), [1, 3])
+        filler.write(self.out, pages=[3, 0])
+        self.assertEqual(PdfFileReader(self.out).numPages, 2)
+        self.assertTextCount(self.out, "Jane Doe", 1, pagenum=0)
+        self.assertTextCount(self.out, "Page 0", 1, pagenum=1)
+
+        out = BytesIO()
+        filler.write(out, onlyFilledPages=True)
+        self.assertEqual(PdfFileReader(out).numPages, 2)
+        self.assertTextCount(out, "Joe Smith", 1, pagenum=0)
+        self.assertLess(len(out.getvalue()), len(template.data))
+
+        pages = filler.write_pages(onlyFilledPages=True)
+        self.assertEqual(list(pages), [1, 3])
+        single = BytesIO()
+        filler.write(single, pages=[3])
+        self.assertEqual(pages[3], single.getvalue())
+        self.assertRaises(ValueError, filler.write, BytesIO(), pages=[5])
+        self.assertRaises(ValueError, filler.write, BytesIO(), incremental=True, pages=[1])
+
+        filler = PdfFormFiller(make_form())
+        filler.set_field("name", "Joe Smith")
+        self.assertEqual(filler.filled_pages(), [0])
+        filler.write(self.out, onlyFilledPages=True)
+        self.assertEqual(PdfFileReader(self.out).getFields()["name"]["/V"], "Joe Smith")
+
+    def test_compression(self):
+        "content streams can be written uncompressed or compressed"
+        template = PdfTemplate(make_pdf(3))
+        sizes = {}
+        for compression in ("none", "fast", "max"):
+            for incremental in (False, True):
+                filler = template.filler(compression=compression)
+                for pagenum in range(3):
+                    filler.add_text("Joe Smith " * 20, pagenum, (50, 50), (500, 300))
+                out = BytesIO()
+                filler.write(out, incremental=incremental)
+                self.assertTextCount(out, "Smith", 20, pagenum=2)
+                sizes[compression, incremental] = len(out.getvalue())
+        self.assertLess(sizes["fast", False], sizes["none", False])
+        self.assertLessEqual(sizes["max", True], sizes["fast", True])
+        self.assertRaises(ValueError, PdfFormFiller, self.pdf, compression="zip")
+
+    def test_merge_modes(self):
+        "appending keeps the template's content streams byte for byte"
+        template = PdfTemplate(make_pdf(3))
+        original = template.pdf.getPage(1).getContents()._data
+        for merge in MERGE_MODES:
+            filler = template.filler(merge=merge)
+            filler.add_text("Joe Smith", 1, (50, 50), (500, 100))
+            out = BytesIO()
+            filler.write(out)
+            self.assertTextCount(out, "Joe Smith", 1, pagenum=1)
+            self.assertTextCount(out, "Page 1", 1, pagenum=1)
+            contents = PdfFileReader(out).getPage(1).getContents()
+            if merge == "append":
+                self.assertIsInstance(contents, ArrayObject)
+                self.assertIn(original, [c.getObject()._data for c in contents])
+        self.assertRaises(ValueError, PdfFormFiller, self.pdf, merge="splice")
+
+    def test_images(self):
+        "each image is embedded once however many pages and pdfs use it"
+        logo, photo = make_image(), make_image((30, 30), fmt="JPEG")
+        images = ImageCache()
+        template = PdfTemplate(make_pdf(10))
+        combined = BytesIO()
+        writer = ConcatenatedWriter(combined)
+        for record in range(3):
+            filler = template.filler(images=images)
+            for pagenum in range(10):
+                filler.add_image(logo, pagenum, (50, 50), (250, 150))
+            filler.add_image(BytesIO(photo), 2, (300, 50), (400, 150), preserveAspectRatio=False)
+            filler.add_text("Joe Smith", 2, (50, 200), (500, 250))
+            out = BytesIO()
+            filler.write(out)
+            # the logo, its transparency mask and the photo
+            self.assertEqual(out.getvalue().count(b"/Subtype /Image"), 3)
+            self.assertTextCount(out, "Joe Smith", 1, pagenum=2)
+            self.assertTextCount(out, "Do", 2, pagenum=2)
+            writer.add(out.getvalue())
+        writer.close()
+        self.assertEqual(len(images), 2)
+        self.assertEqual(combined.getvalue().count(b"/Subtype /Image"), 3)
+        self.assertEqual(PdfFileReader(combined).numPages, 30)
+
+        # the logo is scaled to fit, centered in its box
+        field = filler.images[0][0]
+        self.assertEqual((field.x1, field.y1, field.width, field.height), (50, 642, 200, 100))
+        field = filler.images[2][1]
+        self.assertEqual((field.width, field.height), (100, 100))
+
+    def test_shared_template(self):
+        "every copy of a page draws the template's content from one Form XObject"
+        template = PdfTemplate(make_pdf(2))
+        out = BytesIO()
+        writer = SharedTemplateWriter(out, template)
+        for record in range(5):
+            filler = template.filler()
+            filler.add_text("Record {}".format(record), 1, (50, 50), (500, 100))
+            writer.add(filler)
+        self.assertRaises(ValueError, writer.add, PdfFormFiller(make_pdf(3)))
+        writer.close()
+        reader = PdfFileReader(out)
+        self.assertEqual(reader.getNumPages(), 10)
+        self.assertEqual(out.getvalue().count(b"/Subtype /Form"), 2)
+        for record in range(5):
+            self.assertTextCount(out, "Record {}".format(record), 1, pagenum=record * 2 + 1)
+        form = reader.getPage(3)["/Resources"]["/XObject"]["/Tpl"].getObject()
+        self.assertIn(b"Page 1", form.getData())
+
+    def test_backends(self):
+        "other pdf libraries can merge and write plain fills"
+        self.assertEqual(PdfFormFiller(self.pdf).backend, "pypdf2")
+        self.assertRaises(ValueError, PdfTemplate, make_pdf(1), backend="pdfbox")
+        for backend in ("pypdf", "pikepdf"):
+            if not installed(backend):
+                self.assertRaises(ImportError, PdfTemplate, make_pdf(1), backend=backend)
+                continue
+            template = PdfTemplate(make_pdf(3), backend=backend)
+            filler = template.filler(deterministic=True)
+            filler.add_text("Joe Smith", 1, (50, 50), (500, 100))
+            outputs = []
+            for i in range(2):
+                out = BytesIO()
+                filler.write(out, pages=[1, 2])
+                outputs.append(out.getvalue())
+            self.assertEqual(outputs[0], outputs[1])
+            reader = PdfFileReader(BytesIO(outputs[0]))
+            self.assertEqual(reader.getNumPages(), 2)
+            # pikepdf draws the overlay as a Form XObject
+            page = reader.getPage(0)
+            contents = page.getContents()
+            if not isinstance(contents, ArrayObject):
+                contents = [contents]
+            contents.extend(page["/Resources"].get("/XObject", {}).values())
+            content = b"\n".join(c.getObject().getData() for c in contents)
+            self.assertIn(b"Joe Smith", content.replace(b"\\040", b" "))
+            # the template is only parsed by PyPDF2 for features that need it
+            self.assertIsNone(template._pages)
+            self.assertRaises(ValueError, filler.write, BytesIO(), incremental=True)
+            self.assertRaises(ValueError, template.filler, engine="direct")
+
+    def assertBackendOutput(self, backend):
+        "Check the pages, text and document ID a backend writes"
+        template = PdfTemplate(make_pdf(3), backend=backend)
+        filler = template.filler(deterministic=True)
+        filler.add_text("Joe Smith", 1, (50, 50), (500, 100))
+        out = BytesIO()
+        filler.write(out, pages=[1, 2])
+        other = BytesIO()
+        template.filler(deterministic=True).write(other, pages=[1, 2])
+        reader = PdfFileReader(out)
+        self.assertEqual(reader.getNumPages(), 2)
+        self.assertIn("Page 1", reader.getPage(0).extractText())
+        self.assertIn("Page 2", reader.getPage(1).extractText())
+        page = reader.getPage(0)
+        contents = page.getContents()
+        if not isinstance(contents, ArrayObject):
+            contents = [contents]
+        contents.extend(page["/Resources"].get("/XObject", {}).values())
+        content = b"\n".join(c.getObject().getData() for c in contents)
+        self.assertIn(b"Joe Smith", content.replace(b"\\040", b" "))
+        ids = [reader.trailer["/ID"], PdfFileReader(other).trailer["/ID"]]
+        for documentId in ids:
+            self.assertEqual(len(documentId), 2)
+            self.assertEqual(len(documentId[0]), 16)
+        # different fills get different IDs
+        self.assertNotEqual(ids[0][0], ids[1][0])
+        self.assertNotEqual(ids[0][1], ids[1][1])
+        return ids[0]
+
+    @unittest.skipUnless(installed("pypdf"), "pypdf isn't installed")
+    def test_pypdf_backend(self):
+        "the pypdf backend writes the selected pages and the fill's document ID"
+        documentId = self.assertBackendOutput("pypdf")
+        self.assertEqual(documentId[0], documentId[1])
+
+    @unittest.skipUnless(installed("pikepdf"), "pikepdf isn't installed")
+    def test_pikepdf_backend(self):
+        "the pikepdf backend writes the selected pages and the fill's document ID"
+        self.assertBackendOutput("pikepdf")
+        # qpdf has one zlib level for every compressed write
+        template = PdfTemplate(make_pdf(3), backend="pikepdf")
+        outputs = {}
+        for compression in ("none", "fast", "max"):
+            filler = template.filler(deterministic=True, compression=compression)
+            filler.add_text("Joe Smith", 1, (50, 50), (500, 100))
+            out = BytesIO()
+            filler.write(out)
+            outputs[compression] = len(out.getvalue())
+        self.assertEqual(outputs["fast"], outputs["max"])
+        self.assertLess(outputs["max"], outputs["none"])
+
+    def test_fonts(self):
+        "every overlay embeds the same TrueType subset, which is written once"
+        vera = os.path.join(os.path.dirname(reportlab.__file__), "fonts", "Vera.ttf")
+        self.assertIs(register_font("Vera", vera), register_font("Vera", vera))
+        style = ParagraphStyle("vera", fontName="Vera", fontSize=12, leading=14)
+        template = PdfTemplate(make_pdf(3))
+        names = [u"J\xfcrgen", u"Fran\xe7oise", u"Ren\xe9e"]
+        filler = template.filler(fonts={"Vera": vera}, style=style, overlay="page")
+        for pagenum, name in enumerate(names):
+            filler.add_text(name, pagenum, (50, 50), (500, 100))
+        out = BytesIO()
+        filler.write(out)
+        self.assertEqual(out.getvalue().count(b"/FontFile2"), 1)
+        reader = PdfFileReader(out)
+        fonts = set()
+        for pagenum in range(3):
+            resources = reader.getPage(pagenum)["/Resources"]["/Font"]
+            fonts.update(resources.raw_get(name).idnum for name in resources if "+" in name)
+        self.assertEqual(len(fonts), 1)
+
+        subsets = FontSubsets()
+        fillers = []
+        for name in names:
+            filler = template.filler(style=style, subsets=subsets)
+            filler.add_text(name, 0, (50, 50), (500, 100))
+            subsets.add_filler(filler)
+            fillers.append(filler)
+        self.assertEqual(subsets.key(), (("Vera", u"J\xfcrgenFa\xe7oisR\xe9"),))
+        out = BytesIO()
+        writer = SharedTemplateWriter(out, template)
+        for filler in fillers:
+            writer.add(filler)
+        writer.close()
+        self.assertEqual(out.getvalue().count(b"/FontFile2"), 1)
+        self.assertFalse(subsets.add("Times-Roman", u"\xe9"))
+
+    def test_streaming(self):
+        "pdfs can be filled out and written one page at a time"
+        template = PdfTemplate(make_pdf(20), preload=False)
+        filler = template.filler(deterministic=True)
+        for pagenum in range(20):
+            filler.add_text("Joe Smith {}".format(pagenum), pagenum, (50, 50), (500, 100))
+        filler.add_image(make_image(), 5, (50, 200), (250, 300))
+        filler.write(self.out, streaming=True)
+        pdf = PdfFileReader(self.out)
+        self.assertEqual(pdf.numPages, 20)
+        self.assertTextCount(self.out, "Joe Smith 19", 1, pagenum=19)
+        self.assertTextCount(self.out, "Page 19", 1, pagenum=19)
+        self.assertTextCount(self.out, "Do", 1, pagenum=5)
+        # the objects parsed for each page were dropped after writing it
+        self.assertLess(len(template.pdf.resolvedObjects), 30)
+
+        # the fields are only looked through for fonts once per write
+        class CountingSubsets(FontSubsets):
+            calls = 0
+            def add_filler(self, filler):
+                CountingSubsets.calls += 1
+                FontSubsets.add_filler(self, filler)
+        filler.subsets = CountingSubsets()
+        filler.write(BytesIO(), streaming=True)
+        self.assertEqual(CountingSubsets.calls, 1)
+
+        out = BytesIO()
+        filler.write(out, streaming=True, pages=[7, 3])
+        self.assertTextCount(out, "Joe Smith 7", 1)
+        self.assertTextCount(out, "Joe Smith 3", 1, pagenum=1)
+        self.assertRaises(ValueError, filler.write, out, streaming=True, incremental=True)
+
+        # repeated pages are written as separate copies, like without streaming
+        outputs = []
+        for streaming in (False, True):
+            out = BytesIO()
+            filler.write(out, streaming=streaming, pages=[3, 3, 7])
+            pdf = PdfFileReader(out)
+            kids = pdf.trailer["/Root"]["/Pages"]["/Kids"]
+            self.assertEqual(len(set(kid.idnum for kid in kids)), 3)
+            outputs.append([pdf.getPage(n).extractText() for n in range(pdf.numPages)])
+            for pagenum, text in enumerate(["Joe Smith 3", "Joe Smith 3", "Joe Smith 7"]):
+                self.assertTextCount(out, text, 1, pagenum=pagenum)
+        self.assertEqual(outputs[0], outputs[1])
+
+        filler = PdfFormFiller(make_form())
+        filler.set_field("name", "Joe Smith")
+        filler.set_field("agree", True)
+        out = BytesIO()
+        filler.write(out, streaming=True)
+        fields = PdfFileReader(out).getFields()
+        self.assertEqual(fields["name"]["/V"], "Joe Smith")
+        self.assertEqual(fields["agree"]["/V"], "/Yes")
+
+    def test_cache(self):
+        "repeated fills are served from the cache"
+        template = PdfTemplate(BytesIO(hello_world_pdf))
+        disk = DiskCache(mkdtemp(), maxBytes=2500)
+        cache = LayeredCache(MemoryCache(), disk)
+        stats = FillStats()
+        outputs = []
+        for name in ("Joe Smith", "Joe Smith", "Jane Doe"):
+            filler = template.filler(cache=cache, stats=stats)
+            filler.add_text(name, 0, (50, 50), (500, 100))
+            out = BytesIO()
+            filler.write(out)
+            outputs.append(out.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertNotEqual(outputs[0], outputs[2])
+        self.assertEqual((stats.counts["cacheHits"], stats.counts["cacheMisses"]), (1, 2))
+        self.assertEqual(stats.calls["layout"], 2)
+
+        # the disk cache only has room for one of them
+        names = os.listdir(disk.directory)
+        self.assertEqual(len(names), 1)
+        self.assertEqual(disk.get(names[0][:-4]), outputs[2])
+
+        # putting the same pdf again doesn't count it twice
+        disk = DiskCache(mkdtemp(), maxBytes=3 * len(outputs[0]))
+        for i in range(5):
+            disk.put("joe", outputs[0])
+        disk.put("jane", outputs[2])
+        self.assertEqual(disk.size, len(outputs[0]) + len(outputs[2]))
+        self.assertEqual(disk.get("joe"), outputs[0])
+
+
+example_layout = u"""{
+    "styles": {"small": {"fontName": "Helvetica", "fontSize": 8, "leading": 10}},
+    "fields": [
+        {"name": "name", "page": 0, "box": [[50, 50], [500, 100]]},
+        {"name": "ssn", "page": 0, "box": [[50, 120], [300, 140]],
+         "style": "small", "padding": [2, 2, 2, 2]}
+    ]
+}"""
 
 # Hello World example pdf
 hello_world_pdf = b64decode("""\